@@ -0,0 +1,123 @@
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Hashable, Iterable, Optional
+
+# ── Limits ─────────────────────────────────────────────────────────────────────
+# Firmware posts every 5 s; the defaults leave room for retries and bursts
+# after reconnects without letting one device flood the API.
+DEVICE_RATE   = float(os.getenv("INGEST_DEVICE_RATE", 1))     # tokens / second
+DEVICE_BURST  = float(os.getenv("INGEST_DEVICE_BURST", 10))
+HOUSE_RATE    = float(os.getenv("INGEST_HOUSE_RATE", 20))
+HOUSE_BURST   = float(os.getenv("INGEST_HOUSE_BURST", 100))
+MAX_INFLIGHT  = int(os.getenv("INGEST_MAX_INFLIGHT", 32))     # concurrent ingests per worker
+SHED_RETRY_AFTER = 1
+
+class TokenBucketLimiter:
+    """
+    Token bucket per key, refilled lazily on access: O(1) time per request
+    and bounded memory (least recently seen keys are evicted).
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int = 100_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[Hashable, list]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def acquire(self, key: Hashable, now: Optional[float] = None) -> float:
+        """Take one token. Returns 0 if admitted, else seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is None:
+                b = self._buckets[key] = [self.burst, now]
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                b[0] = min(self.burst, b[0] + (now - b[1]) * self.rate)
+                b[1] = now
+                self._buckets.move_to_end(key)
+            if b[0] >= 1:
+                b[0] -= 1
+                return 0.0
+            return (1 - b[0]) / self.rate if self.rate > 0 else float("inf")
+
+    def refund(self, key: Hashable):
+        """Give back a token taken by a request that was rejected elsewhere."""
+        with self._lock:
+            b = self._buckets.get(key)
+            if b is not None:
+                b[0] = min(self.burst, b[0] + 1)
+
+class InflightGauge:
+    """Counts concurrent ingest requests; refuses entry past `limit`."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.current = 0
+        self._lock = threading.Lock()
+
+    def try_enter(self) -> bool:
+        with self._lock:
+            if self.current >= self.limit:
+                return False
+            self.current += 1
+            return True
+
+    def leave(self):
+        with self._lock:
+            self.current -= 1
+
+DEVICE_LIMITER = TokenBucketLimiter(DEVICE_RATE, DEVICE_BURST)
+HOUSE_LIMITER  = TokenBucketLimiter(HOUSE_RATE, HOUSE_BURST)
+INFLIGHT       = InflightGauge(MAX_INFLIGHT)
+
+COUNTERS = {"admitted": 0, "rate_limited": 0, "shed": 0}
+
+# ── Checks ─────────────────────────────────────────────────────────────────────
+def pool_saturated(engine) -> bool:
+    """True when every pooled connection (including overflow) is checked out."""
+    pool = engine.pool
+    try:
+        size, checked_out = pool.size(), pool.checkedout()
+        max_overflow = getattr(pool, "_max_overflow", 0)
+    except AttributeError:  # pools without a fixed size (NullPool, StaticPool)
+        return False
+    return max_overflow >= 0 and checked_out >= size + max_overflow
+
+def admit(house_id: int, device_ids: Iterable[Hashable]) -> int:
+    """
+    Charge one token to the house and to every device.
+    Returns 0 if admitted, else the Retry-After in whole seconds; on
+    rejection every token taken by this call is refunded.
+    """
+    taken = []
+    wait = 0.0
+    for limiter, key in [(DEVICE_LIMITER, d) for d in device_ids] + [(HOUSE_LIMITER, house_id)]:
+        w = limiter.acquire(key)
+        if w:
+            wait = max(wait, w)
+            break
+        taken.append((limiter, key))
+    if wait:
+        for limiter, key in taken:
+            limiter.refund(key)
+        COUNTERS["rate_limited"] += 1
+        return max(1, math.ceil(wait))
+    COUNTERS["admitted"] += 1
+    return 0
+
+def status() -> dict:
+    return {
+        "inflight": INFLIGHT.current,
+        "max_inflight": INFLIGHT.limit,
+        "device_rate": DEVICE_RATE,
+        "device_burst": DEVICE_BURST,
+        "house_rate": HOUSE_RATE,
+        "house_burst": HOUSE_BURST,
+        **COUNTERS,
+    }
@@ -0,0 +1,228 @@
+import time
+from dataclasses import dataclass, field
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import select
+
+from . import ml_model
+
+# Offline replay of stored or imported readings through the same feature
+# engineering (ml_model.clean_and_engineer) and decision code
+# (ml_model.predict_off) as the ingest endpoints, a whole chunk at a time.
+#
+#   python -m app.backtest --house 3 --candidate-models new_models/
+#   python -m app.backtest --file refit_house3.csv --candidate-thresholds t.json
+
+CHUNK_ROWS = 500_000
+
+# ── Configurations ─────────────────────────────────────────────────────────────
+@dataclass
+class Config:
+    """One set of models + thresholds to replay."""
+    name: str
+    models: Dict[str, Any]
+    thresholds: Dict[str, float]
+
+def load_config(name: str, models_dir: Path, thresholds_file: Path) -> Config:
+    return Config(name, ml_model.load_models(models_dir), ml_model.load_thresholds(thresholds_file))
+
+# ── Sources ────────────────────────────────────────────────────────────────────
+# Each yields wide frames: Time, Appliance1..9 and, when the source has it,
+# Aggregate (one row per instant).
+def file_chunks(path: Path, chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """CSV export (REFIT layout: Time/timestamp, Aggregate, Appliance1..9)."""
+    yield from pd.read_csv(path, chunksize=chunk_rows)
+
+def house_devices(house_id: int) -> List[Tuple[str, str, bool, bool]]:
+    """(device_id, appliance, sends email, auto-off) for a house's active devices."""
+    from .database import SessionLocal
+    from . import models
+
+    with SessionLocal() as db:
+        return [
+            (d.id, d.appliance, bool(d.recommend_only and d.email), bool(d.auto_off))
+            for d in db.query(models.Device).filter(
+                models.Device.house_id == house_id,
+                models.Device.deleted_at.is_(None)
+            )
+        ]
+
+def house_chunks(house_id: int, chunk_rows: int = CHUNK_ROWS,
+                 since: Optional[datetime] = None,
+                 until: Optional[datetime] = None) -> Iterator[pd.DataFrame]:
+    """
+    Stream a house's stored readings in timestamp order from its shard and
+    pivot them to one row per timestamp. Readings keep no aggregate, so
+    the frames have no Aggregate column and the replay falls back to the
+    sum of the channels.
+    """
+    from .database import router
+    from . import models
+
+    channel = {did: appl for did, appl, _, _ in house_devices(house_id)}
+    if not channel:
+        return
+    R = models.Reading
+    stmt = select(R.ts, R.device_id, R.watts).where(R.device_id.in_(channel))
+    if since:
+        stmt = stmt.where(R.ts >= since)
+    if until:
+        stmt = stmt.where(R.ts < until)
+    stmt = stmt.order_by(R.ts)
+
+    carry = None
+    with router.engine_for(house_id).connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_rows).execute(stmt)
+        for rows in result.partitions():
+            long = pd.DataFrame.from_records(rows, columns=["Time", "device_id", "watts"])
+            if carry is not None:
+                long = pd.concat([carry, long], ignore_index=True)
+            # The last instant may continue in the next partition
+            last = long["Time"].iloc[-1]
+            carry = long[long["Time"] == last]
+            long = long[long["Time"] != last]
+            if len(long):
+                yield _pivot(long, channel)
+    if carry is not None and len(carry):
+        yield _pivot(carry, channel)
+
+def _pivot(long: pd.DataFrame, channel: Dict[str, str]) -> pd.DataFrame:
+    long = long.assign(appliance=long["device_id"].map(channel))
+    # Devices sharing a channel receive the same value from bulk ingest
+    wide = long.pivot_table(index="Time", columns="appliance", values="watts", aggfunc="max")
+    wide = wide.reindex(columns=ml_model.APPLIANCE_COLS).fillna(0.0)
+    return wide.reset_index()
+
+# ── Replay ─────────────────────────────────────────────────────────────────────
+@dataclass
+class Tally:
+    rows: int = 0
+    offs: int = 0
+    flips: int = 0
+    agree: int = 0            # rows where this config matches the baseline
+    last: Optional[bool] = field(default=None, repr=False)
+
+class Backtest:
+    """
+    Feeds chunks through every config and tallies, per appliance: OFF
+    decisions, flips (decision changes between consecutive rows),
+    agreement with the first (baseline) config and the alert volume the
+    API would have produced for the house's devices.
+    """
+
+    def __init__(self, configs: List[Config], devices: List[Tuple[str, str, bool, bool]]):
+        self.configs = configs
+        self.tallies = {c.name: {a: Tally() for a in ml_model.APPLIANCE_COLS} for c in configs}
+        # Per channel: devices that get an email per reading / relay auto-off on OFF
+        self.emailed = {a: sum(1 for _, ap, e, _ in devices if ap == a and e) for a in ml_model.APPLIANCE_COLS}
+        self.auto_off = {a: sum(1 for _, ap, _, o in devices if ap == a and o) for a in ml_model.APPLIANCE_COLS}
+        self.rows = 0
+        self.seconds = 0.0
+
+    def feed(self, chunk: pd.DataFrame):
+        t0 = time.perf_counter()
+        for appl in ml_model.APPLIANCE_COLS:
+            if appl not in chunk:
+                chunk[appl] = 0.0
+        chunk[ml_model.APPLIANCE_COLS] = chunk[ml_model.APPLIANCE_COLS].fillna(0.0)
+        # The metered aggregate also covers unmonitored loads; the sum of the
+        # channels only stands in where the source has none
+        channels = chunk[ml_model.APPLIANCE_COLS].sum(axis=1)
+        chunk["Aggregate"] = chunk["Aggregate"].fillna(channels) if "Aggregate" in chunk else channels
+        feat = ml_model.clean_and_engineer(chunk)
+
+        baseline = None
+        for config in self.configs:
+            off = ml_model.predict_off(feat, config.models, config.thresholds)
+            if baseline is None:
+                baseline = off
+            for appl, d in off.items():
+                t = self.tallies[config.name][appl]
+                t.rows += len(d)
+                t.offs += int(np.count_nonzero(d))
+                t.flips += int(np.count_nonzero(d[1:] != d[:-1]))
+                if t.last is not None and len(d):
+                    t.flips += int(d[0] != t.last)
+                t.last = bool(d[-1]) if len(d) else t.last
+                t.agree += int(np.count_nonzero(d == baseline[appl]))
+        self.rows += len(feat)
+        self.seconds += time.perf_counter() - t0
+
+    def report(self) -> List[dict]:
+        out = []
+        for config in self.configs:
+            for appl, t in self.tallies[config.name].items():
+                out.append({
+                    "config": config.name,
+                    "appliance": appl,
+                    "rows": t.rows,
+                    "off_share": t.offs / t.rows if t.rows else 0.0,
+                    "flips_per_1k": 1000 * t.flips / t.rows if t.rows else 0.0,
+                    "agreement": t.agree / t.rows if t.rows else 0.0,
+                    "emails": t.rows * self.emailed[appl],
+                    "auto_offs": t.offs * self.auto_off[appl],
+                })
+        return out
+
+    @property
+    def rows_per_minute(self) -> float:
+        return 60 * self.rows / self.seconds if self.seconds else 0.0
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Replay readings through models/thresholds offline")
+    src = parser.add_mutually_exclusive_group(required=True)
+    src.add_argument("--house", type=int,
+                     help="stored readings of this house (no meter aggregate is stored, "
+                          "so Aggregate is the sum of the channels)")
+    src.add_argument("--file", type=Path,
+                     help="CSV with Time, Aggregate, Appliance1..9 (rows without "
+                          "Aggregate fall back to the sum of the channels)")
+    parser.add_argument("--since", type=datetime.fromisoformat)
+    parser.add_argument("--until", type=datetime.fromisoformat)
+    parser.add_argument("--models-dir", type=Path, default=ml_model.MODELS_DIR)
+    parser.add_argument("--thresholds", type=Path, default=ml_model.THRESH_FILE)
+    parser.add_argument("--candidate-models", type=Path, help="compare against these models")
+    parser.add_argument("--candidate-thresholds", type=Path, help="compare against these thresholds")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS)
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    configs = [load_config("baseline", args.models_dir, args.thresholds)]
+    if args.candidate_models or args.candidate_thresholds:
+        configs.append(load_config(
+            "candidate",
+            args.candidate_models or args.models_dir,
+            args.candidate_thresholds or args.thresholds
+        ))
+
+    if args.house is not None:
+        devices = house_devices(args.house)
+        chunks = house_chunks(args.house, args.chunk_rows, args.since, args.until)
+    else:
+        # An import file has no devices: assume one per channel, alerting and auto-off
+        devices = [(a, a, True, True) for a in ml_model.APPLIANCE_COLS]
+        chunks = file_chunks(args.file, args.chunk_rows)
+
+    bt = Backtest(configs, devices)
+    t0 = time.perf_counter()
+    for chunk in chunks:
+        bt.feed(chunk)
+    wall = time.perf_counter() - t0
+    report = bt.report()
+
+    if args.json:
+        print(json.dumps({"rows": bt.rows, "seconds": wall, "results": report}, indent=2))
+    else:
+        print(f"{'config':<10} {'appliance':<11} {'off %':>7} {'flips/1k':>9} {'agree %':>8} {'emails':>9} {'auto-offs':>10}")
+        for r in report:
+            print(f"{r['config']:<10} {r['appliance']:<11} {100 * r['off_share']:>7.2f} "
+                  f"{r['flips_per_1k']:>9.2f} {100 * r['agreement']:>8.2f} {r['emails']:>9} {r['auto_offs']:>10}")
+        print(f"{bt.rows} rows in {wall:.1f}s ({60 * bt.rows / wall if wall else 0:,.0f} rows/min end to end, "
+              f"{bt.rows_per_minute:,.0f} rows/min replay)")
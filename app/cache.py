@@ -0,0 +1,187 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, Hashable, Iterable, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from . import database, models
+
+# ── Version counters ───────────────────────────────────────────────────────────
+# crud write functions bump the counters of what they touch, e.g.
+#   ("owner", owner_id)       device added to / removed from an owner
+#   ("device", device_id)     device row changed or deleted
+#   ("schedules", device_id)  schedule created / edited / deleted
+#   ("readings", device_id)   history moved between shards
+# New readings bump nothing: responses built from them expire on WINDOW_TTL.
+# A cached response records the versions it was built from and is treated
+# as stale as soon as any of them moves. Bumps are written to the
+# cache_versions table on the primary; each worker keeps the counters in
+# memory and polls the rows bumped since its last look at most every
+# VERSION_TTL seconds, so a 304 normally runs no query and a write on one
+# worker reaches the others within VERSION_TTL.
+VERSION_TTL = float(os.getenv("CACHE_VERSION_TTL", 1))
+CLOCK_SKEW  = 5.0   # seconds a poll reaches back, for late commits and worker clocks
+
+_table = models.CacheVersion.__table__
+_lock = threading.Lock()
+_sync_lock = threading.Lock()
+_versions: Dict[str, int] = {}
+_synced_at: Optional[float] = None      # monotonic time of the last poll
+_polled_from: Optional[datetime] = None  # wall-clock start of the last poll
+
+def _name(key: Hashable) -> str:
+    return ":".join(map(str, key)) if isinstance(key, tuple) else str(key)
+
+def _increment(dialect: str):
+    if dialect in ("mysql", "mariadb"):
+        stmt = mysql.insert(_table)
+        return stmt.on_duplicate_key_update(version=_table.c.version + 1,
+                                            updated_at=stmt.inserted.updated_at)
+    if dialect in ("postgresql", "sqlite"):
+        stmt = (postgresql if dialect == "postgresql" else sqlite).insert(_table)
+        return stmt.on_conflict_do_update(
+            index_elements=["key"],
+            set_={"version": _table.c.version + 1, "updated_at": stmt.excluded.updated_at},
+        )
+    raise NotImplementedError(f"cache versions are not implemented for {dialect}")
+
+def _merge(rows):
+    with _lock:
+        for name, version in rows:
+            # Counters only grow; never let an older read win
+            if version > _versions.get(name, 0):
+                _versions[name] = version
+
+def bump(*keys: Hashable):
+    """
+    Invalidate every cached response that depends on any of `keys`: at
+    once in this worker, within VERSION_TTL in the others. Call after the
+    write commits.
+    """
+    # Sorted, so concurrent bumps lock the rows in the same order
+    names = sorted({_name(k) for k in keys})
+    if not names:
+        return
+    now = datetime.utcnow()
+    with database.engine.begin() as conn:
+        conn.execute(_increment(conn.dialect.name),
+                     [{"key": n, "version": 1, "updated_at": now} for n in names])
+        rows = conn.execute(
+            select(_table.c.key, _table.c.version).where(_table.c.key.in_(names))
+        ).all()
+    _merge(rows)
+
+def sync(force: bool = False):
+    """
+    Pick up counters bumped by other workers. Polls at most every
+    VERSION_TTL seconds, and never blocks on a poll already running,
+    unless `force`.
+    """
+    global _synced_at, _polled_from
+    if not force and _synced_at is not None and time.monotonic() - _synced_at < VERSION_TTL:
+        return
+    if not _sync_lock.acquire(blocking=force):
+        return
+    try:
+        started = datetime.utcnow()
+        query = select(_table.c.key, _table.c.version)
+        if _polled_from is not None:
+            query = query.where(_table.c.updated_at >= _polled_from - timedelta(seconds=CLOCK_SKEW))
+        with database.engine.connect() as conn:
+            rows = conn.execute(query).all()
+        _merge(rows)
+        _polled_from, _synced_at = started, time.monotonic()
+    finally:
+        _sync_lock.release()
+
+def _current(deps: Tuple[Hashable, ...]) -> Tuple[int, ...]:
+    sync()
+    with _lock:
+        return tuple(_versions.get(_name(d), 0) for d in deps)
+
+# ── Response cache ─────────────────────────────────────────────────────────────
+DEFAULT_TTL = 60.0   # seconds; also drops entries of writes made outside crud
+WINDOW_TTL  = 10.0   # time-windowed results (energy-summary, stats)
+MAX_ENTRIES = 10_000
+
+@dataclass
+class CachedResponse:
+    etag: str
+    body: bytes
+    deps: Tuple[Hashable, ...]
+    versions: Tuple[int, ...]
+    expires: float
+
+_entries: "OrderedDict[Hashable, CachedResponse]" = OrderedDict()
+
+def get(key: Hashable) -> Optional[CachedResponse]:
+    """
+    Return a fresh cached response for `key`, or None. Compares the entry's
+    versions with the in-memory counters instead of running the endpoint's
+    queries.
+    """
+    with _lock:
+        entry = _entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires < time.monotonic():
+            del _entries[key]
+            return None
+    fresh = entry.versions == _current(entry.deps)
+    with _lock:
+        if not fresh:
+            if _entries.get(key) is entry:
+                del _entries[key]
+            return None
+        if key in _entries:
+            _entries.move_to_end(key)
+        return entry
+
+def snapshot(deps: Iterable[Hashable]) -> Tuple[int, ...]:
+    """
+    Versions of `deps` right now. Take this *before* reading the data so a
+    write that lands mid-read leaves the entry already stale.
+    """
+    return _current(tuple(deps))
+
+def put(key: Hashable, deps: Iterable[Hashable], versions: Tuple[int, ...],
+        body: bytes, ttl: float = DEFAULT_TTL) -> CachedResponse:
+    """Store a serialized response built from `versions` of `deps`."""
+    deps = tuple(deps)
+    # Body and shared versions only: every worker derives the same ETag
+    digest = hashlib.blake2b(repr(versions).encode() + body, digest_size=12)
+    with _lock:
+        entry = CachedResponse(
+            etag=f'W/"{digest.hexdigest()}"',
+            body=body,
+            deps=deps,
+            versions=versions,
+            expires=time.monotonic() + ttl,
+        )
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+        return entry
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """RFC 7232 weak comparison of an If-None-Match header against `etag`."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    strip = lambda t: t.strip().removeprefix("W/")
+    return strip(etag) in {strip(t) for t in if_none_match.split(",")}
+
+def clear():
+    global _synced_at, _polled_from
+    with _lock:
+        _entries.clear()
+        _versions.clear()
+        _synced_at = _polled_from = None
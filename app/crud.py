@@ -1,10 +1,11 @@
 from uuid import uuid4
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from . import models, schemas
-from typing import List
+from sqlalchemy import func, case, and_, select
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+from . import models, schemas, scheduler, cache, database, retention, sketches, device_keys
+from typing import Iterable, List, Tuple
 from passlib.hash import bcrypt
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 # -------- Users --------
 
@@ -57,143 +58,392 @@ def create_device(db: Session, data: schemas.DeviceCreate, owner_id: int):
     db.add(device)
     db.commit()
     db.refresh(device)
+    cache.bump(("owner", owner_id))
     return device
 
+# Devices marked deleted stay in the table until the purge job has removed
+# their readings; every read filters them out.
+_active_device = models.Device.deleted_at.is_(None)
+
 def list_devices(db: Session, owner_id: int):
     """
     List all devices belonging to a given owner.
     """
-    return db.query(models.Device).filter(models.Device.owner_id == owner_id).all()
+    return db.query(models.Device).filter(models.Device.owner_id == owner_id, _active_device).all()
 
 def get_device(db: Session, device_id: str):
     """Retrieve a device by its ID"""
-    return db.get(models.Device, device_id)
+    device = db.get(models.Device, device_id)
+    return device if device is not None and device.deleted_at is None else None
 
 def update_device(db: Session, device_id: str, data: schemas.DeviceUpdate):
-    """Update device fields selectively"""
+    """
+    Update device fields selectively. A new house only records a move;
+    the moves job carries the readings to its shard in the background.
+    """
+    device = db.get(models.Device, device_id)
+    owner_id = device.owner_id if device else None
+    old_house = device.house_id if device else None
     db.query(models.Device) \
       .filter(models.Device.id == device_id) \
       .update(data.dict(exclude_none=True))
+    # Readings follow the device to the shard of its new house
+    if old_house is not None and data.house_id is not None and data.house_id != old_house \
+            and database.router.engine_for(old_house) is not database.router.engine_for(data.house_id):
+        db.add(models.DeviceMove(device_id=device_id, from_house=old_house,
+                                 to_house=data.house_id, created_at=datetime.utcnow()))
     db.commit()
+    cache.bump(("device", device_id), ("owner", owner_id), ("readings", device_id))
 
 def delete_device(db: Session, device_id: str):
-    """Delete a device and its related readings"""
-    db.query(models.Reading) \
-      .filter(models.Reading.device_id == device_id) \
-      .delete()
-    db.query(models.Device) \
-      .filter(models.Device.id == device_id) \
+    """
+    Mark a device deleted (hidden from every read) and drop its schedules.
+    Once purge.grace() has passed, the purge job removes its readings in
+    batches, then the row itself.
+    """
+    device = get_device(db, device_id)
+    if device is None:
+        return
+    owner_id = device.owner_id
+    device.deleted_at = datetime.utcnow()
+    # Query delete: the ORM cascade on Device.schedules doesn't run here
+    db.query(models.DeviceSchedule) \
+      .filter(models.DeviceSchedule.device_id == device_id) \
       .delete()
+    key_ids = _revoke_device_keys(db, device_id, device.deleted_at)
+    db.commit()
+    device_keys.CACHE.forget(*key_ids)
+    scheduler.SCHEDULER.remove_device(device_id)
+    sketches.STORE.forget(device_id)
+    cache.bump(("device", device_id), ("owner", owner_id),
+               ("schedules", device_id), ("readings", device_id))
+
+# -------- Device API Keys --------
+
+def create_device_key(db: Session, device_id: str) -> Tuple[models.DeviceKey, str]:
+    """
+    Issue a key for a device. Returns the row and the full key, which is
+    not stored and cannot be shown again.
+    """
+    key_id, key = device_keys.generate()
+    row = models.DeviceKey(
+        id=key_id,
+        device_id=device_id,
+        digest=device_keys.digest(key),
+        created_at=datetime.utcnow()
+    )
+    db.add(row)
     db.commit()
+    db.refresh(row)
+    device_keys.CACHE.forget(key_id)
+    return row, key
+
+def list_device_keys(db: Session, device_id: str):
+    """All keys of a device, revoked ones included, newest first."""
+    return db.query(models.DeviceKey) \
+             .filter(models.DeviceKey.device_id == device_id) \
+             .order_by(models.DeviceKey.created_at.desc()) \
+             .all()
+
+def revoke_device_key(db: Session, device_id: str, key_id: str) -> bool:
+    """Revoke one key of a device; False if the device has no such live key."""
+    revoked = db.query(models.DeviceKey) \
+                .filter(
+                    models.DeviceKey.id == key_id,
+                    models.DeviceKey.device_id == device_id,
+                    models.DeviceKey.revoked_at.is_(None)
+                ).update({"revoked_at": datetime.utcnow()})
+    db.commit()
+    device_keys.CACHE.forget(key_id)
+    return bool(revoked)
+
+def _revoke_device_keys(db: Session, device_id: str, when: datetime) -> List[str]:
+    key_ids = [
+        kid for (kid,) in db.query(models.DeviceKey.id).filter(
+            models.DeviceKey.device_id == device_id,
+            models.DeviceKey.revoked_at.is_(None)
+        )
+    ]
+    if key_ids:
+        db.query(models.DeviceKey) \
+          .filter(models.DeviceKey.id.in_(key_ids)) \
+          .update({"revoked_at": when}, synchronize_session=False)
+    return key_ids
 
 # -------- Device Schedules --------
 
+def _schedule_out(s: models.DeviceSchedule) -> schemas.ScheduleOut:
+    return schemas.ScheduleOut(
+        id=s.id,
+        device_id=s.device_id,
+        start_time=s.start_time,
+        end_time=s.end_time,
+        days=scheduler.mask_to_days(s.days_mask),
+        send_email_reminder=s.send_email_reminder
+    )
+
+def _arm_schedule(s: models.DeviceSchedule):
+    """Push the committed schedule into the in-process schedule engine."""
+    scheduler.SCHEDULER.upsert(
+        s.id, s.device_id, s.start_time, s.end_time,
+        s.days_mask, s.send_email_reminder
+    )
+
 def create_schedule(db: Session, data: schemas.ScheduleCreate) -> schemas.ScheduleOut:
     """
     Create a new schedule and return a ScheduleOut (with days as List[str]).
     """
-    # column 'start_time' و 'end_time' مُعرّفين كـ Time في الموديل، فلا حاجة لتحويلهم إلى str
-    days_str = ",".join([d.value for d in data.days])
-
     schedule = models.DeviceSchedule(
-        device_id=data.device_id,
+        device_id=str(data.device_id),
         start_time=data.start_time,
         end_time=data.end_time,
-        days=days_str,
+        days_mask=scheduler.days_to_mask(data.days),
         send_email_reminder=data.send_email_reminder
     )
     db.add(schedule)
     db.commit()
     db.refresh(schedule)
-
-    # هنا نحوّل days_str إلى قائمة قبل الإرجاع
-    return schemas.ScheduleOut(
-        id=schedule.id,
-        device_id=schedule.device_id,
-        start_time=schedule.start_time,
-        end_time=schedule.end_time,
-        days=schedule.days.split(","),
-        send_email_reminder=schedule.send_email_reminder
-    )
+    _arm_schedule(schedule)
+    cache.bump(("schedules", schedule.device_id))
+    return _schedule_out(schedule)
 
 
 def update_schedule(db: Session, schedule_id: int, data: schemas.ScheduleUpdate):
-    days_str = ",".join([d.value for d in data.days])
     db.query(models.DeviceSchedule) \
       .filter(models.DeviceSchedule.id == schedule_id) \
       .update({
           "start_time": data.start_time,
           "end_time": data.end_time,
-          "days": days_str,
+          "days_mask": scheduler.days_to_mask(data.days),
           "send_email_reminder": data.send_email_reminder
       })
     db.commit()
+    schedule = db.get(models.DeviceSchedule, schedule_id)
+    if schedule:
+        _arm_schedule(schedule)
+        cache.bump(("schedules", schedule.device_id))
+
+def get_schedule(db: Session, schedule_id: int):
+    return db.get(models.DeviceSchedule, schedule_id)
 
 def list_schedules_for_device(db: Session, device_id: str) -> List[schemas.ScheduleOut]:
     schedules = db.query(models.DeviceSchedule).filter(models.DeviceSchedule.device_id == device_id).all()
-    return [
-        schemas.ScheduleOut(
-            id=s.id,
-            device_id=s.device_id,
-            start_time=s.start_time,
-            end_time=s.end_time,
-            days=s.days.split(",") if s.days else [],
-            send_email_reminder=s.send_email_reminder
-        )
-        for s in schedules
-    ]
+    return [_schedule_out(s) for s in schedules]
 
-def delete_schedule(db: Session, schedule_id: int):
-    db.query(models.DeviceSchedule).filter(models.DeviceSchedule.id == schedule_id).delete()
+def list_all_schedules(db: Session) -> List[models.DeviceSchedule]:
+    """Every schedule row, used to seed the schedule engine at startup."""
+    return db.query(models.DeviceSchedule).all()
+
+def changed_schedules(db: Session, since: datetime) -> List[Tuple[str, datetime, List[models.DeviceSchedule]]]:
+    """
+    Devices whose schedules changed since `since` (UTC), going by their
+    ("schedules", device_id) cache counters, with the time of the change
+    and the schedules they have now. Reaches back cache.CLOCK_SKEW for
+    late commits; replaying a change is harmless.
+    """
+    V = models.CacheVersion
+    changed = {
+        key.split(":", 1)[1]: at for key, at in db.query(V.key, V.updated_at).filter(
+            V.key.like("schedules:%"),
+            V.updated_at >= since - timedelta(seconds=cache.CLOCK_SKEW)
+        )
+    }
+    if not changed:
+        return []
+    current = {}
+    for s in db.query(models.DeviceSchedule).filter(models.DeviceSchedule.device_id.in_(changed)):
+        current.setdefault(s.device_id, []).append(s)
+    return [(did, at, current.get(did, [])) for did, at in changed.items()]
+
+def delete_schedule(db: Session, schedule_id: int) -> bool:
+    """Delete a schedule; False if it does not exist."""
+    schedule = db.get(models.DeviceSchedule, schedule_id)
+    if schedule is None:
+        return False
+    device_id = schedule.device_id
+    db.delete(schedule)
     db.commit()
+    scheduler.SCHEDULER.remove(schedule_id)
+    cache.bump(("schedules", device_id))
+    return True
 
 # -------- Aggregated Consumption Stats --------
 
-def energy_summary(db: Session, device_id: str):
+def _totals(db: Session, device_ids: List[str]):
+    """
+    {device_id: [today, week, month, sum_watts, samples]} over raw readings
+    plus the rollups the retention job compacted them into.
+    One grouped query per table, whatever the number of devices.
+    """
     now = datetime.utcnow()
     start_of_day = datetime(now.year, now.month, now.day)
     last_week = now - timedelta(days=7)
     last_month = now - timedelta(days=30)
 
-    # اليوم
-    today_total = db.query(func.sum(models.Reading.watts)) \
-        .filter(
-            models.Reading.device_id == device_id,
-            models.Reading.ts >= start_of_day
-        ).scalar() or 0.0
-
-    # الأسبوع
-    week_total = db.query(func.sum(models.Reading.watts)) \
-        .filter(
-            models.Reading.device_id == device_id,
-            models.Reading.ts >= last_week
-        ).scalar() or 0.0
-
-    # الشهر
-    month_total = db.query(func.sum(models.Reading.watts)) \
-        .filter(
-            models.Reading.device_id == device_id,
-            models.Reading.ts >= last_month
-        ).scalar() or 0.0
+    R, U = models.Reading, models.ReadingRollup
+    out = {}
+    for model, ts, watts, samples in (
+        (R, R.ts, R.watts, func.count()),
+        (U, U.bucket_start, U.sum_watts, func.sum(U.samples)),
+    ):
+        rows = db.query(
+            model.device_id,
+            func.sum(case((ts >= start_of_day, watts), else_=0.0)),
+            func.sum(case((ts >= last_week, watts), else_=0.0)),
+            func.sum(case((ts >= last_month, watts), else_=0.0)),
+            func.sum(watts),
+            samples
+        ).filter(model.device_id.in_(device_ids)).group_by(model.device_id).all()
+        for did, *vals in rows:
+            acc = out.setdefault(did, [0.0, 0.0, 0.0, 0.0, 0])
+            for i, v in enumerate(vals):
+                acc[i] += v or 0
+    return out
 
+def energy_summary(db: Session, device_id: str):
+    today, week, month, _, _ = _totals(db, [device_id]).get(device_id, [0.0, 0.0, 0.0, 0.0, 0])
     return {
-        "today": round(today_total, 2),
-        "week": round(week_total, 2),
-        "month": round(month_total, 2)
+        "today": round(today, 2),
+        "week": round(week, 2),
+        "month": round(month, 2)
+    }
+
+# -------- House Dashboard --------
+
+STATUS_ON_WATTS = 10
+
+def device_state(watts: float) -> str:
+    """ON/OFF label for a single reading."""
+    return "ON" if watts >= STATUS_ON_WATTS else "OFF"
+
+def house_dashboard(db: Session, house_id: int, owner_id: int):
+    """
+    Status, energy totals and stats for every device an owner has in a house.
+
+    Uses four set-based queries (devices, latest reading per device,
+    grouped raw and rollup totals) no matter how many devices the house has.
+    """
+    devices = db.query(models.Device) \
+                .filter(
+                    models.Device.house_id == house_id,
+                    models.Device.owner_id == owner_id,
+                    _active_device
+                ).all()
+    if not devices:
+        return []
+    ids = [d.id for d in devices]
+
+    R = models.Reading
+    latest_ts = db.query(R.device_id, func.max(R.ts).label("ts")) \
+                  .filter(R.device_id.in_(ids)) \
+                  .group_by(R.device_id) \
+                  .subquery()
+    latest = {
+        row.device_id: row
+        for row in db.query(R.device_id, R.ts, R.watts)
+                     .join(latest_ts, and_(
+                         R.device_id == latest_ts.c.device_id,
+                         R.ts == latest_ts.c.ts
+                     )).all()
     }
 
+    totals = _totals(db, ids)
+
+    result = []
+    for d in devices:
+        last = latest.get(d.id)
+        today, week, month, total, cnt = totals.get(d.id, (0.0, 0.0, 0.0, 0.0, 0))
+        result.append({
+            **schemas.DeviceOut.model_validate(d, from_attributes=True).model_dump(),
+            "timestamp": last.ts if last else None,
+            "watts":     last.watts if last else None,
+            "status":    device_state(last.watts) if last else "UNKNOWN",
+            "summary": {
+                "today": round(today or 0.0, 2),
+                "week":  round(week or 0.0, 2),
+                "month": round(month or 0.0, 2)
+            },
+            "avg_watts": total / cnt if cnt else 0.0,
+            "total_readings": cnt or 0
+        })
+    return result
+
 # -------- Readings --------
 
-def add_reading(db: Session, did: str, rd: schemas.ReadingIn):
-    db.add(models.Reading(device_id=did, ts=rd.timestamp, watts=rd.watts))
+def _utc(ts: datetime) -> datetime:
+    """Naive UTC, the form readings are stored and compared in."""
+    return ts.astimezone(timezone.utc).replace(tzinfo=None) if ts.tzinfo else ts
+
+def _insert_new_readings(dialect: str):
+    """INSERT that skips rows whose (device_id, ts) is already stored."""
+    table = models.Reading.__table__
+    if dialect in ("mysql", "mariadb"):
+        # Setting a column to its own value leaves the stored row untouched
+        return mysql.insert(table).on_duplicate_key_update(watts=table.c.watts)
+    if dialect == "postgresql":
+        stmt = postgresql.insert(table)
+    elif dialect == "sqlite":
+        stmt = sqlite.insert(table)
+    else:
+        raise NotImplementedError(f"No idempotent readings insert for {dialect}")
+    return stmt.on_conflict_do_nothing(index_elements=["device_id", "ts"])
+
+def add_readings(db: Session, rows: Iterable[Tuple[str, datetime, float]]) -> int:
+    """
+    Store (device_id, ts, watts) samples with one bulk upsert on the
+    session's shard. Samples already stored for the same (device_id, ts)
+    are skipped by the database, so retries and overlapping uploads are
+    no-ops, and samples may arrive in any order. Only the samples that were
+    new are added to the device sketches. Returns how many were new.
+    """
+    horizon = retention.horizon()
+    batch = {}
+    for did, ts, watts in rows:
+        ts = _utc(ts)
+        # Older samples may already be folded into a rollup; storing them
+        # raw again would count them twice.
+        if horizon is not None and ts < horizon:
+            continue
+        batch.setdefault((str(did), ts), watts)   # first copy wins, as in the DB
+    if not batch:
+        return 0
+
+    # Key order gives index-ordered inserts and a consistent lock order
+    # between concurrent uploads touching the same devices.
+    values = [{"device_id": did, "ts": ts, "watts": w} for (did, ts), w in sorted(batch.items())]
+    conn = db.connection(bind_arguments={"mapper": models.Reading.__mapper__})
+    stmt = _insert_new_readings(conn.dialect.name)
+    R = models.Reading.__table__
+    if conn.dialect.insert_executemany_returning:
+        # ON CONFLICT DO NOTHING ... RETURNING yields only the inserted rows
+        new = conn.execute(stmt.returning(R.c.device_id, R.c.ts, R.c.watts), values).all()
+    else:
+        # MySQL has no RETURNING: look up which keys were already stored
+        # (two uploads racing on the same sample may both sketch it)
+        stored = set(conn.execute(
+            select(R.c.device_id, R.c.ts).where(
+                R.c.device_id.in_({did for did, _ in batch}),
+                R.c.ts.in_({ts for _, ts in batch})
+            )
+        ).all())
+        conn.execute(stmt, values)
+        new = [(v["device_id"], v["ts"], v["watts"]) for v in values
+               if (v["device_id"], v["ts"]) not in stored]
     db.commit()
+    if new:
+        sketches.STORE.record(conn.engine, new)
+    return len(new)
+
+def add_reading(db: Session, did: str, rd: schemas.ReadingIn) -> int:
+    return add_readings(db, [(did, rd.timestamp, rd.watts)])
 
 def stats(db: Session, did: str):
-    avg, cnt = db.query(
-        func.avg(models.Reading.watts),
-        func.count()
-    ).filter(models.Reading.device_id == did).one()
-    return {"avg_watts": avg or 0.0, "total_readings": cnt or 0}
+    """Average, count, percentiles and max from the device's sketch."""
+    return sketches.STORE.summary(db, did)
+
+def watt_percentiles(db: Session, device_ids: List[str], since: datetime = None):
+    """Percentiles across several devices (same shard), optionally since a day."""
+    return sketches.STORE.window(db, device_ids, since).summary()
 
 # -------- Houses & Channels --------
 
@@ -201,15 +451,43 @@ def list_houses(db: Session):
     """
     Return a list of distinct house_id values.
     """
-    rows = db.query(models.Device.house_id).distinct().all()
+    rows = db.query(models.Device.house_id).filter(_active_device).distinct().all()
     return [r[0] for r in rows]
 
+def house_overview(db: Session):
+    """
+    Admin view of every house: its readings shard, device count and
+    reading count. Reading counts fan out across all shards in parallel.
+    """
+    device_houses = dict(db.query(models.Device.id, models.Device.house_id).filter(_active_device).all())
+    router = database.router
+
+    def count_by_device(name, eng):
+        with eng.connect() as conn:
+            return conn.execute(
+                select(models.Reading.device_id, func.count())
+                .group_by(models.Reading.device_id)
+            ).all()
+
+    houses = {
+        hid: {"house_id": hid, "shard": router.shard_name(hid), "devices": 0, "readings": 0}
+        for hid in set(device_houses.values())
+    }
+    for hid in device_houses.values():
+        houses[hid]["devices"] += 1
+    for rows in router.fan_out(count_by_device).values():
+        for did, n in rows:
+            hid = device_houses.get(did)
+            if hid is not None:
+                houses[hid]["readings"] += n
+    return sorted(houses.values(), key=lambda h: h["house_id"])
+
 def list_devices_by_house(db: Session, house_id: int):
     """
     Return all Device objects for a given house_id.
     """
     return db.query(models.Device) \
-             .filter(models.Device.house_id == house_id) \
+             .filter(models.Device.house_id == house_id, _active_device) \
              .all()
 
 def by_house_appliance(db: Session, house: int, appl: str):
@@ -219,7 +497,8 @@ def by_house_appliance(db: Session, house: int, appl: str):
     return db.query(models.Device) \
              .filter(
                  models.Device.house_id == house,
-                 models.Device.appliance == appl
+                 models.Device.appliance == appl,
+                 _active_device
              ).first()
 
 # -------- Latest Reading --------
@@ -242,5 +521,6 @@ def by_house_appliances(db: Session, house: int, appl: str):
     return db.query(models.Device) \
              .filter(
                  models.Device.house_id == house,
-                 models.Device.appliance == appl
+                 models.Device.appliance == appl,
+                 _active_device
              ).all()
@@ -0,0 +1,216 @@
+import os
+from typing import Dict, List
+
+from sqlalchemy import DateTime, Integer, delete, func, inspect, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import sessionmaker, Session
+
+from . import models, pooling, scheduler, sharding
+
+# -------------------------------------------------------------------
+# Database configuration (pool sizing: DB_POOL_* in pooling.py)
+# -------------------------------------------------------------------
+DATABASE_URL = os.getenv("DB_URL")
+engine = pooling.make_engine(DATABASE_URL)
+
+# -------------------------------------------------------------------
+# Readings shards
+#   DB_SHARDS="s0=mysql+pymysql://…/energy0,s1=mysql+pymysql://…/energy1"
+#   DB_SHARD_PINS="12=s1"   (optional house → shard overrides)
+# Users, devices and schedules always live on DB_URL; readings are routed
+# by house_id. Without DB_SHARDS every reading stays on DB_URL.
+# -------------------------------------------------------------------
+SHARD_URLS = sharding.parse_shard_urls(os.getenv("DB_SHARDS", ""))
+router = sharding.ShardRouter(
+    {
+        name: engine if url == DATABASE_URL else pooling.make_engine(url)
+        for name, url in SHARD_URLS.items()
+    } or {"primary": engine},
+    sharding.ConsistentHashMap(
+        SHARD_URLS or ["primary"],
+        pins=sharding.parse_pins(os.getenv("DB_SHARD_PINS", ""))
+    )
+)
+
+# Tables that live on the readings shards rather than on DB_URL
+SHARDED_MODELS = (models.Reading, models.ReadingRollup, models.ReadingSketch, models.ShardMoveProgress)
+
+# -------------------------------------------------------------------
+# Read replicas (optional)
+#   DB_REPLICA_URL="mysql+pymysql://…@replica/energy"   replica of DB_URL
+#   DB_SHARD_REPLICAS="s0=…,s1=…"                        replicas of shards
+# Read-only sessions (get_read_db) use a replica while its lag stays
+# under DB_REPLICA_MAX_LAG and fall back to the primary otherwise.
+# -------------------------------------------------------------------
+REPLICAS: Dict[Engine, pooling.Replica] = {}
+if os.getenv("DB_REPLICA_URL"):
+    REPLICAS[engine] = pooling.Replica(pooling.make_engine(os.environ["DB_REPLICA_URL"]))
+for _name, _url in sharding.parse_shard_urls(os.getenv("DB_SHARD_REPLICAS", "")).items():
+    REPLICAS[router.engines[_name]] = pooling.Replica(pooling.make_engine(_url))
+
+class RoutingSession(Session):
+    """
+    Session that sends Reading statements to the shard of its house and,
+    when opened read-only, every statement to that database's replica.
+    """
+
+    def get_bind(self, mapper=None, clause=None, **kw):
+        bind = self._primary_bind(mapper, clause, **kw)
+        if not self.info.get("read_only"):
+            return bind
+        # Decide once per session so a request never mixes replica and primary
+        picked = self.info.setdefault("read_binds", {})
+        if bind not in picked:
+            replica = REPLICAS.get(bind)
+            picked[bind] = replica.engine if replica is not None and replica.usable() else bind
+        return picked[bind]
+
+    def _primary_bind(self, mapper, clause, **kw):
+        if mapper is not None and mapper.class_ in SHARDED_MODELS:
+            if router.single is not None:
+                return router.single
+            house_id = self.info.get("house_id")
+            if house_id is None:
+                raise RuntimeError("Readings are sharded: call database.route(db, house_id) first")
+            return router.engine_for(house_id)
+        return super().get_bind(mapper=mapper, clause=clause, **kw)
+
+SessionLocal = sessionmaker(bind=engine, class_=RoutingSession, autoflush=False, future=True)
+
+def route(db: Session, house_id: int) -> Session:
+    """Point the session's readings access at the shard for `house_id`."""
+    db.info["house_id"] = house_id
+    return db
+
+# -------------------------------------------------------------------
+# Dependency: provide a database session
+# -------------------------------------------------------------------
+def get_db() -> Session:
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_read_db() -> Session:
+    """Session for read-only endpoints; served by a replica when one keeps up."""
+    db = SessionLocal(info={"read_only": True})
+    try:
+        yield db
+    finally:
+        db.close()
+
+def served_by_replica(db: Session) -> bool:
+    """True if any statement of this session went to a replica."""
+    return any(b is not p for p, b in db.info.get("read_binds", {}).items())
+
+def all_engines() -> List[Engine]:
+    """Primary, shard and replica engines, each once."""
+    engines = [engine, *router.engines.values(), *(r.engine for r in REPLICAS.values())]
+    return list({id(e): e for e in engines}.values())
+
+def pool_report() -> dict:
+    """Pool occupancy and checkout waits per database, plus replica lag."""
+    names = {id(eng): f"shard:{name}" for name, eng in router.engines.items()}
+    names[id(engine)] = "primary"
+    report = {names[id(eng)]: pooling.pool_status(eng)
+              for eng in {id(e): e for e in [engine, *router.engines.values()]}.values()}
+    for primary, replica in REPLICAS.items():
+        report[f"replica:{names[id(primary)]}"] = replica.status()
+    return report
+
+# -------------------------------------------------------------------
+# Schema management & health
+# -------------------------------------------------------------------
+def _add_reading_uniqueness(eng):
+    """
+    Readings tables created before uq_reading_device_ts may hold duplicate
+    (device_id, ts) rows: keep the first copy of each, then add the index.
+    """
+    R = models.Reading.__table__
+    index = next(i for i in R.indexes if i.name == "uq_reading_device_ts")
+    if index.name in {i["name"] for i in inspect(eng).get_indexes(R.name)}:
+        return
+    # Derived table so MySQL accepts a subquery on the table being deleted from
+    keep = select(func.min(R.c.id).label("id")).group_by(R.c.device_id, R.c.ts).subquery()
+    with eng.begin() as conn:
+        removed = conn.execute(delete(R).where(R.c.id.not_in(select(keep.c.id)))).rowcount
+        index.create(conn)
+    print(f"readings on {eng.url.render_as_string()}: removed {removed} duplicates, added {index.name}")
+
+def _add_device_deleted_at(eng):
+    """devices tables created before soft deletion lack the deleted_at column."""
+    if "deleted_at" in {c["name"] for c in inspect(eng).get_columns("devices")}:
+        return
+    with eng.begin() as conn:
+        conn.execute(text(
+            f"ALTER TABLE devices ADD COLUMN deleted_at {DateTime().compile(dialect=eng.dialect)} NULL"
+        ))
+    print("devices: added deleted_at")
+
+def _add_cache_version_updated_at(eng):
+    """
+    cache_versions tables from before workers polled them lack updated_at.
+    They only hold counters, so recreate the table; the ETags stay valid
+    because they also cover the body.
+    """
+    table = models.CacheVersion.__table__
+    if "updated_at" in {c["name"] for c in inspect(eng).get_columns(table.name)}:
+        return
+    table.drop(eng)
+    table.create(eng)
+    print("cache_versions: recreated with updated_at")
+
+def _add_schedule_days_mask(eng):
+    """
+    schedules tables from before the weekday bitmask store days as a
+    "Mon,Wed" string: add days_mask, fill it from that, drop the string.
+    """
+    columns = {c["name"] for c in inspect(eng).get_columns("schedules")}
+    if "days_mask" in columns:
+        return
+    converted = 0
+    with eng.begin() as conn:
+        conn.execute(text(
+            f"ALTER TABLE schedules ADD COLUMN days_mask {Integer().compile(dialect=eng.dialect)} NOT NULL DEFAULT 0"
+        ))
+        if "days" in columns:
+            for sid, days in conn.execute(text("SELECT id, days FROM schedules")).all():
+                conn.execute(
+                    text("UPDATE schedules SET days_mask = :mask WHERE id = :id"),
+                    {"mask": scheduler.days_to_mask(d for d in (days or "").split(",") if d), "id": sid}
+                )
+                converted += 1
+            # NOT NULL without a default: new inserts would fail while it exists
+            conn.execute(text("ALTER TABLE schedules DROP COLUMN days"))
+    print(f"schedules: added days_mask ({converted} converted)")
+
+def create_schema():
+    """Create all tables that do not exist yet (idempotent)."""
+    models.Base.metadata.create_all(engine)
+    _add_schedule_days_mask(engine)
+    _add_cache_version_updated_at(engine)
+    _add_device_deleted_at(engine)
+    for shard in router.engines.values():
+        if shard is not engine:
+            for model in SHARDED_MODELS:
+                model.__table__.create(shard, checkfirst=True)
+    for shard in router.engines.values():
+        _add_reading_uniqueness(shard)
+
+def _ping(eng) -> bool:
+    try:
+        with eng.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        return True
+    except Exception:
+        return False
+
+def ping() -> bool:
+    """True if the primary database and every readings shard answer."""
+    return _ping(engine) and all(router.fan_out(lambda name, eng: _ping(eng)).values())
+
+if __name__ == "__main__":
+    # Explicit migration step: python -m app.database
+    create_schema()
+    print("Database schema is up to date")
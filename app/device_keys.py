@@ -0,0 +1,128 @@
+import hashlib
+import hmac
+import os
+import re
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple, Optional, Tuple
+
+from . import models
+from .database import SessionLocal
+
+# Per-device API keys: `dk_<id>.<secret>`. The id is public and locates the
+# row; only an HMAC of the whole key is stored. The secret carries 256 bits
+# of entropy, so one keyed SHA-256 and a constant-time compare replace the
+# bcrypt verify of a password login, and a leaked key reaches one device.
+
+# ── Settings ───────────────────────────────────────────────────────────────────
+PREFIX     = "dk_"
+PEPPER     = (os.getenv("DEVICE_KEY_SECRET") or os.getenv("SECRET_KEY", "CHANGE_ME")).encode()
+CACHE_TTL  = float(os.getenv("DEVICE_KEY_CACHE_TTL", 60))    # revocations elsewhere apply within this
+CACHE_SIZE = int(os.getenv("DEVICE_KEY_CACHE_SIZE", 100_000))
+MISS_TTL   = 5.0       # unknown ids are remembered briefly, apart from live keys
+MISS_SIZE  = 10_000
+
+# What `generate` issues: 16 hex digits of id, 43 url-safe characters of secret
+KEY_FORMAT = re.compile(re.escape(PREFIX) + r"([0-9a-f]{16})\.[A-Za-z0-9_-]{43}")
+
+# ── Keys ───────────────────────────────────────────────────────────────────────
+def is_key(credential: Optional[str]) -> bool:
+    return bool(credential) and credential.startswith(PREFIX)
+
+def generate() -> Tuple[str, str]:
+    """A new (key id, full key)."""
+    key_id = secrets.token_hex(8)
+    return key_id, f"{PREFIX}{key_id}.{secrets.token_urlsafe(32)}"
+
+def digest(key: str) -> str:
+    return hmac.new(PEPPER, key.encode(), hashlib.sha256).hexdigest()
+
+def key_id_of(key: str) -> Optional[str]:
+    """The id of a well-formed key, else None (without touching the database)."""
+    match = KEY_FORMAT.fullmatch(key)
+    return match.group(1) if match else None
+
+# ── Verification cache ─────────────────────────────────────────────────────────
+class KeyEntry(NamedTuple):
+    device_id: str
+    digest: str
+
+class KeyCache:
+    """
+    Live keys by id, so repeat traffic verifies without the database.
+    Entries expire after `ttl` so revocations made by other workers take
+    effect; revocations made here call `forget`. Unknown or revoked ids go
+    to a small, short-lived miss cache of their own, so a flood of made-up
+    ids cannot evict live keys.
+    """
+
+    def __init__(self, ttl: float = CACHE_TTL, max_entries: int = CACHE_SIZE,
+                 miss_ttl: float = MISS_TTL, max_misses: int = MISS_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.miss_ttl = miss_ttl
+        self.max_misses = max_misses
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[KeyEntry, float]]" = OrderedDict()
+        self._missing: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _load(self, key_id: str) -> Optional[KeyEntry]:
+        with SessionLocal() as db:
+            row = db.get(models.DeviceKey, key_id)
+            if row is None or row.revoked_at is not None:
+                return None
+            return KeyEntry(row.device_id, row.digest)
+
+    def get(self, key_id: str) -> Optional[KeyEntry]:
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key_id)
+            if cached is not None and cached[1] > now:
+                self._entries.move_to_end(key_id)
+                self.hits += 1
+                return cached[0]
+            if self._missing.get(key_id, 0) > now:
+                self.hits += 1
+                return None
+        self.misses += 1
+        entry = self._load(key_id)
+        with self._lock:
+            if entry is None:
+                self._entries.pop(key_id, None)
+                self._missing[key_id] = now + self.miss_ttl
+                self._missing.move_to_end(key_id)
+                while len(self._missing) > self.max_misses:
+                    self._missing.popitem(last=False)
+            else:
+                self._missing.pop(key_id, None)
+                self._entries[key_id] = (entry, now + self.ttl)
+                self._entries.move_to_end(key_id)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return entry
+
+    def forget(self, *key_ids: str):
+        with self._lock:
+            for key_id in key_ids:
+                self._entries.pop(key_id, None)
+                self._missing.pop(key_id, None)
+
+    def status(self) -> dict:
+        with self._lock:
+            size, missing = len(self._entries), len(self._missing)
+        return {"entries": size, "missing": missing, "hits": self.hits,
+                "misses": self.misses, "ttl": self.ttl}
+
+CACHE = KeyCache()
+
+def authenticate(key: str) -> Optional[str]:
+    """Device id the key belongs to, or None if it is malformed, unknown or revoked."""
+    key_id = key_id_of(key)
+    entry = CACHE.get(key_id) if key_id else None
+    if entry is None or not hmac.compare_digest(digest(key), entry.digest):
+        return None
+    return entry.device_id
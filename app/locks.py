@@ -0,0 +1,28 @@
+import os
+import tempfile
+from typing import IO, Optional
+
+def lock_path(name: str) -> str:
+    """Default lock file location for a named background job."""
+    return os.path.join(tempfile.gettempdir(), f"energy-{name}.lock")
+
+def try_lock(path: str) -> Optional[IO]:
+    """
+    Take a non-blocking exclusive flock on `path`.
+
+    Returns the open file (keep a reference: closing it releases the lock),
+    or None if another process holds it. Used so that only one of several
+    worker processes runs a given background job; the OS drops the lock if
+    that process dies, letting another worker take over.
+    """
+    try:
+        import fcntl
+    except ImportError:  # non-POSIX: single process assumed
+        return open(os.devnull, "w")
+    fh = open(path, "w")
+    try:
+        fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        fh.close()
+        return None
+    return fh
@@ -1,40 +1,38 @@
+import json
+import logging
 import os
+import threading
 from datetime import datetime, timedelta
-from typing import List, Dict
+from functools import lru_cache
+from typing import Any, Callable, Hashable, Iterable, List, Dict, Optional
 
-import pandas as pd
-from dotenv import load_dotenv
 from fastapi import (
     FastAPI, HTTPException, Depends,
-    BackgroundTasks, Request, Path, Body
+    BackgroundTasks, Request, Path, Body, Query,
+    WebSocket, WebSocketDisconnect, status
 )
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import (
     OAuth2PasswordBearer, OAuth2PasswordRequestForm
 )
 from fastapi.responses import (
-    FileResponse, HTMLResponse, RedirectResponse
+    FileResponse, HTMLResponse, JSONResponse, RedirectResponse, Response
 )
 from fastapi.staticfiles import StaticFiles
 from jose import JWTError, jwt
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, Session
+from pydantic import TypeAdapter, ValidationError
+from sqlalchemy.orm import Session
 
-# Local application modules
-from . import models, schemas, crud, ml_model, notifications
+# Local application modules (.env is loaded by the package __init__)
+from . import schemas, crud, ml_model, notifications, scheduler, cache, database, retention, admission, pooling, sketches, purge, moves, streams, device_keys
+from .database import SessionLocal, get_db, get_read_db
 
-# Load environment variables from .env
-load_dotenv()
+logger = logging.getLogger("relays")
 
-# -------------------------------------------------------------------
-# Database configuration
-# -------------------------------------------------------------------
-DATABASE_URL = os.getenv("DB_URL")
-engine = create_engine(DATABASE_URL, future=True)
-SessionLocal = sessionmaker(bind=engine, autoflush=False, future=True)
-
-# Create all tables (if not exist)
-models.Base.metadata.create_all(engine)
+# Schema creation is a deployment step (python -m app.database); set
+# DB_CREATE_SCHEMA=true to also run it at startup for local development.
+DB_CREATE_SCHEMA = os.getenv("DB_CREATE_SCHEMA", "false").lower() in ("1", "true")
 
 # -------------------------------------------------------------------
 # JWT configuration
@@ -43,6 +41,9 @@ SECRET_KEY = os.getenv("SECRET_KEY", "CHANGE_ME")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
+# Once every device reports with an API key, refuse ingest without one
+INGEST_REQUIRE_KEY = os.getenv("INGEST_REQUIRE_KEY", "false").lower() in ("1", "true")
+
 # -------------------------------------------------------------------
 # FastAPI application setup
 # -------------------------------------------------------------------
@@ -57,16 +58,6 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# -------------------------------------------------------------------
-# Dependency: provide a database session
-# -------------------------------------------------------------------
-def get_db() -> Session:
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # -------------------------------------------------------------------
 # OAuth2 password flow
 # -------------------------------------------------------------------
@@ -79,11 +70,8 @@ def create_access_token(data: Dict[str, str], expires_delta: timedelta = None) -
     to_encode.update({"exp": expire})
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 
-def get_current_user(
-    token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
-):
-    """Decode JWT and retrieve the corresponding user."""
+def get_token_subject(token: str = Depends(oauth2_scheme)) -> str:
+    """Decode JWT and return its subject (email) without touching the DB."""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("sub")
@@ -91,17 +79,87 @@ def get_current_user(
             raise HTTPException(status_code=401, detail="Invalid authentication token")
     except JWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication token")
+    return email
+
+def load_user(db: Session, email: str):
+    """Retrieve the user behind a token subject."""
     user = crud.get_user_by_email(db, email)
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
     return user
 
+def get_current_user(
+    email: str = Depends(get_token_subject),
+    db: Session = Depends(get_db)
+):
+    """Decode JWT and retrieve the corresponding user."""
+    return load_user(db, email)
+
 def require_admin(user=Depends(get_current_user)):
     """Ensure that the current user has an admin role."""
     if user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin privileges required")
     return user
 
+def device_scope(credential: Optional[str]) -> Optional[str]:
+    """
+    The device a `dk_…` API key may report for, verified by HMAC against
+    the in-memory key cache (no user lookup, no bcrypt). Other credentials
+    give no scope, and are refused when INGEST_REQUIRE_KEY is set.
+    """
+    if device_keys.is_key(credential):
+        device_id = device_keys.authenticate(credential)
+        if device_id is None:
+            raise HTTPException(status_code=401, detail="Invalid device key",
+                                headers={"WWW-Authenticate": "Bearer"})
+        return device_id
+    if INGEST_REQUIRE_KEY:
+        raise HTTPException(status_code=401, detail="Device key required",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return None
+
+def ingest_device_scope(request: Request) -> Optional[str]:
+    """`Authorization: Bearer dk_…` on the ingest endpoints."""
+    return device_scope(request.headers.get("authorization", "").removeprefix("Bearer "))
+
+# -------------------------------------------------------------------
+# Conditional GET / response cache helpers
+# -------------------------------------------------------------------
+@lru_cache(maxsize=None)
+def _adapter(model) -> TypeAdapter:
+    return TypeAdapter(model)
+
+def _etag_response(request: Request, entry: cache.CachedResponse) -> Response:
+    headers = {"ETag": entry.etag, "Cache-Control": "private, no-cache"}
+    if cache.etag_matches(request.headers.get("if-none-match"), entry.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=entry.body, media_type="application/json", headers=headers)
+
+def cached_hit(request: Request, key: Hashable):
+    """Serve a still-valid cached response (or 304) without running a query."""
+    entry = cache.get(key)
+    return _etag_response(request, entry) if entry else None
+
+def cache_and_respond(
+    request: Request,
+    key: Hashable,
+    deps: Iterable[Hashable],
+    model: Any,
+    fetch: Callable[[], Any],
+    ttl: float = cache.DEFAULT_TTL,
+    db: Optional[Session] = None
+) -> Response:
+    """Run `fetch`, serialize it as `model`, cache it under `key` and respond."""
+    deps = tuple(deps)
+    versions = cache.snapshot(deps)
+    adapter = _adapter(model)
+    body = adapter.dump_json(adapter.validate_python(fetch(), from_attributes=True))
+    if db is not None and database.served_by_replica(db):
+        # A replica may not have the write behind `versions` yet; don't
+        # keep what it returned for longer than it is allowed to lag.
+        ttl = min(ttl, pooling.REPLICA_MAX_LAG)
+    return _etag_response(request, cache.put(key, deps, versions, body, ttl))
+
 # -------------------------------------------------------------------
 # Authentication endpoints
 # -------------------------------------------------------------------
@@ -153,23 +211,41 @@ def create_device(
 
 @app.get("/devices", response_model=List[schemas.DeviceOut])
 def list_devices(
-    db: Session = Depends(get_db),
-    current_user=Depends(get_current_user)
+    request: Request,
+    db: Session = Depends(get_read_db),
+    email: str = Depends(get_token_subject)
 ):
     """Return all devices owned by the authenticated user."""
-    return crud.list_devices(db, current_user.id)
+    key = ("devices", email)
+    hit = cached_hit(request, key)
+    if hit:
+        return hit
+    current_user = load_user(db, email)
+    return cache_and_respond(
+        request, key, [("owner", current_user.id)], List[schemas.DeviceOut],
+        lambda: crud.list_devices(db, current_user.id),
+        db=db
+    )
 
 @app.get("/devices/{device_id}", response_model=schemas.DeviceOut)
 def get_device(
     device_id: str,
+    request: Request,
     db: Session = Depends(get_db),
-    current_user=Depends(get_current_user)
+    email: str = Depends(get_token_subject)
 ):
     """Fetch a single device, ensuring ownership."""
+    key = ("device", email, device_id)
+    hit = cached_hit(request, key)
+    if hit:
+        return hit
+    current_user = load_user(db, email)
     device = crud.get_device(db, device_id)
     if not device or device.owner_id != current_user.id:
         raise HTTPException(status_code=404, detail="Device not found")
-    return device
+    return cache_and_respond(
+        request, key, [("device", device_id)], schemas.DeviceOut, lambda: device
+    )
 
 @app.put("/devices/{device_id}", response_model=schemas.DeviceOut)
 def update_device(
@@ -191,13 +267,62 @@ def remove_device(
     db: Session = Depends(get_db),
     current_user=Depends(get_current_user)
 ):
-    """Delete a device and all its readings."""
+    """Delete a device; its readings are purged in the background."""
     device = crud.get_device(db, device_id)
     if not device or device.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
     crud.delete_device(db, device_id)
     return {"detail": "Device deleted"}
 
+# -------------------------------------------------------------------
+# Device API keys
+# -------------------------------------------------------------------
+def owned_device(db: Session, device_id: str, user):
+    device = crud.get_device(db, device_id)
+    if not device or device.owner_id != user.id:
+        raise HTTPException(status_code=404, detail="Device not found")
+    return device
+
+@app.post("/devices/{device_id}/keys", response_model=schemas.DeviceKeyCreated)
+def issue_device_key(
+    device_id: str,
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Issue an API key for the device to ingest with; it is shown only once."""
+    owned_device(db, device_id, current_user)
+    row, key = crud.create_device_key(db, device_id)
+    return {
+        "id": row.id,
+        "device_id": row.device_id,
+        "created_at": row.created_at,
+        "revoked_at": row.revoked_at,
+        "key": key
+    }
+
+@app.get("/devices/{device_id}/keys", response_model=List[schemas.DeviceKeyOut])
+def list_device_keys(
+    device_id: str,
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """List a device's keys (without their secrets)."""
+    owned_device(db, device_id, current_user)
+    return crud.list_device_keys(db, device_id)
+
+@app.delete("/devices/{device_id}/keys/{key_id}")
+def revoke_device_key(
+    device_id: str,
+    key_id: str,
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Revoke a key; other workers stop accepting it within DEVICE_KEY_CACHE_TTL."""
+    owned_device(db, device_id, current_user)
+    if not crud.revoke_device_key(db, device_id, key_id):
+        raise HTTPException(status_code=404, detail="Key not found")
+    return {"detail": "Key revoked"}
+
 # -------------------------------------------------------------------
 # Scheduling endpoints
 # -------------------------------------------------------------------
@@ -208,23 +333,41 @@ def add_schedule(
     current_user=Depends(get_current_user)
 ):
     """Add an on/off schedule for a device."""
-    device = crud.get_device(db, schedule_in.device_id)
+    device = crud.get_device(db, str(schedule_in.device_id))
     if not device or device.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
 
     return crud.create_schedule(db, schedule_in)
 
+def owned_schedule(db: Session, schedule_id: int, user):
+    """The schedule if it belongs to one of the user's devices, else 404."""
+    schedule = crud.get_schedule(db, schedule_id)
+    if schedule is None:
+        raise HTTPException(status_code=404, detail="Schedule not found")
+    owned_device(db, schedule.device_id, user)
+    return schedule
+
 @app.get("/devices/{device_id}/schedules", response_model=List[schemas.ScheduleOut])
 def get_schedules(
     device_id: str,
+    request: Request,
     db: Session = Depends(get_db),
-    current_user=Depends(get_current_user)
+    email: str = Depends(get_token_subject)
 ):
     """List all schedules for a specific device."""
+    key = ("schedules", email, device_id)
+    hit = cached_hit(request, key)
+    if hit:
+        return hit
+    current_user = load_user(db, email)
     device = crud.get_device(db, device_id)
     if not device or device.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
-    return crud.list_schedules_for_device(db, device_id)
+    return cache_and_respond(
+        request, key, [("schedules", device_id), ("device", device_id)],
+        List[schemas.ScheduleOut],
+        lambda: crud.list_schedules_for_device(db, device_id)
+    )
 
 @app.put("/schedules/{schedule_id}")
 def edit_schedule(
@@ -234,6 +377,7 @@ def edit_schedule(
     current_user=Depends(get_current_user)
 ):
     """Modify an existing schedule."""
+    owned_schedule(db, schedule_id, current_user)
     crud.update_schedule(db, schedule_id, schedule_update)
     return {"detail": "Schedule updated"}
 
@@ -244,23 +388,186 @@ def remove_schedule(
     current_user=Depends(get_current_user)
 ):
     """Delete a schedule by its ID."""
-    crud.delete_schedule(db, schedule_id)
+    owned_schedule(db, schedule_id, current_user)
+    if not crud.delete_schedule(db, schedule_id):
+        raise HTTPException(status_code=404, detail="Schedule not found")
     return {"detail": "Schedule deleted"}
 
+# -------------------------------------------------------------------
+# Schedule execution
+# -------------------------------------------------------------------
+def fire_schedule(event: scheduler.ScheduleEvent):
+    """Drive the relay and send the reminder for a due schedule edge."""
+    db = SessionLocal()
+    try:
+        device = crud.get_device(db, event.device_id)
+    finally:
+        db.close()
+    if not device:
+        return
+
+    logger.info("Schedule %s: relay %s for device %s", event.schedule_id, event.action, device.id)
+    # Devices streaming to this worker get the relay command right away
+    streams.REGISTRY.push(device, [{
+        "device_id": device.id,
+        "name":      device.name,
+        "appliance": device.appliance,
+        "action":    event.action
+    }])
+    if event.send_email_reminder and event.edge == scheduler.START and device.email:
+        # SMTP can take seconds; keep the engine thread free for other edges
+        threading.Thread(
+            target=notifications.send_email,
+            args=(
+                device.email,
+                f"[Reminder] {device.name} schedule started",
+                f"{device.name} scheduled ON at {event.fire_at:%H:%M}"
+            ),
+            daemon=True
+        ).start()
+
+scheduler.SCHEDULER.on_fire = fire_schedule
+
+def load_schedules():
+    db = SessionLocal()
+    try:
+        return crud.list_all_schedules(db)
+    finally:
+        db.close()
+
+def schedule_changes(since: datetime):
+    # The engine runs on local wall-clock time, cache counters on UTC
+    offset = datetime.now().astimezone().utcoffset()
+    db = SessionLocal()
+    try:
+        return [(did, at + offset, rows)
+                for did, at, rows in crud.changed_schedules(db, since - offset)]
+    finally:
+        db.close()
+
+scheduler.SCHEDULER.loader = load_schedules
+scheduler.SCHEDULER.feed = schedule_changes
+
+@app.on_event("startup")
+def prepare_runtime():
+    """Optional schema creation, then warm ML models off the request path."""
+    if DB_CREATE_SCHEMA:
+        database.create_schema()
+    threading.Thread(target=ml_model.warm, name="ml-warmup", daemon=True).start()
+    retention.start()
+    sketches.start()
+    purge.start()
+    moves.start()
+
+@app.on_event("startup")
+def start_scheduler():
+    """Start the schedule engine; it seeds itself from the database."""
+    scheduler.SCHEDULER.start()
+
+@app.on_event("shutdown")
+def stop_scheduler():
+    scheduler.SCHEDULER.stop()
+    retention.stop()
+    sketches.stop()
+    purge.stop()
+    moves.stop()
+
 # -------------------------------------------------------------------
 # Energy summary endpoint
 # -------------------------------------------------------------------
 @app.get("/devices/{device_id}/energy-summary", response_model=schemas.EnergySummary)
 def energy_summary(
     device_id: str,
-    db: Session = Depends(get_db),
-    current_user=Depends(get_current_user)
+    request: Request,
+    db: Session = Depends(get_read_db),
+    email: str = Depends(get_token_subject)
 ):
     """Return consumption totals: today, past week, past month."""
+    key = ("energy-summary", email, device_id)
+    hit = cached_hit(request, key)
+    if hit:
+        return hit
+    current_user = load_user(db, email)
     device = crud.get_device(db, device_id)
     if not device or device.owner_id != current_user.id:
         raise HTTPException(status_code=403, detail="Forbidden")
-    return crud.energy_summary(db, device_id)
+    database.route(db, device.house_id)
+    # Windows slide with the clock, so expire quickly even without writes
+    return cache_and_respond(
+        request, key, [("readings", device_id), ("device", device_id)],
+        schemas.EnergySummary,
+        lambda: crud.energy_summary(db, device_id),
+        ttl=cache.WINDOW_TTL,
+        db=db
+    )
+
+# -------------------------------------------------------------------
+# Ingest admission control
+# -------------------------------------------------------------------
+def enter_ingest(house_id: int):
+    """
+    Load shedding: refuse with 503 before any DB work when this worker
+    already has too many ingests in flight or the DB pool is exhausted.
+    Pair with admission.INFLIGHT.leave().
+    """
+    saturated = (
+        admission.pool_saturated(database.engine) or
+        admission.pool_saturated(database.router.engine_for(house_id))
+    )
+    if saturated or not admission.INFLIGHT.try_enter():
+        admission.COUNTERS["shed"] += 1
+        raise HTTPException(
+            status_code=503,
+            detail="Server busy, retry shortly",
+            headers={"Retry-After": str(admission.SHED_RETRY_AFTER)}
+        )
+
+def ingest_slot(house_id: int):
+    enter_ingest(house_id)
+    try:
+        yield
+    finally:
+        admission.INFLIGHT.leave()
+
+def enforce_rate_limit(house_id: int, device_ids: Iterable[str]):
+    """
+    Per-device and per-house token buckets; 429 + Retry-After when empty.
+    Call once the request is validated, so rejected requests cost nothing.
+    """
+    retry_after = admission.admit(house_id, device_ids)
+    if retry_after:
+        raise HTTPException(
+            status_code=429,
+            detail="Too many readings",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+def act_on(devices, actions: Dict[str, str], timestamp, notify: Callable) -> List[dict]:
+    """
+    Alerts and relay auto-off for predicted actions; returns ActionOut dicts.
+    `notify(fn, *args)` runs the email send off the request path.
+    """
+    response = []
+    for d in devices:
+        action = actions.get(d.appliance, "UNKNOWN")
+        # Send email alerts if enabled
+        if d.recommend_only and d.email:
+            notify(
+                notifications.send_email,
+                d.email,
+                f"[Alert] {d.name} → {action}",
+                f"{d.name} predicted to {action} at {timestamp}"
+            )
+        # Perform relay auto-off if configured
+        if d.auto_off and action == "OFF":
+            logger.info("Auto-off: relay OFF for device %s", d.id)
+        response.append({
+            "device_id": d.id,
+            "name":      d.name,
+            "appliance": d.appliance,
+            "action":    action
+        })
+    return response
 
 # -------------------------------------------------------------------
 # Bulk reading ingestion & action prediction
@@ -270,49 +577,51 @@ def ingest_bulk_readings(
     house_id: int,
     bulk: schemas.BulkReading,
     background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    scope: Optional[str] = Depends(ingest_device_scope),
+    _slot=Depends(ingest_slot)
 ):
     """
     Store readings for each appliance, run the ML model
     to predict ON/OFF actions, then handle notifications/auto-off.
+    With a device key only that device's channel is stored and acted on.
     """
-    # Persist each channel reading
-    for channel, watt in bulk.appliances.items():
-        devices = crud.by_house_appliances(db, house_id, channel)
-        for d in devices:
-            crud.add_reading(db, d.id, schemas.ReadingIn(timestamp=bulk.timestamp, watts=watt))
+    if scope is not None:
+        device = crud.get_device(db, scope)
+        if not device or device.house_id != house_id:
+            raise HTTPException(status_code=403, detail="Key is not valid for this house")
+
+    channels = {}
+    def devices_on(channel):
+        if channel not in channels:
+            channels[channel] = [d for d in crud.by_house_appliances(db, house_id, channel)
+                                 if scope in (None, d.id)]
+        return channels[channel]
+
+    # A house gateway posts all channels at once; charge the devices behind
+    # them, the same buckets their single-reading posts draw from
+    rows = [
+        (d.id, bulk.timestamp, watt)
+        for channel, watt in bulk.appliances.items()
+        for d in devices_on(channel)
+    ]
+    enforce_rate_limit(house_id, sorted({did for did, _, _ in rows}))
+
+    database.route(db, house_id)
+    # Persist every channel reading in one idempotent batch
+    crud.add_readings(db, rows)
 
     # Prepare DataFrame for model
     df_input = {
-        "Time": pd.to_datetime(bulk.timestamp),
+        "Time": bulk.timestamp,
         "Aggregate": bulk.aggregate,
         **bulk.appliances
     }
     actions = ml_model.predict_actions(df_input)
 
     # Process predicted actions
-    response = []
-    for channel, action in actions.items():
-        devices = crud.by_house_appliances(db, house_id, channel)
-        for d in devices:
-            # Send email alerts if enabled
-            if d.recommend_only and d.email:
-                background_tasks.add_task(
-                    notifications.send_email,
-                    d.email,
-                    f"[Alert] {d.name} → {action}",
-                    f"{d.name} predicted to {action} at {bulk.timestamp}"
-                )
-            # Perform relay auto-off if configured
-            if d.auto_off and action == "OFF":
-                print(f"AUTO-OFF relay for device {d.id}")
-            response.append({
-                "device_id": d.id,
-                "name":      d.name,
-                "appliance": d.appliance,
-                "action":    action
-            })
-    return response
+    devices = [d for channel in actions for d in devices_on(channel)]
+    return act_on(devices, actions, bulk.timestamp, background_tasks.add_task)
 
 @app.post("/houses/{house_id}/reading/{device_id}", response_model=schemas.ActionOut)
 def ingest_single_reading(
@@ -321,23 +630,30 @@ def ingest_single_reading(
     device_id: str = Path(..., description="UUID of the device"),
     reading: schemas.ReadingIn = Body(...),
 
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_db),
+    scope: Optional[str] = Depends(ingest_device_scope),
+    _slot=Depends(ingest_slot)
 ):
     """
     Receive a single reading for a specific device in a given house.
     Store the reading, run the prediction model, and return the expected action.
     """
+    if scope is not None and scope != device_id:
+        raise HTTPException(status_code=403, detail="Key is not valid for this device")
+
     # Verify that the device exists within the given house
     device = crud.get_device(db, device_id)
     if not device or device.house_id != house_id:
         raise HTTPException(status_code=404, detail="Device not found in this house")
+    enforce_rate_limit(house_id, [device_id])
+    database.route(db, house_id)
 
     # Save the reading to the database
     crud.add_reading(db, device_id, reading)
 
     # Prepare input data for the prediction model (simplified example)
     df_input = {
-        "Time": pd.to_datetime(reading.timestamp),
+        "Time": reading.timestamp,
         "Aggregate": reading.watts,
         device.appliance: reading.watts
     }
@@ -345,26 +661,137 @@ def ingest_single_reading(
     # Predict the action using the ML model
     actions = ml_model.predict_actions(df_input)  # returns dict like {"Appliance5": "OFF"}
 
-    action = actions.get(device.appliance, "UNKNOWN")
-
     # Send notifications or perform other actions if necessary
-    if device.recommend_only and device.email:
-        background_tasks.add_task(
-            notifications.send_email,
-            device.email,
-            f"[Alert] {device.name} → {action}",
-            f"{device.name} predicted to {action} at {reading.timestamp}"
-        )
-    if device.auto_off and action == "OFF":
-        print(f"AUTO-OFF relay for device {device_id}")
-
-    # Return the predicted action result
-    return schemas.ActionOut(
-        device_id=device_id,
-        name=device.name,
-        appliance=device.appliance,
-        action=action
-    )
+    return act_on([device], actions, reading.timestamp, background_tasks.add_task)[0]
+
+# -------------------------------------------------------------------
+# Streaming ingestion over WebSocket
+# -------------------------------------------------------------------
+def _in_thread(fn, *args):
+    # No response to run background tasks after; SMTP must not hold a frame
+    threading.Thread(target=fn, args=args, daemon=True).start()
+
+def open_stream(house_id: int, credential: str) -> streams.StreamSession:
+    """
+    Authenticate once per socket. A device key opens a stream for its
+    device only; a user JWT for all of the user's devices in the house.
+    """
+    scope = device_scope(credential)
+    if scope is not None:
+        with SessionLocal() as db:
+            device = crud.get_device(db, scope)
+        if not device or device.house_id != house_id:
+            raise HTTPException(status_code=403, detail="Key is not valid for this house")
+        session = streams.StreamSession(house_id, device.owner_id, device_ids={scope})
+        session.device_key = credential
+    else:
+        email = get_token_subject(credential)
+        with SessionLocal() as db:
+            user = load_user(db, email)
+        session = streams.StreamSession(house_id, user.id)
+    session.refresh(force=True)
+    if not session.devices:
+        raise HTTPException(status_code=404, detail="No devices in this house")
+    return session
+
+def ingest_frame(session: streams.StreamSession, frame: Any) -> List[dict]:
+    """
+    One stream frame, shaped like the bulk body (has "appliances") or the
+    single body plus "device_id". Stored, admitted and acted on exactly
+    like the HTTP ingest, but against the session's cached devices.
+    """
+    if session.device_key and device_keys.authenticate(session.device_key) is None:
+        raise HTTPException(status_code=401, detail="Device key revoked")
+    if not isinstance(frame, dict):
+        raise HTTPException(status_code=422, detail="Frame must be a JSON object")
+    session.refresh()
+    house_id = session.house_id
+    if "appliances" in frame:
+        bulk = schemas.BulkReading(**frame)
+        rows = [
+            (d.id, bulk.timestamp, watt)
+            for channel, watt in bulk.appliances.items()
+            for d in session.channels.get(channel, ())
+        ]
+        device_ids = sorted({did for did, _, _ in rows})
+        timestamp = bulk.timestamp
+        df_input = {"Time": bulk.timestamp, "Aggregate": bulk.aggregate, **bulk.appliances}
+        devices = None
+    else:
+        reading = schemas.StreamReading(**frame)
+        device = session.devices.get(reading.device_id)
+        if device is None:
+            # Possibly added since the last counter read
+            session.refresh(check=True)
+            device = session.devices.get(reading.device_id)
+        if device is None:
+            raise HTTPException(status_code=404, detail="Device not found in this house")
+        device_ids = [device.id]
+        rows = [(device.id, reading.timestamp, reading.watts)]
+        timestamp = reading.timestamp
+        df_input = {"Time": reading.timestamp, "Aggregate": reading.watts, device.appliance: reading.watts}
+        devices = [device]
+
+    enter_ingest(house_id)
+    try:
+        enforce_rate_limit(house_id, device_ids)
+        with SessionLocal() as db:
+            database.route(db, house_id)
+            crud.add_readings(db, rows)
+        actions = ml_model.predict_actions(df_input)
+    finally:
+        admission.INFLIGHT.leave()
+    if devices is None:
+        devices = [d for channel in actions for d in session.channels.get(channel, ())]
+    session.frames += 1
+    return act_on(devices, actions, timestamp, _in_thread)
+
+def _frame_error(e: Exception) -> dict:
+    if isinstance(e, HTTPException):
+        error = {"status": e.status_code, "detail": e.detail}
+        retry_after = (e.headers or {}).get("Retry-After")
+        if retry_after:
+            error["retry_after"] = int(retry_after)
+        return error
+    return {"status": 422, "detail": json.loads(e.json())}
+
+@app.websocket("/houses/{house_id}/stream")
+async def stream_readings(websocket: WebSocket, house_id: int):
+    """
+    Long-lived device connection. Authenticate once with a device key or
+    a JWT (as `Authorization: Bearer` or `?token=`), then send reading
+    frames; each is answered with a list of ActionOut, and schedule relay
+    commands are pushed as they fire. Errors are answered as
+    {"status", "detail"} and leave the socket open, except a revoked key.
+    """
+    token = websocket.query_params.get("token") or \
+        websocket.headers.get("authorization", "").removeprefix("Bearer ")
+    try:
+        session = await run_in_threadpool(open_stream, house_id, token)
+    except HTTPException as e:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION, reason=str(e.detail))
+        return
+
+    await websocket.accept()
+    session.attach(websocket)
+    streams.REGISTRY.add(session)
+    try:
+        while True:
+            text = await websocket.receive_text()
+            try:
+                reply = await run_in_threadpool(ingest_frame, session, json.loads(text))
+            except json.JSONDecodeError:
+                reply = {"status": 400, "detail": "Invalid JSON frame"}
+            except (HTTPException, ValidationError) as e:
+                reply = _frame_error(e)
+            await session.send(reply)
+            if isinstance(reply, dict) and reply["status"] == 401:
+                await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        streams.REGISTRY.remove(session)
 
 # -------------------------------------------------------------------
 # Live device status endpoint
@@ -377,18 +804,19 @@ def ingest_single_reading(
 def device_status(
     house_id: int,
     device_id: str,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
     """Fetch the latest reading and determine ON/OFF state."""
     device = crud.get_device(db, device_id)
     if not device or device.house_id != house_id:
         raise HTTPException(status_code=404, detail="Device not found in this house")
+    database.route(db, house_id)
 
     latest = crud.latest_reading(db, device_id)
     if not latest:
         return {"device_id": device_id, "house_id": house_id, "status": "UNKNOWN"}
 
-    status = "ON" if latest.watts >= 10 else "OFF"
+    status = crud.device_state(latest.watts)
     return {
         "device_id": device_id,
         "house_id":  house_id,
@@ -397,19 +825,124 @@ def device_status(
         "status":    status
     }
 
+# -------------------------------------------------------------------
+# House dashboard endpoint
+# -------------------------------------------------------------------
+@app.get(
+    "/houses/{house_id}/dashboard",
+    response_model=schemas.HouseDashboard,
+    summary="Status, energy totals and stats for every device in a house"
+)
+def house_dashboard(
+    house_id: int,
+    db: Session = Depends(get_db),
+    current_user=Depends(get_current_user)
+):
+    """Single-call replacement for per-device status/summary/stats requests."""
+    database.route(db, house_id)
+    return {"house_id": house_id, "devices": crud.house_dashboard(db, house_id, current_user.id)}
+
+@app.get(
+    "/houses/{house_id}/percentiles",
+    response_model=schemas.HousePercentiles,
+    summary="Watt percentiles across every device an owner has in a house"
+)
+def house_percentiles(
+    house_id: int,
+    days: Optional[int] = Query(None, ge=1, description="Only the last N days"),
+    db: Session = Depends(get_read_db),
+    email: str = Depends(get_token_subject)
+):
+    """Merges the devices' per-day sketches; no readings are scanned."""
+    current_user = load_user(db, email)
+    ids = [d.id for d in crud.list_devices(db, current_user.id) if d.house_id == house_id]
+    since = datetime.utcnow() - timedelta(days=days - 1) if days else None
+    database.route(db, house_id)
+    return {"house_id": house_id, "days": days, **crud.watt_percentiles(db, ids, since)}
+
 # -------------------------------------------------------------------
 # Historical stats endpoint
 # -------------------------------------------------------------------
 @app.get("/devices/{device_id}/stats", response_model=schemas.DeviceStats)
 def device_stats(
     device_id: str,
-    db: Session = Depends(get_db)
+    request: Request,
+    db: Session = Depends(get_read_db)
 ):
-    """Compute average watts and total readings for a device."""
-    if not crud.get_device(db, device_id):
+    """Average, count, p50/p90/p99 and max watts from the device's sketch."""
+    key = ("stats", device_id)
+    hit = cached_hit(request, key)
+    if hit:
+        return hit
+    device = crud.get_device(db, device_id)
+    if not device:
         raise HTTPException(status_code=404, detail="Device not found")
-    stats = crud.stats(db, device_id)
-    return {"id": device_id, **stats}
+    database.route(db, device.house_id)
+    return cache_and_respond(
+        request, key, [("readings", device_id), ("device", device_id)],
+        schemas.DeviceStats,
+        lambda: {"id": device_id, **crud.stats(db, device_id)},
+        ttl=cache.WINDOW_TTL,
+        db=db
+    )
+
+# -------------------------------------------------------------------
+# Admin endpoints
+# -------------------------------------------------------------------
+@app.get("/admin/houses", response_model=List[schemas.HouseOverview])
+def admin_houses(
+    db: Session = Depends(get_db),
+    admin=Depends(require_admin)
+):
+    """Every house with its readings shard, device and reading counts."""
+    return crud.house_overview(db)
+
+@app.get("/admin/ingest")
+def admin_ingest(admin=Depends(require_admin)):
+    """Admission-control limits, in-flight ingests, reject counters and open streams."""
+    return {
+        **admission.status(),
+        "streams": streams.REGISTRY.status(),
+        "device_keys": device_keys.CACHE.status()
+    }
+
+@app.get("/admin/db")
+def admin_db(admin=Depends(require_admin)):
+    """Connection pool saturation and checkout waits, replica lag and fallbacks."""
+    return database.pool_report()
+
+@app.get("/admin/purge")
+def admin_purge(admin=Depends(require_admin)):
+    """Devices awaiting purge and progress of the batched deletion."""
+    return purge.status()
+
+@app.get("/admin/moves")
+def admin_moves(admin=Depends(require_admin)):
+    """Devices whose readings await a move to their new house's shard, and progress."""
+    return moves.status()
+
+@app.get("/admin/retention")
+def admin_retention(admin=Depends(require_admin)):
+    """Retention policy and progress of the raw-readings compaction job."""
+    return retention.status()
+
+# -------------------------------------------------------------------
+# Liveness & readiness probes
+# -------------------------------------------------------------------
+@app.get("/healthz", summary="Liveness probe")
+def healthz():
+    """The process is up and serving requests."""
+    return {"status": "ok"}
+
+@app.get("/readyz", summary="Readiness probe")
+def readyz():
+    """Ready once ML models are warm and the database is reachable."""
+    checks = {"models": ml_model.is_warm(), "database": database.ping()}
+    ready = all(checks.values())
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"status": "ready" if ready else "starting", **checks}
+    )
 
 # -------------------------------------------------------------------
 # Serve frontend SPA and static assets
@@ -1,40 +1,81 @@
 import os
 import json
+import threading
 import warnings
-import pandas as pd
-import joblib
 from pathlib import Path
-from typing import Any, Dict
+from typing import TYPE_CHECKING, Any, Dict
+
+# pandas / joblib / sklearn are imported on first use (see warm()) so that
+# importing the API stays cheap and /healthz answers before models load.
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
 warnings.filterwarnings("ignore", category=UserWarning, message="Model file.*not found.*")
 warnings.filterwarnings("ignore", category=UserWarning, message="Thresholds file.*not found.*")
 # ── Paths ──────────────────────────────────────────────────────────────────────
 BASE_DIR    = Path(__file__).parent
 MODELS_DIR  = Path(os.getenv("ML_MODELS_DIR", BASE_DIR / "ml_models"))
 THRESH_FILE = Path(os.getenv("THRESHOLDS_FILE", BASE_DIR / "thresholds.json"))
+# "r" memory-maps the numpy arrays of uncompressed artifacts (see
+# export_for_mmap) so every worker process shares one page-cache copy.
+MMAP_MODE   = os.getenv("ML_MMAP_MODE") or None
 
 # ── Constants ──────────────────────────────────────────────────────────────────
 APPLIANCE_COLS = [f"Appliance{i}" for i in range(1, 10)]
 FEATURE_BASE   = ["Aggregate", "dayofweek", "is_weekend"]
 
-# ── Load thresholds ────────────────────────────────────────────────────────────
-if THRESH_FILE.exists():
-    with open(THRESH_FILE, "r") as f:
-        THRESHOLDS = json.load(f)
-else:
-    warnings.warn(f"Thresholds file '{THRESH_FILE.name}' not found. Using 1000W default.")
-    THRESHOLDS = {appl: 1000 for appl in APPLIANCE_COLS}
-
-# ── Load models ────────────────────────────────────────────────────────────────
+# ── Lazily loaded state ────────────────────────────────────────────────────────
+THRESHOLDS: Dict[str, float] = {}
 MODELS: Dict[str, Any] = {}
-for appl in APPLIANCE_COLS:
-    path = MODELS_DIR / f"{appl}_pipeline.joblib"
+_warm = False
+_warm_lock = threading.Lock()
+
+def load_thresholds(path: Path = THRESH_FILE) -> Dict[str, float]:
     if path.exists():
-        MODELS[appl] = joblib.load(path)
-    else:
-        warnings.warn(f"Model file '{path.name}' not found. Appliance '{appl}' will use threshold-only fallback.")
-        MODELS[appl] = None
+        with open(path, "r") as f:
+            return json.load(f)
+    warnings.warn(f"Thresholds file '{path.name}' not found. Using 1000W default.")
+    return {appl: 1000 for appl in APPLIANCE_COLS}
+
+def model_path(appl: str, models_dir: Path = MODELS_DIR) -> Path:
+    return models_dir / f"{appl}_pipeline.joblib"
+
+def load_model(path: Path) -> Any:
+    """joblib.load honouring ML_MMAP_MODE (compressed files load normally)."""
+    import joblib
+    return joblib.load(path, mmap_mode=MMAP_MODE)
+
+def load_models(models_dir: Path = MODELS_DIR) -> Dict[str, Any]:
+    """Every appliance model in `models_dir`; None where a file is missing."""
+    models: Dict[str, Any] = {}
+    for appl in APPLIANCE_COLS:
+        path = model_path(appl, models_dir)
+        if path.exists():
+            models[appl] = load_model(path)
+        else:
+            warnings.warn(f"Model file '{path.name}' not found. Appliance '{appl}' will use threshold-only fallback.")
+            models[appl] = None
+    return models
+
+def warm():
+    """Import pandas and load thresholds + every model once (thread-safe)."""
+    global _warm
+    if _warm:
+        return
+    with _warm_lock:
+        if _warm:
+            return
+        import pandas  # noqa: F401  (pay the import cost here, not mid-request)
+        THRESHOLDS.update(load_thresholds())
+        MODELS.update(load_models())
+        _warm = True
+
+def is_warm() -> bool:
+    return _warm
+
+def clean_and_engineer(df: "pd.DataFrame") -> "pd.DataFrame":
+    import pandas as pd
 
-def clean_and_engineer(df: pd.DataFrame) -> pd.DataFrame:
     # Convert timestamp or Time column
     if "timestamp" in df.columns:
         df["Time"] = pd.to_datetime(df.pop("timestamp"))
@@ -65,6 +106,9 @@ def predict_actions(data: Dict[str, Any]) -> Dict[str, str]:
 
     Missing appliance keys default to 0.0.
     """
+    warm()
+    import pandas as pd
+
     # ── Ensure every channel is present (missing → 0.0) ──────────────────────────
     for appl in APPLIANCE_COLS:
         data.setdefault(appl, 0.0)
@@ -76,23 +120,70 @@ def predict_actions(data: Dict[str, Any]) -> Dict[str, str]:
     df_feat = clean_and_engineer(df)
 
     # 3) Predict for each appliance
-    actions: Dict[str, str] = {}
+    return {appl: "OFF" if off[0] else "ON" for appl, off in predict_off(df_feat).items()}
+
+def predict_off(
+    df_feat: "pd.DataFrame",
+    models: Dict[str, Any] = None,
+    thresholds: Dict[str, float] = None
+) -> Dict[str, "np.ndarray"]:
+    """
+    Vectorized decisions for every row of an engineered frame: a boolean
+    array per appliance, True where the action is OFF (model label 1).
+    Defaults to the loaded MODELS / THRESHOLDS; the backtester passes others.
+    """
+    import numpy as np
+
+    if models is None:
+        warm()
+        models = MODELS
+    thresholds = THRESHOLDS if thresholds is None else thresholds
+
+    off: Dict[str, np.ndarray] = {}
     for appl in APPLIANCE_COLS:
-        model = MODELS.get(appl)
+        model = models.get(appl)
         X = df_feat[FEATURE_BASE + [f"{appl}_roll_mean", f"{appl}_roll_std"]]
 
         if model:
             try:
-                pred = model.predict(X)[0]
+                off[appl] = np.asarray(model.predict(X)) == 1
+                continue
             except Exception as e:
                 warnings.warn(f"Error in model for {appl}: {e} – using threshold fallback")
-                val  = float(data.get(appl, 0.0))
-                pred = 1 if val > THRESHOLDS[appl] else 0
-        else:
-            # threshold-only fallback
-            val  = float(data.get(appl, 0.0))
-            pred = 1 if val > THRESHOLDS[appl] else 0
+        # threshold-only fallback
+        off[appl] = df_feat[appl].to_numpy(dtype=float) > thresholds[appl]
 
-        actions[appl] = "OFF" if pred == 1 else "ON"
+    return off
 
-    return actions
\ No newline at end of file
+# ── Shared-memory export ───────────────────────────────────────────────────────
+def export_for_mmap(dst_dir: Path, src_dir: Path = MODELS_DIR) -> Dict[str, Path]:
+    """
+    Re-dump every appliance model uncompressed into `dst_dir`.
+
+    Uncompressed joblib files keep numpy arrays as raw buffers, which
+    joblib.load(mmap_mode="r") maps read-only instead of copying. Point
+    ML_MODELS_DIR at `dst_dir` and set ML_MMAP_MODE=r to use them.
+    """
+    import joblib
+
+    dst_dir = Path(dst_dir)
+    dst_dir.mkdir(parents=True, exist_ok=True)
+    written: Dict[str, Path] = {}
+    for appl in APPLIANCE_COLS:
+        src = model_path(appl, Path(src_dir))
+        if not src.exists():
+            continue
+        dst = model_path(appl, dst_dir)
+        joblib.dump(load_model(src), dst, compress=0)
+        written[appl] = dst
+    return written
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export models for memory-mapped loading")
+    parser.add_argument("dst_dir", type=Path)
+    parser.add_argument("--src-dir", type=Path, default=MODELS_DIR)
+    args = parser.parse_args()
+    for appl, dst in export_for_mmap(args.dst_dir, args.src_dir).items():
+        print(f"{appl} -> {dst}")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Time, String, Integer, Float, DateTime, Boolean, ForeignKey
+from sqlalchemy import Column, Time, String, Integer, Float, DateTime, Boolean, ForeignKey, Index, Text, UniqueConstraint
 from sqlalchemy.orm import declarative_base, relationship
 
 Base = declarative_base()
@@ -25,6 +25,7 @@ class Device(Base):
     recommend_only = Column(Boolean, default=True)
     auto_off       = Column(Boolean, default=False)
     owner_id       = Column(Integer, ForeignKey("users.id"))  # FK to users.id
+    deleted_at     = Column(DateTime, nullable=True)          # hidden; purge job removes it
 
     owner = relationship("User", back_populates="devices")
     schedules = relationship(
@@ -40,15 +41,90 @@ class DeviceSchedule(Base):
     device_id           = Column(String(36), ForeignKey("devices.id"), nullable=False)
     start_time          = Column(Time, nullable=False)     
     end_time            = Column(Time, nullable=False)    
-    days                = Column(String(255), nullable=False)
+    days_mask           = Column(Integer, nullable=False)  # bit 0 = Mon … bit 6 = Sun
     send_email_reminder = Column(Boolean, default=False)
 
     device = relationship("Device", back_populates="schedules")
 
+class DeviceKey(Base):
+    """API key of one device: `dk_<id>.<secret>`, stored as a keyed HMAC of the whole key."""
+    __tablename__ = "device_keys"
+
+    id         = Column(String(16), primary_key=True)     # public part of the key
+    device_id  = Column(String(36), ForeignKey("devices.id"), nullable=False, index=True)
+    digest     = Column(String(64), nullable=False)       # HMAC-SHA256 hex
+    created_at = Column(DateTime, nullable=False)
+    revoked_at = Column(DateTime, nullable=True)
+
+class ShardMoveProgress(Base):
+    """Last source id of a device's rows copied into this shard by an unfinished move (app/sharding.py)."""
+    __tablename__ = "shard_move_progress"
+
+    device_id  = Column(String(36), primary_key=True)
+    source     = Column(String(16), primary_key=True)   # digest of the source shard's URL
+    table_name = Column(String(32), primary_key=True)
+    last_id    = Column(Integer, nullable=False)
+
+class DeviceMove(Base):
+    """History of a device whose house changed, waiting to move shards (app/moves.py)."""
+    __tablename__ = "device_moves"
+
+    id         = Column(Integer, primary_key=True, autoincrement=True)
+    device_id  = Column(String(36), ForeignKey("devices.id"), nullable=False, index=True)
+    from_house = Column(Integer, nullable=False)
+    to_house   = Column(Integer, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
+class CacheVersion(Base):
+    """Response-cache version counter shared by every worker (app/cache.py)."""
+    __tablename__ = "cache_versions"
+
+    key        = Column(String(64), primary_key=True)    # "owner:3", "device:<uuid>", …
+    version    = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, nullable=False, index=True)   # workers poll bumps since their last look
+
 class Reading(Base):
     __tablename__ = "readings"
+    __table_args__ = (
+        # One sample per device per timestamp: retried uploads are no-ops.
+        # Also serves the per-device time-range and latest-reading lookups.
+        Index("uq_reading_device_ts", "device_id", "ts", unique=True),
+    )
 
     id        = Column(Integer, primary_key=True, autoincrement=True)
-    device_id = Column(String(36), ForeignKey("devices.id"), nullable=False)
+    # No FK: readings may live on a different shard database than devices
+    device_id = Column(String(36), nullable=False)
     ts        = Column(DateTime, nullable=False)
     watts     = Column(Float, nullable=False)
+
+class ReadingRollup(Base):
+    """Compacted raw readings: one row per device per minute/hour bucket."""
+    __tablename__ = "reading_rollups"
+    __table_args__ = (
+        UniqueConstraint("device_id", "resolution", "bucket_start", name="uq_rollup_bucket"),
+    )
+
+    id           = Column(Integer, primary_key=True, autoincrement=True)
+    device_id    = Column(String(36), nullable=False)
+    resolution   = Column(Integer, nullable=False)   # bucket width in seconds (60 | 3600)
+    bucket_start = Column(DateTime, nullable=False)
+    samples      = Column(Integer, nullable=False)   # raw readings folded in
+    sum_watts    = Column(Float, nullable=False)
+    min_watts    = Column(Float, nullable=False)
+    max_watts    = Column(Float, nullable=False)
+
+class ReadingSketch(Base):
+    """Mergeable watt-distribution sketch (DDSketch) per device per UTC day."""
+    __tablename__ = "reading_sketches"
+    __table_args__ = (
+        UniqueConstraint("device_id", "day", name="uq_sketch_day"),
+    )
+
+    id        = Column(Integer, primary_key=True, autoincrement=True)
+    device_id = Column(String(36), nullable=False)
+    day       = Column(DateTime, nullable=False)
+    samples   = Column(Integer, nullable=False)
+    sum_watts = Column(Float, nullable=False)
+    min_watts = Column(Float, nullable=False)
+    max_watts = Column(Float, nullable=False)
+    bins      = Column(Text, nullable=False)   # JSON: accuracy, zero count, bucket counts
@@ -0,0 +1,171 @@
+import logging
+import os
+import threading
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from . import cache, database, locks, models, purge, sharding
+
+logger = logging.getLogger("moves")
+
+# ── Policy ─────────────────────────────────────────────────────────────────────
+# update_device only records a DeviceMove when a device changes house; this
+# job carries its readings, rollups and sketches to the new house's shard in
+# small batches, oldest move first. Until then the history stays on the old
+# shard and reads of the device only see what was ingested since the change.
+BATCH_SIZE  = int(os.getenv("MOVE_BATCH_SIZE", 5000))
+BATCH_PAUSE = float(os.getenv("MOVE_BATCH_PAUSE", 0.1))   # seconds between batches
+INTERVAL    = float(os.getenv("MOVE_INTERVAL", 60))       # seconds between scans
+LOCK_FILE   = os.getenv("MOVE_LOCK_FILE", locks.lock_path("moves"))
+GRACE       = float(os.getenv("MOVE_GRACE", 0))           # seconds; 0 = purge.grace()
+
+# ── Progress metrics ───────────────────────────────────────────────────────────
+@dataclass
+class MoveStats:
+    running: bool = False
+    runs: int = 0
+    device_id: Optional[str] = None
+    device_rows_moved: int = 0
+    batches: int = 0
+    rows_moved: int = 0
+    moves_done: int = 0
+    last_run_started: Optional[datetime] = None
+    last_run_finished: Optional[datetime] = None
+    last_error: Optional[str] = None
+
+STATS = MoveStats()
+
+def grace() -> float:
+    """
+    How long a recorded move waits. Other workers keep routing the device
+    to its old shard until their caches and sketch deltas catch up, and the
+    move has to carry those rows too, so it waits as long as a purge.
+    """
+    return GRACE or purge.grace()
+
+def pending_moves(due_only: bool = False) -> List[models.DeviceMove]:
+    """
+    Moves not finished yet, oldest first; with `due_only`, just those
+    recorded longer than grace() ago.
+    """
+    with database.SessionLocal() as db:
+        query = db.query(models.DeviceMove)
+        if due_only:
+            query = query.filter(models.DeviceMove.created_at <= datetime.utcnow() - timedelta(seconds=grace()))
+        return query.order_by(models.DeviceMove.id).all()
+
+def status() -> dict:
+    return {
+        "batch_size": BATCH_SIZE,
+        "grace_seconds": grace(),
+        "pending_moves": [
+            {"device_id": m.device_id, "from_house": m.from_house, "to_house": m.to_house,
+             "created_at": m.created_at}
+            for m in pending_moves()
+        ],
+        **asdict(STATS)
+    }
+
+# ── Moving ─────────────────────────────────────────────────────────────────────
+def _progress(n: int):
+    STATS.batches += 1
+    STATS.rows_moved += n
+    STATS.device_rows_moved += n
+
+def run_move(move: models.DeviceMove, batch_size: int = BATCH_SIZE, pause: float = BATCH_PAUSE,
+             stop: Optional[threading.Event] = None) -> bool:
+    """
+    Carry one device's history from its old house's shard to the new one,
+    then drop the move. Returns False if stopped before finishing; moves
+    are resumable, so the next run picks up where this one left off.
+    """
+    STATS.device_id, STATS.device_rows_moved = move.device_id, 0
+    with database.SessionLocal() as db:
+        device = db.get(models.Device, move.device_id)
+        # A deleted device's rows are the purge job's, on whichever shard
+        moving = device is not None and device.deleted_at is None
+    if moving:
+        sharding.move_device_readings(
+            database.router.engine_for(move.from_house),
+            database.router.engine_for(move.to_house),
+            move.device_id, batch_size, pause, stop, _progress
+        )
+        if stop and stop.is_set():
+            return False
+    with database.SessionLocal() as db:
+        db.query(models.DeviceMove).filter(models.DeviceMove.id == move.id).delete()
+        db.commit()
+    if moving:
+        cache.bump(("readings", move.device_id))
+    STATS.moves_done += 1
+    logger.info("Moved device %s from house %s to %s (%d rows)",
+                move.device_id, move.from_house, move.to_house, STATS.device_rows_moved)
+    return True
+
+def run_once(batch_size: int = BATCH_SIZE, pause: float = BATCH_PAUSE,
+             stop: Optional[threading.Event] = None) -> int:
+    """Run every move recorded longer than grace() ago; returns how many were finished."""
+    STATS.running = True
+    STATS.last_run_started, STATS.last_error = datetime.utcnow(), None
+    done = 0
+    try:
+        for move in pending_moves(due_only=True):
+            if not run_move(move, batch_size, pause, stop):
+                break
+            done += 1
+    except Exception as e:
+        STATS.last_error = repr(e)
+        logger.exception("Move run failed")
+    finally:
+        STATS.running, STATS.device_id = False, None
+        STATS.runs += 1
+        STATS.last_run_finished = datetime.utcnow()
+    return done
+
+# ── Background job ─────────────────────────────────────────────────────────────
+_stop = threading.Event()
+_wake = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+def _loop():
+    lock = None
+    while not _stop.is_set():
+        lock = lock or locks.try_lock(LOCK_FILE)
+        if lock:
+            run_once(stop=_stop)
+        _wake.wait(INTERVAL)
+        _wake.clear()
+    if lock:
+        lock.close()
+
+def wake():
+    """Start a run now instead of at the next interval (this process only)."""
+    _wake.set()
+
+def start():
+    """Scan for recorded moves every MOVE_INTERVAL seconds in one worker process."""
+    global _thread
+    if _thread and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="device-moves", daemon=True)
+    _thread.start()
+
+def stop():
+    global _thread
+    _stop.set()
+    _wake.set()
+    if _thread:
+        _thread.join(timeout=5)
+        _thread = None
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Move the readings of re-housed devices once")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=BATCH_PAUSE)
+    args = parser.parse_args()
+    n = run_once(args.batch_size, args.pause)
+    print(f"Finished {n} moves; {STATS.rows_moved} rows moved")
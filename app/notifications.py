@@ -1,13 +1,9 @@
 import os
-from dotenv import load_dotenv
 import smtplib
 import ssl
 import logging
 from email.mime.text import MIMEText
 
-# Load environment variables from .env file
-load_dotenv()
-
 # Configure logger for email notifications
 glogger = logging.getLogger("notifications")
 glogger.setLevel(logging.DEBUG)
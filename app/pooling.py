@@ -0,0 +1,172 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Optional
+
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger("pooling")
+
+# ── Pool settings ──────────────────────────────────────────────────────────────
+# Applied to the primary, every readings shard and every replica engine.
+POOL_SIZE     = int(os.getenv("DB_POOL_SIZE", 5))
+MAX_OVERFLOW  = int(os.getenv("DB_MAX_OVERFLOW", 10))
+POOL_TIMEOUT  = float(os.getenv("DB_POOL_TIMEOUT", 30))      # seconds to wait for a connection
+POOL_RECYCLE  = int(os.getenv("DB_POOL_RECYCLE", 1800))      # below MySQL's wait_timeout
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true")
+
+# ── Replica policy ─────────────────────────────────────────────────────────────
+REPLICA_MAX_LAG     = float(os.getenv("DB_REPLICA_MAX_LAG", 5))     # seconds
+REPLICA_CHECK_EVERY = float(os.getenv("DB_REPLICA_LAG_CHECK", 2))   # seconds between lag probes
+
+# ── Checkout timing ────────────────────────────────────────────────────────────
+@dataclass
+class CheckoutStats:
+    checkouts: int = 0
+    timeouts: int = 0
+    wait_total_ms: float = 0.0
+    wait_max_ms: float = 0.0
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def __init__(self, *args, **kw):
+        super().__init__(*args, **kw)
+        self.stats = CheckoutStats()
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        t0 = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            ms = (time.perf_counter() - t0) * 1000
+            with self._stats_lock:
+                s = self.stats
+                s.checkouts += 1
+                s.timeouts += timed_out
+                s.wait_total_ms += ms
+                s.wait_max_ms = max(s.wait_max_ms, ms)
+
+def make_engine(url: str) -> Engine:
+    """create_engine with the DB_POOL_* settings."""
+    u = make_url(url)
+    if u.get_backend_name() == "sqlite" and u.database in (None, "", ":memory:"):
+        # In-memory SQLite uses a per-thread pool that takes no sizing
+        return create_engine(url, future=True)
+    return create_engine(
+        url,
+        future=True,
+        poolclass=TimedQueuePool,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT,
+        pool_recycle=POOL_RECYCLE,
+        pool_pre_ping=POOL_PRE_PING,
+    )
+
+def pool_status(eng: Engine) -> dict:
+    """Occupancy, saturation (checked out / capacity) and checkout waits."""
+    pool = eng.pool
+    if not isinstance(pool, QueuePool):
+        return {"pool": type(pool).__name__}
+    overflow = max(pool._max_overflow, 0)
+    capacity = pool.size() + overflow
+    out = {
+        "size": pool.size(),
+        "max_overflow": overflow,
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        "saturation": round(pool.checkedout() / capacity, 3) if capacity else 0.0,
+    }
+    stats = getattr(pool, "stats", None)
+    if stats is not None:
+        out.update(asdict(stats))
+        out["wait_avg_ms"] = stats.wait_total_ms / stats.checkouts if stats.checkouts else 0.0
+    return out
+
+# ── Replicas ───────────────────────────────────────────────────────────────────
+_PG_LAG = text(
+    "SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+def replication_lag(eng: Engine) -> Optional[float]:
+    """Seconds `eng` is behind its primary, or None if it can't tell."""
+    dialect = eng.dialect.name
+    if dialect == "sqlite":
+        return 0.0          # a local file copy has nothing to replay
+    with eng.connect() as conn:
+        if dialect == "postgresql":
+            lag = conn.execute(_PG_LAG).scalar()
+            return None if lag is None else float(lag)
+        if dialect in ("mysql", "mariadb"):
+            for stmt in ("SHOW REPLICA STATUS", "SHOW SLAVE STATUS"):   # 8.0.22+ / older
+                try:
+                    row = conn.execute(text(stmt)).mappings().first()
+                except exc.DBAPIError:
+                    continue
+                if row is None:
+                    return None     # not configured as a replica
+                lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+                return None if lag is None else float(lag)   # NULL: replication stopped
+    return None
+
+class Replica:
+    """
+    Read replica of one primary engine. It is used only while its measured
+    lag is at most `max_lag`; the lag is re-probed at most every
+    `check_every` seconds by one caller, so a read costs no extra query.
+    """
+
+    def __init__(self, engine: Engine, max_lag: float = REPLICA_MAX_LAG,
+                 check_every: float = REPLICA_CHECK_EVERY,
+                 clock: Callable[[], float] = time.monotonic):
+        self.engine = engine
+        self.max_lag = max_lag
+        self.check_every = check_every
+        self.clock = clock
+        self.lag: Optional[float] = None
+        self.checked_at: Optional[float] = None
+        self.reads = 0
+        self.fallbacks = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def usable(self) -> bool:
+        now = self.clock()
+        due = self.checked_at is None or now - self.checked_at >= self.check_every
+        if due and self._lock.acquire(blocking=False):
+            try:
+                self.checked_at = now
+                self.lag = replication_lag(self.engine)
+            except Exception as e:
+                self.lag = None
+                self.errors += 1
+                logger.warning("Replica lag probe failed: %r", e)
+            finally:
+                self._lock.release()
+        ok = self.lag is not None and self.lag <= self.max_lag
+        if ok:
+            self.reads += 1
+        else:
+            self.fallbacks += 1
+        return ok
+
+    def status(self) -> dict:
+        return {
+            "lag": self.lag,
+            "max_lag": self.max_lag,
+            "reads": self.reads,
+            "fallbacks": self.fallbacks,
+            "probe_errors": self.errors,
+            "pool": pool_status(self.engine),
+        }
@@ -0,0 +1,207 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import delete, select
+from sqlalchemy.engine import Engine
+
+from . import database, locks, models
+
+logger = logging.getLogger("purge")
+
+# ── Policy ─────────────────────────────────────────────────────────────────────
+# delete_device only marks the device; this job removes its data from every
+# readings shard in small id-ordered batches and then the device row itself.
+BATCH_SIZE  = int(os.getenv("PURGE_BATCH_SIZE", 5000))
+BATCH_PAUSE = float(os.getenv("PURGE_BATCH_PAUSE", 0.1))   # seconds between batches
+INTERVAL    = float(os.getenv("PURGE_INTERVAL", 60))       # seconds between scans
+LOCK_FILE   = os.getenv("PURGE_LOCK_FILE", locks.lock_path("purge"))
+GRACE       = float(os.getenv("PURGE_GRACE", 0))           # seconds; 0 = derive, see grace()
+
+# Derived tables first, so nothing outlives the raw readings it came from
+PURGED_MODELS = (models.ReadingSketch, models.ReadingRollup, models.Reading)
+
+# ── Progress metrics ───────────────────────────────────────────────────────────
+@dataclass
+class PurgeStats:
+    running: bool = False
+    runs: int = 0
+    device_id: Optional[str] = None
+    device_rows_deleted: int = 0
+    batches: int = 0
+    rows_deleted: int = 0
+    devices_purged: int = 0
+    last_batch_ms: float = 0.0
+    last_run_started: Optional[datetime] = None
+    last_run_finished: Optional[datetime] = None
+    last_error: Optional[str] = None
+
+STATS = PurgeStats()
+
+def grace() -> float:
+    """
+    How long a deleted device is left alone. Other workers can still write
+    for it until their sketch deltas flush and their stream sessions and
+    device-key caches let it go; anything they write after the purge would
+    never be removed, so wait twice the longest of those first.
+    """
+    if GRACE:
+        return GRACE
+    from . import cache, device_keys, sketches, streams
+    return 2 * max(sketches.FLUSH_INTERVAL, streams.DEVICE_TTL, cache.DEFAULT_TTL, device_keys.CACHE_TTL)
+
+def pending_devices(due_only: bool = False):
+    """
+    Ids of devices marked deleted whose data is not purged yet, oldest
+    first; with `due_only`, just those deleted longer than grace() ago.
+    """
+    with database.SessionLocal() as db:
+        query = db.query(models.Device.id).filter(models.Device.deleted_at.isnot(None))
+        if due_only:
+            query = query.filter(models.Device.deleted_at <= datetime.utcnow() - timedelta(seconds=grace()))
+        return [did for (did,) in query.order_by(models.Device.deleted_at)]
+
+def status() -> dict:
+    return {
+        "batch_size": BATCH_SIZE,
+        "grace_seconds": grace(),
+        "pending_devices": pending_devices(),
+        **asdict(STATS)
+    }
+
+# ── Deletion ───────────────────────────────────────────────────────────────────
+def delete_batch(eng: Engine, model, device_id: str, batch_size: int = BATCH_SIZE) -> int:
+    """Delete up to `batch_size` of a device's rows in one short transaction."""
+    table = model.__table__
+    with eng.begin() as conn:
+        ids = conn.execute(
+            select(table.c.id)
+            .where(table.c.device_id == device_id)
+            .order_by(table.c.id)
+            .limit(batch_size)
+        ).scalars().all()
+        if ids:
+            conn.execute(delete(table).where(table.c.id.in_(ids)))
+    return len(ids)
+
+def purge_device(device_id: str, batch_size: int = BATCH_SIZE, pause: float = BATCH_PAUSE,
+                 stop: Optional[threading.Event] = None) -> bool:
+    """
+    Remove a deleted device's readings, rollups and sketches from every
+    shard, then its row. Returns False if stopped before finishing; the
+    next run picks up where this one left off.
+    """
+    STATS.device_id, STATS.device_rows_deleted = device_id, 0
+    for eng in {id(e): e for e in database.router.engines.values()}.values():
+        for model in PURGED_MODELS:
+            while True:
+                if stop and stop.is_set():
+                    return False
+                t0 = time.perf_counter()
+                n = delete_batch(eng, model, device_id, batch_size)
+                STATS.last_batch_ms = (time.perf_counter() - t0) * 1000
+                if not n:
+                    break
+                STATS.batches += 1
+                STATS.rows_deleted += n
+                STATS.device_rows_deleted += n
+                if n < batch_size:
+                    break
+                # Throttle so ingestion keeps the DB's attention
+                if pause and stop:
+                    stop.wait(pause)
+                elif pause:
+                    time.sleep(pause)
+        # Left behind by a shard move the device's deletion cut short
+        P = models.ShardMoveProgress.__table__
+        with eng.begin() as conn:
+            conn.execute(delete(P).where(P.c.device_id == device_id))
+
+    with database.SessionLocal() as db:
+        db.query(models.DeviceSchedule) \
+          .filter(models.DeviceSchedule.device_id == device_id) \
+          .delete()
+        db.query(models.DeviceKey) \
+          .filter(models.DeviceKey.device_id == device_id) \
+          .delete()
+        db.query(models.DeviceMove) \
+          .filter(models.DeviceMove.device_id == device_id) \
+          .delete()
+        db.query(models.Device) \
+          .filter(models.Device.id == device_id, models.Device.deleted_at.isnot(None)) \
+          .delete()
+        db.commit()
+    STATS.devices_purged += 1
+    logger.info("Purged device %s (%d rows)", device_id, STATS.device_rows_deleted)
+    return True
+
+def run_once(batch_size: int = BATCH_SIZE, pause: float = BATCH_PAUSE,
+             stop: Optional[threading.Event] = None) -> int:
+    """Purge every device deleted longer than grace() ago; returns how many were finished."""
+    STATS.running = True
+    STATS.last_run_started, STATS.last_error = datetime.utcnow(), None
+    done = 0
+    try:
+        for device_id in pending_devices(due_only=True):
+            if not purge_device(device_id, batch_size, pause, stop):
+                break
+            done += 1
+    except Exception as e:
+        STATS.last_error = repr(e)
+        logger.exception("Purge run failed")
+    finally:
+        STATS.running, STATS.device_id = False, None
+        STATS.runs += 1
+        STATS.last_run_finished = datetime.utcnow()
+    return done
+
+# ── Background job ─────────────────────────────────────────────────────────────
+_stop = threading.Event()
+_wake = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+def _loop():
+    lock = None
+    while not _stop.is_set():
+        lock = lock or locks.try_lock(LOCK_FILE)
+        if lock:
+            run_once(stop=_stop)
+        _wake.wait(INTERVAL)
+        _wake.clear()
+    if lock:
+        lock.close()
+
+def wake():
+    """Start a run now instead of at the next interval (this process only)."""
+    _wake.set()
+
+def start():
+    """Scan for deleted devices every PURGE_INTERVAL seconds in one worker process."""
+    global _thread
+    if _thread and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="device-purge", daemon=True)
+    _thread.start()
+
+def stop():
+    global _thread
+    _stop.set()
+    _wake.set()
+    if _thread:
+        _thread.join(timeout=5)
+        _thread = None
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Remove data of deleted devices once")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=BATCH_PAUSE)
+    args = parser.parse_args()
+    n = run_once(args.batch_size, args.pause)
+    print(f"Purged {n} devices; {STATS.rows_deleted} rows deleted")
@@ -0,0 +1,205 @@
+import logging
+import os
+import threading
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from sqlalchemy import delete, select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import database, locks, models
+
+logger = logging.getLogger("retention")
+
+# ── Policy ─────────────────────────────────────────────────────────────────────
+# Raw readings older than RETENTION_RAW_DAYS are folded into per-minute or
+# per-hour ReadingRollup rows and then deleted. 0 (default) disables the job.
+RESOLUTIONS = {"minute": 60, "hour": 3600}
+
+RAW_DAYS    = float(os.getenv("RETENTION_RAW_DAYS", 0))
+BUCKET      = os.getenv("RETENTION_BUCKET", "hour")
+BATCH_SIZE  = int(os.getenv("RETENTION_BATCH_SIZE", 1000))
+BATCH_PAUSE = float(os.getenv("RETENTION_BATCH_PAUSE", 0.2))   # seconds between batches
+INTERVAL    = float(os.getenv("RETENTION_INTERVAL", 3600))     # seconds between runs
+LOCK_FILE   = os.getenv("RETENTION_LOCK_FILE", locks.lock_path("retention"))
+
+_EPOCH = datetime(1970, 1, 1)
+
+def bucket_start(ts: datetime, resolution: int) -> datetime:
+    """Floor `ts` to the start of its `resolution`-second bucket."""
+    secs = int((ts - _EPOCH).total_seconds())
+    return _EPOCH + timedelta(seconds=secs - secs % resolution)
+
+def horizon(now: Optional[datetime] = None) -> Optional[datetime]:
+    """
+    Start of the oldest bucket still kept raw under the current policy
+    (None when retention is off). Anything older may be compacted already.
+    """
+    if RAW_DAYS <= 0:
+        return None
+    return bucket_start((now or datetime.utcnow()) - timedelta(days=RAW_DAYS), RESOLUTIONS[BUCKET])
+
+# ── Progress metrics ───────────────────────────────────────────────────────────
+@dataclass
+class RetentionStats:
+    running: bool = False
+    runs: int = 0
+    shard: Optional[str] = None
+    cutoff: Optional[datetime] = None
+    batches: int = 0
+    rows_compacted: int = 0
+    rollups_written: int = 0
+    last_batch_ms: float = 0.0
+    last_run_started: Optional[datetime] = None
+    last_run_finished: Optional[datetime] = None
+    last_error: Optional[str] = None
+
+STATS = RetentionStats()
+
+def status() -> dict:
+    return {
+        "enabled": RAW_DAYS > 0,
+        "raw_days": RAW_DAYS,
+        "bucket": BUCKET,
+        "batch_size": BATCH_SIZE,
+        **asdict(STATS),
+    }
+
+# ── Compaction ─────────────────────────────────────────────────────────────────
+def compact_batch(eng: Engine, cutoff: datetime, resolution: int,
+                  batch_size: int = BATCH_SIZE, after_id: int = 0) -> Tuple[int, int, int]:
+    """
+    Fold up to `batch_size` raw readings older than `cutoff` with ids above
+    `after_id` into rollups and delete them, in one short transaction so
+    nothing is counted twice. Returns (raw rows removed, rollup rows
+    touched, last id examined); pass the last to the next batch.
+    """
+    R, U = models.Reading, models.ReadingRollup
+    with Session(eng) as s, s.begin():
+        # readings has no index on ts: walk the primary key from where the
+        # previous batch stopped, so a run reads every row at most once
+        rows = s.execute(
+            select(R.id, R.device_id, R.ts, R.watts)
+            .where(R.id > after_id, R.ts < cutoff)
+            .order_by(R.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return 0, 0, after_id
+
+        buckets = {}
+        for r in rows:
+            key = (r.device_id, bucket_start(r.ts, resolution))
+            b = buckets.get(key)
+            if b is None:
+                buckets[key] = [1, r.watts, r.watts, r.watts]
+            else:
+                b[0] += 1
+                b[1] += r.watts
+                b[2] = min(b[2], r.watts)
+                b[3] = max(b[3], r.watts)
+
+        existing = {
+            (u.device_id, u.bucket_start): u
+            for u in s.query(U).filter(
+                U.resolution == resolution,
+                U.device_id.in_({d for d, _ in buckets}),
+                U.bucket_start.in_({t for _, t in buckets})
+            )
+        }
+        for (device_id, start), (n, total, lo, hi) in buckets.items():
+            u = existing.get((device_id, start))
+            if u is None:
+                s.add(U(device_id=device_id, resolution=resolution, bucket_start=start,
+                        samples=n, sum_watts=total, min_watts=lo, max_watts=hi))
+            else:
+                u.samples += n
+                u.sum_watts += total
+                u.min_watts = min(u.min_watts, lo)
+                u.max_watts = max(u.max_watts, hi)
+
+        s.execute(delete(R.__table__).where(R.__table__.c.id.in_([r.id for r in rows])))
+    return len(rows), len(buckets), rows[-1].id
+
+def run_once(raw_days: float = RAW_DAYS, bucket: str = BUCKET,
+             batch_size: int = BATCH_SIZE, pause: float = BATCH_PAUSE,
+             stop: Optional[threading.Event] = None) -> int:
+    """Compact every shard once; returns the number of raw rows removed."""
+    resolution = RESOLUTIONS[bucket]
+    cutoff = bucket_start(datetime.utcnow() - timedelta(days=raw_days), resolution)
+    STATS.running, STATS.cutoff = True, cutoff
+    STATS.last_run_started, STATS.last_error = datetime.utcnow(), None
+    removed = 0
+    try:
+        for name, eng in database.router.engines.items():
+            STATS.shard = name
+            last_id = 0
+            while not (stop and stop.is_set()):
+                t0 = time.perf_counter()
+                n, touched, last_id = compact_batch(eng, cutoff, resolution, batch_size, last_id)
+                STATS.last_batch_ms = (time.perf_counter() - t0) * 1000
+                if not n:
+                    break
+                removed += n
+                STATS.batches += 1
+                STATS.rows_compacted += n
+                STATS.rollups_written += touched
+                # Throttle so ingestion keeps the DB's attention
+                if pause and stop:
+                    stop.wait(pause)
+                elif pause:
+                    time.sleep(pause)
+    except Exception as e:
+        STATS.last_error = repr(e)
+        logger.exception("Retention run failed")
+    finally:
+        STATS.running, STATS.shard = False, None
+        STATS.runs += 1
+        STATS.last_run_finished = datetime.utcnow()
+    logger.info("Retention compacted %d readings older than %s", removed, cutoff)
+    return removed
+
+# ── Background job ─────────────────────────────────────────────────────────────
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+def _loop():
+    lock = None
+    while not _stop.is_set():
+        lock = lock or locks.try_lock(LOCK_FILE)
+        if lock:
+            run_once(stop=_stop)
+        _stop.wait(INTERVAL)
+    if lock:
+        lock.close()
+
+def start():
+    """Run the policy every RETENTION_INTERVAL seconds in one worker process."""
+    global _thread
+    if RAW_DAYS <= 0 or (_thread and _thread.is_alive()):
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="retention", daemon=True)
+    _thread.start()
+
+def stop():
+    global _thread
+    _stop.set()
+    if _thread:
+        _thread.join(timeout=5)
+        _thread = None
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compact raw readings into rollups once")
+    parser.add_argument("--days", type=float, default=RAW_DAYS or 30)
+    parser.add_argument("--bucket", choices=sorted(RESOLUTIONS), default=BUCKET)
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=BATCH_PAUSE)
+    args = parser.parse_args()
+    n = run_once(args.days, args.bucket, args.batch_size, args.pause)
+    print(f"Compacted {n} readings; {STATS.rollups_written} rollup rows written/updated")
@@ -0,0 +1,329 @@
+import heapq
+import logging
+import os
+import threading
+import time as _time
+from dataclasses import dataclass
+from datetime import datetime, time, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from . import locks
+
+logger = logging.getLogger("scheduler")
+
+# ── Day bitmasks ───────────────────────────────────────────────────────────────
+# Bit i is set when the schedule runs on weekday i (Mon = 0 … Sun = 6), which
+# matches datetime.weekday() so "does it run today?" is a single AND.
+DAY_NAMES = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+DAY_BITS  = {name: 1 << i for i, name in enumerate(DAY_NAMES)}
+ALL_DAYS  = 0x7F
+
+def days_to_mask(days: Iterable) -> int:
+    """Convert ["Mon", "Wed"] (or Day enums) to a weekday bitmask."""
+    mask = 0
+    for d in days:
+        mask |= DAY_BITS[getattr(d, "value", d)]
+    return mask
+
+def mask_to_days(mask: int) -> List[str]:
+    """Convert a weekday bitmask back to ["Mon", "Wed", …]."""
+    return [name for i, name in enumerate(DAY_NAMES) if mask & (1 << i)]
+
+def shift_mask(mask: int) -> int:
+    """Rotate a weekday mask by one day (Sun wraps to Mon)."""
+    return ((mask << 1) | (mask >> 6)) & ALL_DAYS
+
+def next_fire(after: datetime, at: time, mask: int) -> Optional[datetime]:
+    """
+    Return the first datetime strictly after `after` whose weekday is in
+    `mask` and whose wall-clock time is `at`. None if the mask is empty.
+    """
+    if not mask & ALL_DAYS:
+        return None
+    day = after.date()
+    for offset in range(8):
+        candidate = datetime.combine(day + timedelta(days=offset), at)
+        if candidate > after and mask & (1 << candidate.weekday()):
+            return candidate
+    return None
+
+# ── Engine ─────────────────────────────────────────────────────────────────────
+START, END = "START", "END"
+
+@dataclass
+class ScheduleEvent:
+    """A schedule edge that became due: START switches ON, END switches OFF."""
+    schedule_id: int
+    device_id: str
+    edge: str
+    fire_at: datetime
+    send_email_reminder: bool
+
+    @property
+    def action(self) -> str:
+        return "ON" if self.edge == START else "OFF"
+
+@dataclass
+class _Entry:
+    device_id: str
+    start_time: time
+    end_time: time
+    days_mask: int
+    send_email_reminder: bool
+    version: int
+
+class ScheduleEngine:
+    """
+    In-process executor for DeviceSchedule rows.
+
+    Keeps one min-heap of (fire_at, schedule_id, edge, version) across all
+    schedules. Updates and deletes bump the entry version instead of searching
+    the heap, so stale heap items are discarded lazily when they surface.
+    A tick with nothing due is a single peek at heap[0].
+    """
+
+    def __init__(
+        self,
+        on_fire: Optional[Callable[[ScheduleEvent], None]] = None,
+        clock: Callable[[], datetime] = datetime.now,
+        loader: Optional[Callable[[], Iterable]] = None,
+        feed: Optional[Callable[[datetime], Iterable[Tuple[str, datetime, Iterable]]]] = None,
+        lock_path: Optional[str] = None,
+        poll_interval: float = 2.0,
+    ):
+        self.on_fire = on_fire
+        self.clock = clock
+        # With several worker processes only the holder of `lock_path` fires
+        # schedules. It seeds itself once via `loader` when it takes the
+        # lock, then every `poll_interval` seconds asks `feed(since)` for the
+        # devices whose schedules changed since then, as
+        # (device_id, changed_at, that device's current schedules).
+        self.loader = loader
+        self.feed = feed
+        self.lock_path = lock_path
+        self.poll_interval = poll_interval
+        self._lock_file = None
+        self._entries: Dict[int, _Entry] = {}
+        self._heap: List[Tuple[datetime, int, str, int]] = []
+        self._version = 0
+        self._cond = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # -- incremental maintenance ----------------------------------------------
+    def upsert(self, schedule_id: int, device_id: str, start_time: time,
+               end_time: time, days_mask: int, send_email_reminder: bool = False):
+        """Add or replace a schedule and arm its next START/END edges."""
+        with self._cond:
+            self._set(schedule_id, device_id, start_time, end_time, days_mask,
+                      send_email_reminder, self.clock())
+            self._maybe_compact()
+            self._cond.notify()
+
+    def replace_device(self, device_id: str, schedules: Iterable, after: datetime):
+        """
+        Make `schedules` the device's only schedules. Unchanged ones keep
+        their armed edges; new or edited ones are armed from `after`, the
+        time of the change, so an edge due since then fires on the next tick.
+        """
+        device_id = str(device_id)
+        with self._cond:
+            keep = set()
+            for s in schedules:
+                keep.add(s.id)
+                entry = self._entries.get(s.id)
+                if entry is not None and (entry.device_id, entry.start_time, entry.end_time,
+                                          entry.days_mask, entry.send_email_reminder) == \
+                        (device_id, s.start_time, s.end_time, s.days_mask, bool(s.send_email_reminder)):
+                    continue
+                self._set(s.id, device_id, s.start_time, s.end_time, s.days_mask,
+                          s.send_email_reminder, after)
+            for sid in [sid for sid, e in self._entries.items()
+                        if e.device_id == device_id and sid not in keep]:
+                del self._entries[sid]
+            self._maybe_compact()
+            self._cond.notify()
+
+    def load(self, schedules: Iterable, after: Optional[datetime] = None):
+        """
+        Bulk-load DeviceSchedule rows, rebuilding the heap in O(n); used to
+        seed the engine. Edges are armed from `after` (default: now); pass
+        the time before the rows were read so edges that came due meanwhile
+        still fire.
+        """
+        with self._cond:
+            self._entries.clear()
+            self._heap = []
+            now = after or self.clock()
+            for s in schedules:
+                self._version += 1
+                entry = _Entry(str(s.device_id), s.start_time, s.end_time,
+                               s.days_mask, bool(s.send_email_reminder), self._version)
+                self._entries[s.id] = entry
+                for edge in (START, END):
+                    when = self._next_for(entry, edge, now)
+                    if when is not None:
+                        self._heap.append((when, s.id, edge, entry.version))
+            heapq.heapify(self._heap)
+            self._cond.notify()
+
+    def remove(self, schedule_id: int):
+        """Forget a schedule; its heap items become stale."""
+        with self._cond:
+            self._entries.pop(schedule_id, None)
+            self._maybe_compact()
+
+    def remove_device(self, device_id: str):
+        """Forget every schedule belonging to a device."""
+        device_id = str(device_id)
+        with self._cond:
+            for sid in [sid for sid, e in self._entries.items() if e.device_id == device_id]:
+                del self._entries[sid]
+            self._maybe_compact()
+
+    def next_fire_at(self) -> Optional[datetime]:
+        """Earliest pending fire time (may belong to a stale item)."""
+        with self._cond:
+            return self._heap[0][0] if self._heap else None
+
+    # -- execution -------------------------------------------------------------
+    def tick(self, now: Optional[datetime] = None) -> List[ScheduleEvent]:
+        """
+        Pop every edge due at `now`, re-arm it for its next occurrence and
+        dispatch it to on_fire. Returns the fired events.
+        """
+        now = now or self.clock()
+        due: List[ScheduleEvent] = []
+        with self._cond:
+            heap = self._heap
+            while heap and heap[0][0] <= now:
+                when, sid, edge, version = heapq.heappop(heap)
+                entry = self._entries.get(sid)
+                if entry is None or entry.version != version:
+                    continue
+                due.append(ScheduleEvent(sid, entry.device_id, edge, when,
+                                         entry.send_email_reminder))
+                self._arm(sid, entry, edge, now)
+
+        for event in due:
+            if self.on_fire is None:
+                continue
+            try:
+                self.on_fire(event)
+            except Exception:
+                logger.exception("Schedule %s %s handler failed", event.schedule_id, event.edge)
+        return due
+
+    def start(self):
+        """Run tick() in a daemon thread, sleeping until the next fire time."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="schedule-engine", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._stopping = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+        if self._lock_file:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def _hold_lock(self) -> bool:
+        """Become (or stay) the one process that fires schedules."""
+        if not self.lock_path or self._lock_file:
+            return True
+        self._lock_file = locks.try_lock(self.lock_path)
+        if self._lock_file is None:
+            return False
+        logger.info("Schedule engine active in pid %s", os.getpid())
+        return True
+
+    def _run(self):
+        polled_at = None   # engine-clock time the last seed or poll started
+        last_poll = None
+        while True:
+            leader = self._hold_lock()
+            if leader and self.loader and polled_at is None:
+                started = self.clock()
+                try:
+                    # The query can take a while; arm from before it ran and
+                    # fire whatever became due in the meantime right away
+                    self.load(self.loader(), after=started)
+                    polled_at, last_poll = started, _time.monotonic()
+                except Exception:
+                    logger.exception("Schedule seeding failed")
+                self.tick()
+            elif leader and self.feed and polled_at is not None \
+                    and _time.monotonic() - last_poll >= self.poll_interval:
+                started = self.clock()
+                try:
+                    for device_id, changed_at, schedules in self.feed(polled_at):
+                        self.replace_device(device_id, schedules, after=changed_at)
+                    polled_at = started
+                except Exception:
+                    logger.exception("Schedule poll failed")
+                last_poll = _time.monotonic()
+                self.tick()
+
+            with self._cond:
+                if self._stopping:
+                    return
+                timeout = self.poll_interval
+                if leader and self._heap:
+                    wait = (self._heap[0][0] - self.clock()).total_seconds()
+                    timeout = max(0.0, min(wait, timeout))
+                if timeout > 0:
+                    self._cond.wait(timeout)
+                if self._stopping:
+                    return
+            if leader:
+                self.tick()
+
+    # -- internals ---------------------------------------------------------------
+    @staticmethod
+    def _next_for(entry: _Entry, edge: str, after: datetime) -> Optional[datetime]:
+        if edge == START:
+            return next_fire(after, entry.start_time, entry.days_mask)
+        # Overnight windows (22:00 → 06:00) end on the following weekday.
+        mask = entry.days_mask
+        if entry.end_time <= entry.start_time:
+            mask = shift_mask(mask)
+        return next_fire(after, entry.end_time, mask)
+
+    def _set(self, sid: int, device_id: str, start_time: time, end_time: time,
+             days_mask: int, send_email_reminder: bool, after: datetime):
+        self._version += 1
+        entry = _Entry(str(device_id), start_time, end_time, days_mask,
+                       bool(send_email_reminder), self._version)
+        self._entries[sid] = entry
+        self._arm(sid, entry, START, after)
+        self._arm(sid, entry, END, after)
+
+    def _arm(self, sid: int, entry: _Entry, edge: str, after: datetime):
+        when = self._next_for(entry, edge, after)
+        if when is not None:
+            heapq.heappush(self._heap, (when, sid, edge, entry.version))
+
+    def _maybe_compact(self):
+        # Each live schedule owns at most two heap items; once stale items
+        # dominate, rebuild so the heap stays proportional to live schedules.
+        if len(self._heap) > 4 * len(self._entries) + 64:
+            self._heap = [
+                item for item in self._heap
+                if (e := self._entries.get(item[1])) is not None and e.version == item[3]
+            ]
+            heapq.heapify(self._heap)
+
+# Process-wide engine; crud keeps it in sync and main starts it.
+SCHEDULER = ScheduleEngine(
+    lock_path=os.getenv("SCHEDULER_LOCK_FILE", locks.lock_path("scheduler")),
+    poll_interval=float(os.getenv("SCHEDULE_POLL_SECONDS", 2)),
+)
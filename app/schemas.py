@@ -75,6 +75,15 @@ class DeviceOut(DeviceBase):
     id: UUID
     owner_id: int    # added so client sees which user owns it
 
+class DeviceKeyOut(BaseModel):
+    id: str
+    device_id: UUID
+    created_at: datetime
+    revoked_at: Optional[datetime] = None
+
+class DeviceKeyCreated(DeviceKeyOut):
+    key: str         # shown once; only its HMAC is stored
+
 # ---- Readings ----
 class ReadingIn(BaseModel):
     timestamp: datetime
@@ -85,11 +94,25 @@ class BulkReading(BaseModel):
     aggregate: float
     appliances: Dict[str, float]   # keys "Appliance1".."Appliance9"
 
+class StreamReading(ReadingIn):
+    """Single-device frame on /houses/{house_id}/stream."""
+    device_id: str
+
 # ---- Stats ----
-class DeviceStats(BaseModel):
-    id: UUID
+class WattPercentiles(BaseModel):
     avg_watts: float
     total_readings: int
+    p50_watts: Optional[float] = None
+    p90_watts: Optional[float] = None
+    p99_watts: Optional[float] = None
+    max_watts: Optional[float] = None
+
+class DeviceStats(WattPercentiles):
+    id: UUID
+
+class HousePercentiles(WattPercentiles):
+    house_id: int
+    days: Optional[int] = None
 
 class DeviceStatus(BaseModel):
     device_id: UUID
@@ -103,3 +126,23 @@ class ActionOut(BaseModel):
     name: str
     appliance: str  # channel name, e.g. "Appliance3"
     action: str     # "ON" or "OFF"
+
+# ---- Dashboard ----
+class DeviceDashboard(DeviceOut):
+    timestamp: Optional[datetime] = None
+    watts: Optional[float] = None
+    status: str
+    summary: EnergySummary
+    avg_watts: float
+    total_readings: int
+
+class HouseDashboard(BaseModel):
+    house_id: int
+    devices: List[DeviceDashboard]
+
+# ---- Admin ----
+class HouseOverview(BaseModel):
+    house_id: int
+    shard: str
+    devices: int
+    readings: int
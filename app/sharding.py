@@ -0,0 +1,281 @@
+import bisect
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Protocol, TypeVar
+
+from sqlalchemy import delete, func, insert, select, tuple_, update
+from sqlalchemy.engine import Engine
+
+from . import models
+from .sketches import DDSketch
+
+logger = logging.getLogger("sharding")
+
+T = TypeVar("T")
+
+# ── Shard maps ─────────────────────────────────────────────────────────────────
+class ShardMap(Protocol):
+    """Anything that maps a house_id to one of the configured shard names."""
+    def shard_for(self, house_id: int) -> str: ...
+
+class ConsistentHashMap:
+    """
+    Consistent-hash ring with virtual nodes. Adding or removing a shard only
+    moves ~1/N of the houses, which `rebalance` then migrates.
+    `pins` forces specific houses onto a shard (e.g. a very large house).
+    """
+
+    def __init__(self, shards: Iterable[str], vnodes: int = 128,
+                 pins: Optional[Dict[int, str]] = None):
+        self.shards = sorted(set(shards))
+        if not self.shards:
+            raise ValueError("at least one shard is required")
+        self.pins = dict(pins or {})
+        ring = sorted(
+            (self._hash(f"{name}#{i}"), name)
+            for name in self.shards for i in range(vnodes)
+        )
+        self._keys = [k for k, _ in ring]
+        self._names = [n for _, n in ring]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        return int.from_bytes(hashlib.md5(value.encode()).digest()[:8], "big")
+
+    def shard_for(self, house_id: int) -> str:
+        pinned = self.pins.get(house_id)
+        if pinned is not None:
+            return pinned
+        idx = bisect.bisect(self._keys, self._hash(f"house:{house_id}")) % len(self._keys)
+        return self._names[idx]
+
+# ── Router ─────────────────────────────────────────────────────────────────────
+class ShardRouter:
+    """Holds one engine per readings shard and picks one per house."""
+
+    def __init__(self, engines: Dict[str, Engine], shard_map: Optional[ShardMap] = None):
+        if not engines:
+            raise ValueError("at least one shard engine is required")
+        self.engines = dict(engines)
+        self.shard_map = shard_map or ConsistentHashMap(self.engines)
+
+    @property
+    def single(self) -> Optional[Engine]:
+        """The only engine when the readings store is not sharded."""
+        return next(iter(self.engines.values())) if len(self.engines) == 1 else None
+
+    def shard_name(self, house_id: int) -> str:
+        return self.shard_map.shard_for(house_id)
+
+    def engine_for(self, house_id: int) -> Engine:
+        return self.engines[self.shard_name(house_id)]
+
+    def fan_out(self, fn: Callable[[str, Engine], T]) -> Dict[str, T]:
+        """Run `fn(name, engine)` on every shard in parallel."""
+        if len(self.engines) == 1:
+            return {name: fn(name, eng) for name, eng in self.engines.items()}
+        with ThreadPoolExecutor(max_workers=len(self.engines)) as pool:
+            futures = {name: pool.submit(fn, name, eng) for name, eng in self.engines.items()}
+            return {name: f.result() for name, f in futures.items()}
+
+def parse_shard_urls(spec: str) -> Dict[str, str]:
+    """'s0=mysql+pymysql://…,s1=sqlite:///s1.db' → {"s0": …, "s1": …}"""
+    shards: Dict[str, str] = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        name, sep, url = part.partition("=")
+        if not sep or not name.strip() or not url.strip():
+            raise ValueError(f"Invalid DB_SHARDS entry: {part!r} (expected name=url)")
+        shards[name.strip()] = url.strip()
+    return shards
+
+def parse_pins(spec: str) -> Dict[int, str]:
+    """'12=s1,40=s0' → {12: "s1", 40: "s0"}"""
+    pins: Dict[int, str] = {}
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        house, _, shard = part.partition("=")
+        pins[int(house)] = shard.strip()
+    return pins
+
+# ── Moving readings between shards ─────────────────────────────────────────────
+# A move may die between committing a batch on the destination and deleting
+# it from the source. Each batch therefore records the last source id it
+# copied in shard_move_progress, in the same destination transaction, and a
+# resumed move deletes rows up to that id without copying them again. Rows
+# past it are always copied: readings skip stored (device_id, ts) samples,
+# rollups and sketches merge into the destination's row for the same bucket
+# (ingest may have written one there since the device's route changed).
+def _merge_rollups(a, b) -> dict:
+    return {
+        "samples": a.samples + b.samples,
+        "sum_watts": a.sum_watts + b.sum_watts,
+        "min_watts": min(a.min_watts, b.min_watts),
+        "max_watts": max(a.max_watts, b.max_watts),
+    }
+
+def _merge_sketches(a, b) -> dict:
+    sk = DDSketch.from_row(a).merge(DDSketch.from_row(b))
+    return {"samples": sk.count, "sum_watts": sk.sum, "min_watts": sk.min,
+            "max_watts": sk.max, "bins": sk.bins_json()}
+
+# table name → (unique key columns, merge of two rows into column values)
+_MERGED = {
+    models.ReadingRollup.__tablename__: (("device_id", "resolution", "bucket_start"), _merge_rollups),
+    models.ReadingSketch.__tablename__: (("device_id", "day"), _merge_sketches),
+}
+
+def _copy_rows(dconn, table, cols, rows):
+    values = [{c.name: getattr(r, c.name) for c in cols} for r in rows]
+    if table is models.Reading.__table__:
+        from .crud import _insert_new_readings
+        dconn.execute(_insert_new_readings(dconn.dialect.name), values)
+        return
+    key_cols, merge = _MERGED[table.name]
+    key = lambda r: tuple(getattr(r, k) for k in key_cols)
+    key_clause = tuple_(*(table.c[k] for k in key_cols))
+    existing = {
+        key(r): r for r in dconn.execute(
+            select(table).where(key_clause.in_([key(r) for r in rows])).with_for_update()
+        )
+    }
+    fresh = []
+    for r, v in zip(rows, values):
+        e = existing.get(key(r))
+        if e is None:
+            fresh.append(v)
+        else:
+            dconn.execute(update(table).where(table.c.id == e.id).values(merge(e, r)))
+    if fresh:
+        dconn.execute(insert(table), fresh)
+
+def _source_key(src: Engine) -> str:
+    return hashlib.blake2b(str(src.url).encode(), digest_size=8).hexdigest()
+
+def _move_rows(src: Engine, dst: Engine, table, device_id: str, batch_size: int,
+               pause: float = 0.0, stop: Optional[threading.Event] = None,
+               progress: Optional[Callable[[int], None]] = None) -> int:
+    cols = [c for c in table.c if c.name != "id"]
+    P = models.ShardMoveProgress.__table__
+    mark = {"device_id": device_id, "source": _source_key(src), "table_name": table.name}
+    marked = (P.c.device_id == device_id) & (P.c.source == mark["source"]) \
+        & (P.c.table_name == table.name)
+    with dst.connect() as dconn:
+        copied = dconn.execute(select(P.c.last_id).where(marked)).scalar()
+    moved = 0
+    while not (stop and stop.is_set()):
+        with src.connect() as sconn:
+            rows = sconn.execute(
+                select(table.c.id, *cols)
+                .where(table.c.device_id == device_id)
+                .order_by(table.c.id)
+                .limit(batch_size)
+            ).all()
+        if not rows:
+            if copied is not None:
+                with dst.begin() as dconn:
+                    dconn.execute(delete(P).where(marked))
+            return moved
+        fresh = [r for r in rows if copied is None or r.id > copied]
+        if fresh:
+            with dst.begin() as dconn:
+                _copy_rows(dconn, table, cols, fresh)
+                if copied is None:
+                    dconn.execute(insert(P), {**mark, "last_id": fresh[-1].id})
+                else:
+                    dconn.execute(update(P).where(marked).values(last_id=fresh[-1].id))
+            copied = fresh[-1].id
+        with src.begin() as sconn:
+            sconn.execute(delete(table).where(table.c.id.in_([r.id for r in rows])))
+        moved += len(rows)
+        if progress:
+            progress(len(rows))
+        if pause and len(rows) == batch_size:
+            (stop.wait if stop else time.sleep)(pause)
+    return moved
+
+def move_device_readings(src: Engine, dst: Engine, device_id: str,
+                         batch_size: int = 5000, pause: float = 0.0,
+                         stop: Optional[threading.Event] = None,
+                         progress: Optional[Callable[[int], None]] = None) -> int:
+    """
+    Copy a device's readings (and their rollups and sketches) from `src`
+    to `dst` in id-ordered batches, deleting each batch from `src` after it
+    is committed on `dst`. An interrupted move is resumed by running it
+    again; batches it already copied are not copied twice. `pause` throttles
+    between batches, `stop` ends the move early and `progress` is called
+    with each batch's row count. Returns the number of raw readings moved.
+    """
+    if src is dst:
+        return 0
+    opts = dict(pause=pause, stop=stop, progress=progress)
+    _move_rows(src, dst, models.ReadingSketch.__table__, device_id, batch_size, **opts)
+    _move_rows(src, dst, models.ReadingRollup.__table__, device_id, batch_size, **opts)
+    return _move_rows(src, dst, models.Reading.__table__, device_id, batch_size, **opts)
+
+def rebalance(router: ShardRouter, device_houses: Dict[str, int],
+              batch_size: int = 5000, dry_run: bool = False) -> List[dict]:
+    """
+    Move every device's readings to the shard its house maps to now.
+    `device_houses` is {device_id: house_id} from the catalog.
+    """
+    report = []
+    for name, eng in router.engines.items():
+        with eng.connect() as conn:
+            counts = dict(conn.execute(
+                select(models.Reading.device_id, func.count())
+                .group_by(models.Reading.device_id)
+            ).all())
+            # Devices whose raw history is fully compacted still own rollups
+            for model in (models.ReadingRollup, models.ReadingSketch):
+                for (device_id,) in conn.execute(select(model.device_id).distinct()):
+                    counts.setdefault(device_id, 0)
+        for device_id, count in counts.items():
+            house_id = device_houses.get(device_id)
+            if house_id is None:
+                continue  # orphaned readings: leave for the deletion job
+            target = router.shard_name(house_id)
+            if target == name:
+                continue
+            entry = {"device_id": device_id, "house_id": house_id,
+                     "from": name, "to": target, "rows": count}
+            if not dry_run:
+                entry["rows"] = move_device_readings(
+                    eng, router.engines[target], device_id, batch_size
+                )
+            logger.info("rebalance %s", entry)
+            report.append(entry)
+    return report
+
+if __name__ == "__main__":
+    import argparse
+
+    from .database import SessionLocal, router as default_router
+
+    parser = argparse.ArgumentParser(description="Readings shard tools")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    rb = sub.add_parser("rebalance", help="move readings to the shard their house maps to")
+    rb.add_argument("--batch-size", type=int, default=5000)
+    rb.add_argument("--dry-run", action="store_true")
+    sub.add_parser("stats", help="reading counts per shard")
+    args = parser.parse_args()
+
+    if args.cmd == "stats":
+        def count(name, eng):
+            with eng.connect() as conn:
+                return conn.execute(select(func.count()).select_from(models.Reading)).scalar()
+        for name, n in default_router.fan_out(count).items():
+            print(f"{name}: {n} readings")
+    else:
+        db = SessionLocal()
+        try:
+            houses = dict(
+                db.query(models.Device.id, models.Device.house_id)
+                  .filter(models.Device.deleted_at.is_(None)).all()
+            )
+        finally:
+            db.close()
+        for row in rebalance(default_router, houses, args.batch_size, args.dry_run):
+            print(f"{row['device_id']} house {row['house_id']}: "
+                  f"{row['from']} -> {row['to']} ({row['rows']} rows)")
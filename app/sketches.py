@@ -0,0 +1,367 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from . import models
+
+logger = logging.getLogger("sketches")
+
+# ── Settings ───────────────────────────────────────────────────────────────────
+ACCURACY       = float(os.getenv("SKETCH_ACCURACY", 0.01))       # relative error of quantiles
+FLUSH_INTERVAL = float(os.getenv("SKETCH_FLUSH_INTERVAL", 30))   # seconds between DB writes
+CACHE_TTL      = float(os.getenv("SKETCH_CACHE_TTL", 60))        # re-read other workers' flushes
+CACHE_SIZE     = int(os.getenv("SKETCH_CACHE_SIZE", 2000))       # devices kept merged in memory
+
+MAX_BINS  = 2048      # ~1 % accuracy from 1 mW to beyond 1 GW needs far fewer
+MIN_VALUE = 1e-3      # watts at or below this land in the zero bucket
+QUANTILES = (0.5, 0.9, 0.99)
+
+def day_of(ts: datetime) -> datetime:
+    """Midnight (UTC) of the day `ts` falls in; sketches are kept per day."""
+    return datetime(ts.year, ts.month, ts.day)
+
+# ── DDSketch ───────────────────────────────────────────────────────────────────
+class DDSketch:
+    """
+    Log-bucketed quantile sketch: bucket i counts values in
+    (gamma^(i-1), gamma^i], so every quantile is within `alpha` relative
+    error. Count, sum, min and max are exact. Sketches with the same alpha
+    merge by adding bucket counts, which is how per-day sketches become
+    all-time, weekly or house-wide ones.
+    """
+
+    __slots__ = ("alpha", "gamma", "_log_gamma", "bins", "zeros", "count", "sum", "min", "max")
+
+    def __init__(self, alpha: float = ACCURACY):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zeros = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float, n: int = 1):
+        if value > MIN_VALUE:
+            i = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[i] = self.bins.get(i, 0) + n
+            if len(self.bins) > MAX_BINS:
+                self._collapse()
+        else:
+            self.zeros += n
+        self.count += n
+        self.sum += value * n
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: "DDSketch") -> "DDSketch":
+        if other.alpha != self.alpha:
+            raise ValueError("Cannot merge sketches with different accuracy")
+        for i, c in other.bins.items():
+            self.bins[i] = self.bins.get(i, 0) + c
+        if len(self.bins) > MAX_BINS:
+            self._collapse()
+        self.zeros += other.zeros
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    def _collapse(self):
+        # Fold the lowest buckets into one: only the low quantiles lose accuracy
+        keys = sorted(self.bins)
+        target = keys[len(keys) - MAX_BINS]
+        self.bins[target] += sum(self.bins.pop(k) for k in keys[:len(keys) - MAX_BINS])
+
+    def quantiles(self, qs: Sequence[float]) -> List[Optional[float]]:
+        """Estimates for several quantiles in one pass over the buckets."""
+        out: List[Optional[float]] = [None] * len(qs)
+        if not self.count:
+            return out
+        pending = sorted(range(len(qs)), key=lambda k: qs[k])
+        rank = lambda k: qs[k] * (self.count - 1)
+        clamp = lambda v: max(self.min, min(self.max, v))
+
+        cum = self.zeros
+        while pending and rank(pending[0]) < cum:
+            out[pending.pop(0)] = clamp(0.0)
+        for i in sorted(self.bins):
+            if not pending:
+                break
+            cum += self.bins[i]
+            value = clamp(2 * self.gamma ** i / (self.gamma + 1))
+            while pending and rank(pending[0]) < cum:
+                out[pending.pop(0)] = value
+        for k in pending:            # rounding at q = 1
+            out[k] = self.max
+        return out
+
+    def summary(self) -> dict:
+        p50, p90, p99 = self.quantiles(QUANTILES)
+        return {
+            "avg_watts": self.sum / self.count if self.count else 0.0,
+            "total_readings": self.count,
+            "p50_watts": p50,
+            "p90_watts": p90,
+            "p99_watts": p99,
+            "max_watts": self.max if self.count else None,
+        }
+
+    # -- persistence -------------------------------------------------------------
+    def bins_json(self) -> str:
+        return json.dumps({"a": self.alpha, "z": self.zeros, "b": self.bins}, separators=(",", ":"))
+
+    @classmethod
+    def from_row(cls, row) -> "DDSketch":
+        data = json.loads(row.bins)
+        sk = cls(data["a"])
+        sk.bins = {int(i): c for i, c in data["b"].items()}
+        sk.zeros = data["z"]
+        sk.count, sk.sum = row.samples, row.sum_watts
+        sk.min, sk.max = row.min_watts, row.max_watts
+        return sk
+
+    def to_row(self, row):
+        row.samples, row.sum_watts = self.count, self.sum
+        row.min_watts, row.max_watts = self.min, self.max
+        row.bins = self.bins_json()
+        return row
+
+# ── Store ──────────────────────────────────────────────────────────────────────
+class SketchStore:
+    """
+    Per-device sketches for this process. Ingest adds to in-memory deltas
+    keyed by (shard engine, day); flush() merges them into the
+    ReadingSketch rows. Each device's all-time sketch (its rows plus
+    unflushed deltas) stays cached, so a stats lookup touches no readings.
+    """
+
+    def __init__(self, cache_ttl: float = CACHE_TTL, cache_size: int = CACHE_SIZE):
+        self.cache_ttl = cache_ttl
+        self.cache_size = cache_size
+        # device_id → {(engine, day): delta}
+        self._pending: Dict[str, Dict[Tuple[Engine, datetime], DDSketch]] = defaultdict(dict)
+        self._flushing: Dict[str, Dict[Tuple[Engine, datetime], DDSketch]] = {}
+        self._totals: "OrderedDict[str, Tuple[DDSketch, float]]" = OrderedDict()
+        self._generation = 0     # moves whenever deltas are being moved into the DB
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def record(self, eng: Engine, samples: Iterable[Tuple[str, datetime, float]]):
+        """Add freshly stored readings (never duplicates) on shard `eng`."""
+        with self._lock:
+            for did, ts, watts in samples:
+                deltas = self._pending[did]
+                key = (eng, day_of(ts))
+                delta = deltas.get(key)
+                if delta is None:
+                    delta = deltas[key] = DDSketch()
+                delta.add(watts)
+                cached = self._totals.get(did)
+                if cached is not None:
+                    cached[0].add(watts)
+
+    def summary(self, db: Session, device_id: str) -> dict:
+        """avg / count / p50 / p90 / p99 / max of a device's readings."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._totals.get(device_id)
+            if cached is not None and now - cached[1] < self.cache_ttl:
+                self._totals.move_to_end(device_id)
+                return cached[0].summary()
+            generation = self._generation
+
+        S = models.ReadingSketch
+        total = DDSketch()
+        for row in db.query(S).filter(S.device_id == device_id):
+            total.merge(DDSketch.from_row(row))
+
+        with self._lock:
+            for deltas in (self._flushing.get(device_id, {}), self._pending.get(device_id, {})):
+                for delta in deltas.values():
+                    total.merge(delta)
+            # A flush that overlapped the read may be counted twice or not at
+            # all; serve it once but reload on the next call.
+            loaded_at = now if generation == self._generation else -math.inf
+            self._totals[device_id] = (total, loaded_at)
+            self._totals.move_to_end(device_id)
+            while len(self._totals) > self.cache_size:
+                self._totals.popitem(last=False)
+            return total.summary()
+
+    def window(self, db: Session, device_ids: Iterable[str],
+               since: Optional[datetime] = None) -> DDSketch:
+        """Merged sketch of several devices, optionally only days >= `since`."""
+        device_ids = set(device_ids)
+        since = day_of(since) if since else None
+        S = models.ReadingSketch
+        q = db.query(S).filter(S.device_id.in_(device_ids))
+        if since is not None:
+            q = q.filter(S.day >= since)
+        total = DDSketch()
+        for row in q:
+            total.merge(DDSketch.from_row(row))
+        with self._lock:
+            for source in (self._flushing, self._pending):
+                for did in device_ids & source.keys():
+                    for (_, day), delta in source[did].items():
+                        if since is None or day >= since:
+                            total.merge(delta)
+        return total
+
+    def forget(self, device_id: str):
+        """Drop a deleted device's deltas (in-flight ones too) and cached sketch."""
+        with self._lock:
+            self._pending.pop(device_id, None)
+            self._flushing.pop(device_id, None)
+            self._totals.pop(device_id, None)
+
+    def flush(self) -> int:
+        """Merge every pending delta into its ReadingSketch row; returns rows written."""
+        with self._flush_lock:
+            with self._lock:
+                if not self._pending:
+                    return 0
+                self._flushing, self._pending = self._pending, defaultdict(dict)
+                self._generation += 1
+                by_engine: Dict[Engine, List[Tuple[str, datetime, DDSketch]]] = defaultdict(list)
+                for did, deltas in self._flushing.items():
+                    for (eng, day), delta in deltas.items():
+                        by_engine[eng].append((did, day, delta))
+
+            written, failed = 0, []
+            for eng, items in by_engine.items():
+                with self._lock:     # skip devices forgotten since the swap
+                    items = [item for item in items if item[0] in self._flushing]
+                if not items:
+                    continue
+                try:
+                    _write(eng, items)
+                    written += len(items)
+                except Exception:
+                    logger.exception("Sketch flush failed; keeping %d deltas", len(items))
+                    failed.extend((eng, *item) for item in items)
+
+            with self._lock:
+                for eng, did, day, delta in failed:   # retried on the next flush
+                    if did not in self._flushing:
+                        continue
+                    current = self._pending[did].get((eng, day))
+                    self._pending[did][(eng, day)] = delta.merge(current) if current else delta
+                self._flushing = {}
+                self._generation += 1
+            return written
+
+def _write(eng: Engine, items: List[Tuple[str, datetime, DDSketch]]):
+    S = models.ReadingSketch
+    with Session(eng) as s, s.begin():
+        existing = {
+            (r.device_id, r.day): r
+            for r in s.query(S).filter(
+                S.device_id.in_({did for did, _, _ in items}),
+                S.day.in_({day for _, day, _ in items})
+            ).with_for_update()
+        }
+        for did, day, delta in items:
+            row = existing.get((did, day))
+            if row is None:
+                s.add(delta.to_row(S(device_id=did, day=day)))
+            else:
+                DDSketch.from_row(row).merge(delta).to_row(row)
+
+STORE = SketchStore()
+
+# ── Background flush ───────────────────────────────────────────────────────────
+# Every worker flushes its own deltas: they are additive, so no leader is needed.
+_stop = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+def _loop():
+    while not _stop.wait(FLUSH_INTERVAL):
+        STORE.flush()
+
+def start():
+    global _thread
+    if _thread and _thread.is_alive():
+        return
+    _stop.clear()
+    _thread = threading.Thread(target=_loop, name="sketch-flush", daemon=True)
+    _thread.start()
+
+def stop():
+    global _thread
+    _stop.set()
+    if _thread:
+        _thread.join(timeout=5)
+        _thread = None
+    STORE.flush()
+
+# ── Backfill ───────────────────────────────────────────────────────────────────
+def backfill(eng: Engine, before: Optional[datetime] = None, batch_size: int = 50_000) -> int:
+    """
+    Build sketches for (device, day) pairs on shard `eng` that have none,
+    from raw readings and, approximately, from rollups (min and max exact,
+    the other samples at the bucket average). Only days before `before`
+    (default: today, UTC) are filled, since ingest already sketches the
+    days after the deploy. Returns sketch rows written.
+    """
+    before = day_of(before or datetime.utcnow())
+    R, U, S = models.Reading, models.ReadingRollup, models.ReadingSketch
+    with Session(eng) as s:
+        done = set(s.execute(select(S.device_id, S.day)).all())
+        devices = {d for (d,) in s.execute(select(R.device_id).distinct())}
+        devices |= {d for (d,) in s.execute(select(U.device_id).distinct())}
+
+    written = 0
+    for did in sorted(devices):
+        days: Dict[datetime, DDSketch] = defaultdict(DDSketch)
+        with Session(eng) as s:
+            for ts, watts in s.execute(
+                select(R.ts, R.watts).where(R.device_id == did, R.ts < before)
+                .execution_options(yield_per=batch_size)
+            ):
+                days[day_of(ts)].add(watts)
+            for u in s.execute(
+                select(U).where(U.device_id == did, U.bucket_start < before)
+            ).scalars():
+                sk = days[day_of(u.bucket_start)]
+                sk.add(u.min_watts)
+                if u.samples > 1:
+                    sk.add(u.max_watts)
+                if u.samples > 2:
+                    rest = u.sum_watts - u.min_watts - u.max_watts
+                    sk.add(rest / (u.samples - 2), u.samples - 2)
+        new = [(day, sk) for day, sk in days.items() if (did, day) not in done]
+        if new:
+            with Session(eng) as s, s.begin():
+                s.add_all(sk.to_row(S(device_id=did, day=day)) for day, sk in new)
+            written += len(new)
+    return written
+
+if __name__ == "__main__":
+    import argparse
+
+    from .database import router
+
+    parser = argparse.ArgumentParser(description="Per-device watt sketches")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    bf = sub.add_parser("backfill", help="sketch stored readings/rollups for days without a sketch")
+    bf.add_argument("--before", type=datetime.fromisoformat, default=None,
+                    help="only days before this date (default: today)")
+    args = parser.parse_args()
+
+    for name, eng in router.engines.items():
+        print(f"{name}: {backfill(eng, args.before)} sketch rows written")
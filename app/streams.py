@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+from . import cache, crud
+from .database import SessionLocal
+
+logger = logging.getLogger("streams")
+
+# Device-facing WebSocket ingestion (/houses/{house_id}/stream). A device
+# authenticates once when it connects and then sends one JSON frame per
+# sample on the same socket; each frame is answered with the ActionOut list
+# the HTTP ingest would return, and schedule edges of the connected devices
+# are pushed unprompted, so a relay OFF needs no polling.
+
+# ── Settings ───────────────────────────────────────────────────────────────────
+DEVICE_TTL = float(os.getenv("STREAM_DEVICE_TTL", cache.DEFAULT_TTL))   # reload even without a bump
+
+# ── Per-connection state ───────────────────────────────────────────────────────
+class StreamSession:
+    """
+    One open socket: the owner's active devices in the house, loaded once
+    and reloaded only when they change (the ("owner", id) cache counter)
+    or after DEVICE_TTL, so frames don't query the device table. `device_ids` narrows the
+    session to a subset of those devices.
+    """
+
+    def __init__(self, house_id: int, owner_id: int,
+                 device_ids: Optional[Set[str]] = None, ttl: float = DEVICE_TTL):
+        self.house_id = house_id
+        self.owner_id = owner_id
+        self.device_ids = device_ids
+        self.device_key: Optional[str] = None   # re-checked per frame, so revocation ends the stream
+        self.ttl = ttl
+        self.devices: Dict[str, object] = {}
+        self.channels: Dict[str, List[object]] = {}
+        self.frames = 0
+        self._versions: Optional[Tuple[int, ...]] = None
+        self._loaded_at: Optional[float] = None
+        self._socket = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._send_lock = asyncio.Lock()
+
+    @property
+    def key(self) -> Tuple[int, int]:
+        return (self.house_id, self.owner_id)
+
+    def refresh(self, force: bool = False, check: bool = False):
+        """
+        Reload the devices if they may have changed since the last load;
+        `check` polls other workers' bumps now instead of within
+        cache.VERSION_TTL.
+        """
+        deps = [("owner", self.owner_id)]
+        if check:
+            cache.sync(force=True)
+        if not force and self._loaded_at is not None \
+                and time.monotonic() - self._loaded_at < self.ttl \
+                and cache.snapshot(deps) == self._versions:
+            return
+        versions = cache.snapshot(deps)
+        with SessionLocal() as db:
+            # Closing the session detaches the rows with their columns loaded
+            devices = [
+                d for d in crud.list_devices_by_house(db, self.house_id)
+                if d.owner_id == self.owner_id
+                and (self.device_ids is None or d.id in self.device_ids)
+            ]
+        channels = defaultdict(list)
+        for d in devices:
+            channels[d.appliance].append(d)
+        self.devices = {d.id: d for d in devices}
+        self.channels = dict(channels)
+        self._versions = versions
+        self._loaded_at = time.monotonic()
+
+    def attach(self, socket):
+        """Bind the accepted socket; must run on its event loop."""
+        self._socket = socket
+        self._loop = asyncio.get_running_loop()
+
+    async def send(self, message):
+        # Replies and pushes from other threads share the socket
+        async with self._send_lock:
+            await self._socket.send_json(message)
+
+    def push(self, message):
+        """Queue `message` for the socket from any thread."""
+        if self._loop is not None and not self._loop.is_closed():
+            asyncio.run_coroutine_threadsafe(self.send(message), self._loop)
+
+# ── Open sockets of this worker ────────────────────────────────────────────────
+class StreamRegistry:
+    """Open sessions of this worker process, by (house_id, owner_id)."""
+
+    def __init__(self):
+        self._sessions: Dict[Tuple[int, int], Set[StreamSession]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def add(self, session: StreamSession):
+        with self._lock:
+            self._sessions[session.key].add(session)
+
+    def remove(self, session: StreamSession):
+        with self._lock:
+            sessions = self._sessions.get(session.key)
+            if sessions is not None:
+                sessions.discard(session)
+                if not sessions:
+                    del self._sessions[session.key]
+
+    def push(self, device, message) -> int:
+        """
+        Send `message` on every socket streaming `device`; returns how many.
+        Devices connected to another worker are not reached.
+        """
+        with self._lock:
+            sessions = list(self._sessions.get((device.house_id, device.owner_id), ()))
+        sent = 0
+        for session in sessions:
+            if device.id in session.devices:
+                session.push(message)
+                sent += 1
+        return sent
+
+    def status(self) -> dict:
+        with self._lock:
+            sessions = [s for group in self._sessions.values() for s in group]
+        return {
+            "connections": len(sessions),
+            "devices": sum(len(s.devices) for s in sessions),
+            "frames": sum(s.frames for s in sessions),
+        }
+
+REGISTRY = StreamRegistry()
@@ -0,0 +1,30 @@
+import gc
+import multiprocessing
+import os
+
+# Run with:  gunicorn -c gunicorn.conf.py app.main:app
+bind         = os.getenv("BIND", "0.0.0.0:8000")
+workers      = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "uvicorn.workers.UvicornWorker"
+
+# Preload/fork mode: import the app (pandas, sklearn, every joblib model)
+# once in the master, then fork workers that share those pages copy-on-write.
+preload_app  = os.getenv("PRELOAD_APP", "true").lower() in ("1", "true")
+
+def when_ready(server):
+    # Runs in the master after the preload and before the first fork. Models
+    # load lazily, so warm them here to have the workers inherit them. Freezing
+    # moves every object imported so far out of the GC's reach, so collections
+    # in the workers don't write to (and un-share) those pages.
+    if server.cfg.preload_app:
+        from app import ml_model
+        ml_model.warm()
+        gc.freeze()
+
+def post_fork(server, worker):
+    # The engines created at import may hold pooled connections opened by the
+    # master; each worker must open its own.
+    if server.cfg.preload_app:
+        from app.database import all_engines
+        for engine in all_engines():
+            engine.dispose(close=False)
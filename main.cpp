@@ -16,7 +16,9 @@ const char* HOUSE_ID     = "1";
 const char* APPLIANCE_KEY = "Appliance5";
 
 // ---------- CREDENTIALS ----------
-// User credentials for API login
+// Device API key from POST /devices/{id}/keys (preferred: no login, scoped
+// to this device). Leave empty to log in with the user's credentials.
+const char* DEVICE_KEY = "";
 const char* USER_EMAIL = "your_email@example.com";
 const char* USER_PASS  = "your_password";
 
@@ -47,6 +49,11 @@ float readWatts() {
 // ---------- Login to get JWT token ----------
 // Performs HTTP POST login to obtain JWT for authorization
 bool login() {
+  if (strlen(DEVICE_KEY) > 0) {
+    // The key is sent as the bearer token as-is
+    jwt_token = DEVICE_KEY;
+    return true;
+  }
   if (WiFi.status() != WL_CONNECTED) return false;
 
   HTTPClient http;
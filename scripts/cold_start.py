@@ -0,0 +1,66 @@
+"""
+Time from process start to the first served request.
+
+    python scripts/cold_start.py [--runs 5] [--path /healthz] [--ready /readyz]
+
+Starts `uvicorn app.main:app` repeatedly and polls until `--path` answers
+(the process can take traffic) and, optionally, until `--ready` returns 200
+(models warm, DB reachable). Rolling restarts and autoscaling wait on these.
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def wait_for(url: str, deadline: float) -> float:
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as r:
+                if r.status == 200:
+                    return time.perf_counter()
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.005)
+    raise SystemExit(f"timed out waiting for {url}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--runs", type=int, default=5)
+    ap.add_argument("--port", type=int, default=8766)
+    ap.add_argument("--path", default="/healthz")
+    ap.add_argument("--ready", default="/readyz", help="empty to skip")
+    args = ap.parse_args()
+
+    first, ready = [], []
+    for _ in range(args.runs):
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app.main:app",
+             "--port", str(args.port), "--log-level", "warning"],
+            cwd=ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            base = f"http://127.0.0.1:{args.port}"
+            first.append(wait_for(base + args.path, t0 + 120) - t0)
+            if args.ready:
+                ready.append(wait_for(base + args.ready, t0 + 120) - t0)
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+    print(f"first {args.path}: median {statistics.median(first) * 1000:.0f} ms "
+          f"(min {min(first) * 1000:.0f}, max {max(first) * 1000:.0f})")
+    if ready:
+        print(f"first {args.ready} 200: median {statistics.median(ready) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Measure per-worker memory of the API under gunicorn.
+
+    python scripts/worker_rss.py --workers 8            # preload/fork
+    python scripts/worker_rss.py --workers 8 --no-preload
+
+Reports RSS (what each process maps) and PSS (RSS with shared pages split
+between the processes sharing them), the number that actually adds up to
+physical memory. Linux only: reads /proc/<pid>/smaps_rollup.
+"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def children(pid: int):
+    out = subprocess.run(["ps", "-o", "pid=", "--ppid", str(pid)],
+                         capture_output=True, text=True).stdout
+    return [int(p) for p in out.split()]
+
+
+def mem_kb(pid: int):
+    vals = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if parts[0] in ("Rss:", "Pss:"):
+                vals[parts[0][:-1]] = int(parts[1])
+    return vals["Rss"], vals["Pss"]
+
+
+def wait_ready(url: str, timeout: float = 120):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(url, timeout=1)
+            return
+        except OSError:
+            time.sleep(0.5)
+    raise SystemExit("server did not come up")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--no-preload", action="store_true")
+    args = ap.parse_args()
+
+    env = dict(os.environ,
+               WEB_CONCURRENCY=str(args.workers),
+               BIND=f"127.0.0.1:{args.port}",
+               PRELOAD_APP="false" if args.no_preload else "true")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "app.main:app"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_ready(f"http://127.0.0.1:{args.port}/login")
+        # Let every worker finish booting, then hit them so lazy state settles
+        time.sleep(3)
+        for _ in range(args.workers * 4):
+            urllib.request.urlopen(f"http://127.0.0.1:{args.port}/login").read()
+
+        workers = children(proc.pid)
+        rows = [mem_kb(pid) for pid in workers]
+        master = mem_kb(proc.pid)
+        mode = "no-preload" if args.no_preload else "preload"
+        print(f"mode={mode} workers={len(workers)}")
+        print(f"master     RSS {master[0] / 1024:8.1f} MiB  PSS {master[1] / 1024:8.1f} MiB")
+        for pid, (rss, pss) in zip(workers, rows):
+            print(f"pid {pid:<6} RSS {rss / 1024:8.1f} MiB  PSS {pss / 1024:8.1f} MiB")
+        total_pss = master[1] + sum(p for _, p in rows)
+        print(f"mean worker RSS {sum(r for r, _ in rows) / len(rows) / 1024:.1f} MiB, "
+              f"mean worker PSS {sum(p for _, p in rows) / len(rows) / 1024:.1f} MiB, "
+              f"total PSS {total_pss / 1024:.1f} MiB")
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        proc.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
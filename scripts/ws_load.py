@@ -0,0 +1,202 @@
+"""
+Concurrent devices one worker sustains: HTTP posts vs WebSocket streams.
+
+    python scripts/ws_load.py [--devices 50,100,200,400] [--interval 5] [--duration 20]
+
+Starts one `uvicorn app.main:app` worker on a scratch SQLite database (or
+--db-url), registers a user and enough devices (20 per house, so house rate
+limits stay out of the way) and, for each level, runs that many simulated
+devices sending one reading every --interval seconds:
+
+  http  a new connection and POST /houses/{h}/reading/{d} per sample, as
+        the ESP32 firmware does
+  ws    one /houses/{h}/stream socket per device, authenticated once
+
+A level is sustained when at least 99 % of samples got their actions back
+and p99 latency stays under the interval (the answer arrives before the
+next sample is due).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+from collections import Counter
+import urllib.request
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+import websockets
+
+ROOT = Path(__file__).resolve().parent.parent
+DEVICES_PER_HOUSE = 20
+
+
+def wait_for(url: str, deadline: float):
+    while time.perf_counter() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as r:
+                if r.status == 200:
+                    return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            pass
+        time.sleep(0.05)
+    raise SystemExit(f"timed out waiting for {url}")
+
+
+def setup(base: str, n: int):
+    """A user and `n` devices; returns (token, [(house_id, device_id)])."""
+    with httpx.Client(base_url=base, timeout=30) as c:
+        c.post("/users", json={"full_name": "Load", "email": "load@example.com", "password": "load"})
+        token = c.post("/token", data={"username": "load@example.com", "password": "load"}).json()["access_token"]
+        headers = {"Authorization": f"Bearer {token}"}
+        devices = []
+        for i in range(n):
+            house = 1000 + i // DEVICES_PER_HOUSE
+            r = c.post("/devices", headers=headers, json={
+                "name": f"load-{i}", "house_id": house,
+                "appliance": f"Appliance{i % 9 + 1}", "email": None,
+            })
+            r.raise_for_status()
+            devices.append((house, r.json()["id"]))
+    return token, devices
+
+
+class Tally:
+    def __init__(self):
+        self.sent = 0
+        self.ok = 0
+        self.latencies = []
+        self.failures = Counter()
+
+    def report(self, interval: float) -> dict:
+        lat = sorted(self.latencies)
+        p50 = statistics.median(lat) if lat else float("nan")
+        p99 = lat[min(len(lat) - 1, int(len(lat) * 0.99))] if lat else float("nan")
+        ok_share = self.ok / self.sent if self.sent else 0.0
+        return {"sent": self.sent, "ok": ok_share, "p50": p50, "p99": p99,
+                "failures": ", ".join(f"{k} x{v}" for k, v in self.failures.most_common(3)),
+                "sustained": ok_share >= 0.99 and p99 < interval}
+
+
+def samples(start: datetime, interval: float, duration: float):
+    """(due offset, reading body) every `interval`, from a random phase."""
+    t = random.uniform(0, interval)
+    seq = 0
+    while t < duration:
+        ts = start + timedelta(seconds=seq * interval)
+        yield t, {"timestamp": ts.isoformat(), "watts": random.uniform(5, 2500)}
+        t += interval
+        seq += 1
+
+
+async def http_device(client, base, token, house, device, start, args, tally):
+    url = f"{base}/houses/{house}/reading/{device}"
+    headers = {"Authorization": f"Bearer {token}"}
+    t0 = time.perf_counter()
+    for due, body in samples(start, args.interval, args.duration):
+        await asyncio.sleep(max(0.0, t0 + due - time.perf_counter()))
+        tally.sent += 1
+        sent = time.perf_counter()
+        try:
+            r = await client.post(url, json=body, headers=headers)
+        except httpx.HTTPError as e:
+            tally.failures[type(e).__name__] += 1
+            continue
+        if r.status_code == 200:
+            tally.ok += 1
+            tally.latencies.append(time.perf_counter() - sent)
+        else:
+            tally.failures[r.status_code] += 1
+
+
+async def ws_device(client, base, token, house, device, start, args, tally):
+    url = base.replace("http", "ws", 1) + f"/houses/{house}/stream?token={token}"
+    t0 = time.perf_counter()
+    # Connect at the device's first sample, like a fleet coming online
+    plan = list(samples(start, args.interval, args.duration))
+    await asyncio.sleep(plan[0][0] if plan else 0)
+    try:
+        async with websockets.connect(url, open_timeout=args.interval * 4) as ws:
+            for due, body in plan:
+                await asyncio.sleep(max(0.0, t0 + due - time.perf_counter()))
+                tally.sent += 1
+                sent = time.perf_counter()
+                await ws.send(json.dumps({"device_id": device, **body}))
+                reply = json.loads(await asyncio.wait_for(ws.recv(), args.interval * 4))
+                if isinstance(reply, list):
+                    tally.ok += 1
+                    tally.latencies.append(time.perf_counter() - sent)
+                else:
+                    tally.failures[reply.get("status")] += 1
+    except (OSError, asyncio.TimeoutError, websockets.WebSocketException) as e:
+        tally.failures[type(e).__name__] += 1
+        # Samples that never went out count as lost
+        tally.sent += sum(1 for due, _ in plan if t0 + due > time.perf_counter())
+
+
+async def run_level(base, token, devices, transport, args) -> dict:
+    tally = Tally()
+    # Later than every sample of the previous level, so none is a duplicate
+    start = datetime.utcnow()
+    fn = http_device if transport == "http" else ws_device
+    # No keep-alive: every HTTP sample opens and closes its own connection
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=0)
+    async with httpx.AsyncClient(timeout=args.interval * 4, limits=limits) as client:
+        await asyncio.gather(*(fn(client, base, token, h, d, start, args, tally) for h, d in devices))
+    return tally.report(args.interval)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--devices", default="50,100,200,400", help="comma-separated levels")
+    ap.add_argument("--interval", type=float, default=5.0, help="seconds between a device's samples")
+    ap.add_argument("--duration", type=float, default=20.0, help="seconds per level")
+    ap.add_argument("--transports", default="http,ws")
+    ap.add_argument("--port", type=int, default=8767)
+    ap.add_argument("--db-url", help="default: scratch SQLite file")
+    args = ap.parse_args()
+    levels = [int(n) for n in args.devices.split(",")]
+
+    scratch = tempfile.TemporaryDirectory()
+    env = {
+        **os.environ,
+        "DB_URL": args.db_url or f"sqlite:///{scratch.name}/load.db",
+        "DB_CREATE_SCHEMA": "true",
+    }
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app",
+         "--port", str(args.port), "--log-level", "warning"],
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        base = f"http://127.0.0.1:{args.port}"
+        wait_for(base + "/readyz", time.perf_counter() + 180)
+        token, devices = setup(base, max(levels))
+
+        print(f"{'transport':<10} {'devices':>8} {'samples':>8} {'ok %':>7} {'p50 ms':>8} {'p99 ms':>8}  sustained  failures")
+        best = {}
+        for transport in args.transports.split(","):
+            for n in levels:
+                r = asyncio.run(run_level(base, token, devices[:n], transport, args))
+                print(f"{transport:<10} {n:>8} {r['sent']:>8} {100 * r['ok']:>7.1f} "
+                      f"{1000 * r['p50']:>8.1f} {1000 * r['p99']:>8.1f}  {'yes' if r['sustained'] else 'no':<9}  {r['failures']}")
+                if r["sustained"]:
+                    best[transport] = n
+        for transport in args.transports.split(","):
+            print(f"{transport}: sustains {best.get(transport, 0)} devices at one sample / {args.interval:g} s")
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+        scratch.cleanup()
+
+
+if __name__ == "__main__":
+    main()
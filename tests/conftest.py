@@ -0,0 +1,78 @@
+import os
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+import pytest
+
+# Configure the app before anything imports it: a scratch SQLite database
+# with the schema created at startup, the bundled models, and background
+# jobs that only run when a test calls them.
+ROOT = Path(__file__).resolve().parent.parent
+SCRATCH = tempfile.mkdtemp(prefix="energy-tests-")
+os.environ.update({
+    "DB_URL": f"sqlite:///{SCRATCH}/primary.db",
+    "DB_CREATE_SCHEMA": "true",
+    "ML_MODELS_DIR": str(ROOT / "models"),
+    "PURGE_INTERVAL": "3600",
+    "MOVE_INTERVAL": "3600",
+    **{f"{job}_LOCK_FILE": f"{SCRATCH}/{job.lower()}.lock"
+       for job in ("SCHEDULER", "PURGE", "MOVE", "RETENTION")},
+})
+sys.path.insert(0, str(ROOT))
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+from app import cache, database, main  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def client():
+    with TestClient(main.app) as c:
+        yield c
+
+
+@pytest.fixture(autouse=True)
+def fresh_cache():
+    cache.clear()
+    yield
+
+
+def register(client):
+    """A new user; returns their Authorization headers."""
+    email = f"{uuid.uuid4().hex[:12]}@example.com"
+    client.post("/users", json={"full_name": "Test", "email": email, "password": "pw"})
+    token = client.post("/token", data={"username": email, "password": "pw"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def user(client):
+    return register(client)
+
+
+@pytest.fixture
+def house():
+    """A house id no other test uses."""
+    return 10_000 + uuid.uuid4().int % 1_000_000
+
+
+def add_device(client, headers, house_id, appliance="Appliance1"):
+    r = client.post("/devices", headers=headers, json={
+        "name": "dev", "house_id": house_id, "appliance": appliance, "email": None,
+    })
+    assert r.status_code == 200, r.text
+    return r.json()["id"]
+
+
+@pytest.fixture
+def count_queries():
+    """Counter of statements run on the primary while the test runs."""
+    from sqlalchemy import event
+
+    n = [0]
+    listener = lambda *a: n.__setitem__(0, n[0] + 1)
+    event.listen(database.engine, "before_cursor_execute", listener)
+    yield n
+    event.remove(database.engine, "before_cursor_execute", listener)
@@ -0,0 +1,40 @@
+import uuid
+
+from app import admission
+
+from conftest import add_device
+
+
+def single(client, headers, house_id, device_id, second):
+    return client.post(f"/houses/{house_id}/reading/{device_id}", headers=headers,
+                       json={"timestamp": f"2025-07-15T12:00:{second:02d}Z", "watts": 10})
+
+
+def bulk(client, headers, house_id, second):
+    return client.post(f"/houses/{house_id}/reading", headers=headers, json={
+        "timestamp": f"2025-07-15T12:01:{second:02d}Z", "aggregate": 10, "appliances": {"Appliance1": 10}})
+
+
+def test_bulk_and_single_draw_from_the_same_device_bucket(client, user, house):
+    did = add_device(client, user, house)
+    burst = int(admission.DEVICE_BURST)
+    for i in range(burst // 2):
+        assert bulk(client, user, house, i).status_code == 200
+    for i in range(burst - burst // 2):
+        assert single(client, user, house, did, i).status_code == 200
+
+    r = single(client, user, house, did, 59)
+    assert r.status_code == 429
+    assert int(r.headers["retry-after"]) >= 1
+    assert bulk(client, user, house, 59).status_code == 429
+
+
+def test_rejected_requests_do_not_drain_the_house(client, user, house):
+    for i in range(int(admission.HOUSE_BURST) + 5):
+        assert single(client, user, house, str(uuid.uuid4()), i % 60).status_code == 404
+    for i in range(3):
+        malformed = client.post(f"/houses/{house}/reading", headers=user, json={"aggregate": 1})
+        assert malformed.status_code == 422
+
+    did = add_device(client, user, house)
+    assert single(client, user, house, did, 0).status_code == 200
@@ -0,0 +1,55 @@
+from app import cache, database, models
+
+from conftest import add_device
+
+
+def test_conditional_get_is_served_without_a_query(client, user, house, count_queries):
+    add_device(client, user, house)
+    first = client.get("/devices", headers=user)
+    assert first.status_code == 200
+
+    count_queries[0] = 0
+    again = client.get("/devices", headers={**user, "If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304
+    assert count_queries[0] == 0
+
+
+def test_write_invalidates_and_changes_the_etag(client, user, house):
+    add_device(client, user, house)
+    first = client.get("/devices", headers=user)
+    add_device(client, user, house)
+    again = client.get("/devices", headers={**user, "If-None-Match": first.headers["etag"]})
+    assert again.status_code == 200
+    assert len(again.json()) == 2
+    assert again.headers["etag"] != first.headers["etag"]
+
+
+def test_new_readings_bump_nothing(client, user, house):
+    did = add_device(client, user, house)
+    r = client.post(f"/houses/{house}/reading/{did}",
+                    json={"timestamp": "2025-07-15T12:00:00Z", "watts": 10}, headers=user)
+    assert r.status_code == 200
+    with database.engine.connect() as conn:
+        rows = conn.execute(models.CacheVersion.__table__.select()
+                            .where(models.CacheVersion.key == f"readings:{did}")).all()
+    assert rows == []
+
+
+def test_bumps_from_another_worker_are_polled():
+    deps = [("device", "elsewhere")]
+    cache.sync(force=True)
+    before = cache.snapshot(deps)
+    cache.bump(*deps)
+    # Another worker: only the shared table moved, not its memory
+    with cache._lock:
+        cache._versions.pop("device:elsewhere")
+    assert cache.snapshot(deps) == before
+    cache.sync(force=True)
+    assert cache.snapshot(deps) == (before[0] + 1,)
+
+
+def test_same_versions_give_the_same_etag():
+    a = cache.put("a", [("owner", 1)], (3,), b"[]")
+    b = cache.put("b", [("owner", 1)], (3,), b"[]")
+    c = cache.put("c", [("owner", 1)], (4,), b"[]")
+    assert a.etag == b.etag != c.etag
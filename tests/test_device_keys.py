@@ -0,0 +1,46 @@
+import secrets
+
+from app import device_keys
+
+from conftest import add_device
+
+
+def post(client, key, house_id, device_id):
+    return client.post(f"/houses/{house_id}/reading/{device_id}",
+                       headers={"Authorization": f"Bearer {key}"},
+                       json={"timestamp": "2025-07-15T12:00:00Z", "watts": 10})
+
+
+def test_issued_key_ingests_until_revoked(client, user, house):
+    did = add_device(client, user, house)
+    other = add_device(client, user, house, appliance="Appliance2")
+    issued = client.post(f"/devices/{did}/keys", headers=user).json()
+
+    assert post(client, issued["key"], house, did).status_code == 200
+    assert post(client, issued["key"], house, other).status_code == 403
+    assert post(client, issued["key"] + "x", house, did).status_code == 401
+
+    r = client.delete(f"/devices/{did}/keys/{issued['id']}", headers=user)
+    assert r.status_code == 200
+    assert post(client, issued["key"], house, did).status_code == 401
+
+
+def test_malformed_keys_are_refused_without_a_query(count_queries):
+    count_queries[0] = 0
+    for key in ["dk_", "dk_abc.def", "dk_" + "a" * 5000 + "." + "b" * 43,
+                "dk_" + "A" * 16 + "." + "b" * 43]:
+        assert device_keys.authenticate(key) is None
+    assert count_queries[0] == 0
+
+
+def test_unknown_ids_stay_out_of_the_key_cache():
+    cache = device_keys.KeyCache(max_misses=3)
+    for _ in range(10):
+        key_id, key = device_keys.generate()
+        assert cache.get(key_id) is None
+    status = cache.status()
+    assert (status["entries"], status["missing"]) == (0, 3)
+
+    # A repeat of a remembered miss is answered from memory
+    assert cache.get(key_id) is None
+    assert cache.status()["misses"] == 10
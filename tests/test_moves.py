@@ -0,0 +1,135 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, func, insert, select
+
+from app import database, models, moves, sharding
+from app.sketches import DDSketch
+
+from conftest import add_device
+
+R = models.Reading.__table__
+U = models.ReadingRollup.__table__
+S = models.ReadingSketch.__table__
+P = models.ShardMoveProgress.__table__
+T0 = datetime(2026, 1, 1)
+
+
+@pytest.fixture
+def shards(tmp_path):
+    engines = []
+    for name in ("a", "b"):
+        eng = create_engine(f"sqlite:///{tmp_path}/{name}.db")
+        for model in database.SHARDED_MODELS:
+            model.__table__.create(eng)
+        engines.append(eng)
+    return engines
+
+
+def sketch_row(values):
+    sk = DDSketch()
+    for v in values:
+        sk.add(v)
+    return {"samples": sk.count, "sum_watts": sk.sum, "min_watts": sk.min,
+            "max_watts": sk.max, "bins": sk.bins_json()}
+
+
+def idle_rollup(start):
+    # An idle appliance: every bucket looks the same
+    return {"device_id": "d", "resolution": 3600, "bucket_start": start,
+            "samples": 60, "sum_watts": 0.0, "min_watts": 0.0, "max_watts": 0.0}
+
+
+def seed(src):
+    with src.begin() as c:
+        c.execute(insert(R), [{"device_id": "d", "ts": T0 + timedelta(minutes=i), "watts": float(i)}
+                              for i in range(100)])
+        c.execute(insert(U), [idle_rollup(T0 + timedelta(hours=h)) for h in range(3)])
+        c.execute(insert(S), [{"device_id": "d", "day": T0, **sketch_row(range(100))}])
+
+
+def totals(eng):
+    with eng.connect() as c:
+        return (
+            c.execute(select(func.count(), func.sum(R.c.watts))).one(),
+            c.execute(select(func.count(), func.sum(U.c.samples))).one(),
+            c.execute(select(S.c.samples, S.c.sum_watts)).all(),
+            c.execute(select(func.count()).select_from(P)).scalar(),
+        )
+
+
+def test_move_merges_rows_the_destination_already_has(shards):
+    src, dst = shards
+    seed(src)
+    # Ingest after the route switched: the same idle bucket, and a sketch
+    with dst.begin() as c:
+        c.execute(insert(U), [idle_rollup(T0 + timedelta(hours=2))])
+        c.execute(insert(S), [{"device_id": "d", "day": T0, **sketch_row([5.0])}])
+    assert sharding.move_device_readings(src, dst, "d", batch_size=7) == 100
+    readings, rollups, sketch, progress = totals(dst)
+    assert tuple(readings) == (100, 4950.0)
+    assert tuple(rollups) == (3, 240)          # the idle buckets add up, none dropped
+    assert [tuple(r) for r in sketch] == [(101, 4955.0)]
+    assert progress == 0
+    assert totals(src)[0][0] == 0
+
+
+def test_interrupted_move_resumes_without_double_counting(shards, monkeypatch):
+    src, dst = shards
+    seed(src)
+    real_delete = sharding.delete
+    calls = []
+
+    def crash_on_source_delete(table):
+        # Die after the second batch commits on the destination
+        if table is R and len([t for t in calls if t is R]) == 1:
+            raise RuntimeError("crash")
+        calls.append(table)
+        return real_delete(table)
+
+    monkeypatch.setattr(sharding, "delete", crash_on_source_delete)
+    with pytest.raises(RuntimeError):
+        sharding.move_device_readings(src, dst, "d", batch_size=30)
+    monkeypatch.setattr(sharding, "delete", real_delete)
+
+    # Sketches and rollups finished; readings stopped with 60 copied and
+    # only 30 deleted from the source
+    readings, _, _, progress = totals(dst)
+    assert (readings[0], progress) == (60, 1)
+    assert totals(src)[0][0] == 70
+    sharding.move_device_readings(src, dst, "d", batch_size=30)
+    readings, rollups, sketch, progress = totals(dst)
+    assert tuple(readings) == (100, 4950.0)
+    assert tuple(rollups) == (3, 180)
+    assert [tuple(r) for r in sketch] == [(100, 4950.0)]
+    assert progress == 0
+
+
+def test_house_change_is_moved_by_the_background_job(client, user, house, monkeypatch):
+    did = add_device(client, user, house)
+    r = client.post(f"/houses/{house}/reading/{did}",
+                    json={"timestamp": "2025-07-15T12:00:00Z", "watts": 10}, headers=user)
+    assert r.status_code == 200
+    # One database here, so fake a second shard for the new house
+    other = create_engine(f"sqlite:///{database.engine.url.database}.other")
+    for model in database.SHARDED_MODELS:
+        model.__table__.create(other, checkfirst=True)
+    new_house = house + 1
+    real_engine_for = database.router.engine_for
+    monkeypatch.setattr(database.router, "engine_for",
+                        lambda h: other if h == new_house else real_engine_for(h))
+
+    r = client.put(f"/devices/{did}", headers=user, json={
+        "name": "dev", "house_id": new_house, "appliance": "Appliance1", "email": None,
+    })
+    assert r.status_code == 200
+    pending = moves.status()["pending_moves"]
+    assert [(m["device_id"], m["from_house"], m["to_house"]) for m in pending] == [(did, house, new_house)]
+
+    monkeypatch.setattr(moves, "GRACE", 0.001)
+    assert moves.run_once(pause=0) == 1
+    assert moves.status()["pending_moves"] == []
+    with other.connect() as c:
+        assert c.execute(select(func.count()).select_from(R).where(R.c.device_id == did)).scalar() == 1
+    with database.engine.connect() as c:
+        assert c.execute(select(func.count()).select_from(R).where(R.c.device_id == did)).scalar() == 0
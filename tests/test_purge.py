@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+from sqlalchemy import func, select
+
+from app import cache, database, device_keys, models, purge, sketches, streams
+
+from conftest import add_device
+
+
+def stored(device_id):
+    R = models.Reading
+    with database.engine.connect() as conn:
+        return conn.execute(select(func.count()).select_from(R).where(R.device_id == device_id)).scalar()
+
+
+def test_default_grace_outlasts_every_worker_cache(monkeypatch):
+    monkeypatch.setattr(purge, "GRACE", 0)
+    assert purge.grace() == 2 * max(sketches.FLUSH_INTERVAL, streams.DEVICE_TTL,
+                                    cache.DEFAULT_TTL, device_keys.CACHE_TTL)
+    monkeypatch.setattr(purge, "GRACE", 7.5)
+    assert purge.grace() == 7.5
+
+
+def test_deleted_device_is_purged_only_after_grace(client, user, house):
+    did = add_device(client, user, house)
+    r = client.post(f"/houses/{house}/reading/{did}",
+                    json={"timestamp": "2025-07-15T12:00:00Z", "watts": 10}, headers=user)
+    assert r.status_code == 200
+    assert client.delete(f"/devices/{did}", headers=user).status_code == 200
+
+    assert did in purge.pending_devices()
+    assert did not in purge.pending_devices(due_only=True)
+    purge.run_once(pause=0)
+    assert stored(did) == 1
+
+    with database.SessionLocal() as db:
+        db.get(models.Device, did).deleted_at -= timedelta(seconds=purge.grace() + 1)
+        db.commit()
+    purge.run_once(pause=0)
+    assert stored(did) == 0
+    assert did not in purge.pending_devices()
+    with database.SessionLocal() as db:
+        assert db.get(models.Device, did) is None
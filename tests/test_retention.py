@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine, func, insert, select
+
+from app import models, retention
+
+
+def shard(tmp_path):
+    eng = create_engine(f"sqlite:///{tmp_path}/shard.db")
+    for model in (models.Reading, models.ReadingRollup, models.ReadingSketch):
+        model.__table__.create(eng)
+    return eng
+
+
+def test_compaction_folds_old_readings_into_rollups(tmp_path):
+    eng = shard(tmp_path)
+    old = datetime(2026, 1, 1, 10)
+    new = datetime(2026, 3, 1, 10)
+    R, U = models.Reading.__table__, models.ReadingRollup.__table__
+    with eng.begin() as c:
+        # Interleave old and new ids, as late uploads do
+        c.execute(insert(R), [
+            {"device_id": "d", "ts": (old if i % 2 else new) + timedelta(minutes=i), "watts": float(i)}
+            for i in range(40)
+        ])
+    cutoff = datetime(2026, 2, 1)
+    last_id, removed = 0, 0
+    while True:
+        n, _, last_id = retention.compact_batch(eng, cutoff, 3600, batch_size=7, after_id=last_id)
+        if not n:
+            break
+        removed += n
+    assert removed == 20
+    with eng.connect() as c:
+        assert c.execute(select(func.count()).select_from(R)).scalar() == 20
+        samples, total = c.execute(select(func.sum(U.c.samples), func.sum(U.c.sum_watts))).one()
+    assert samples == 20
+    assert total == sum(float(i) for i in range(40) if i % 2)
+
+
+def test_batches_resume_from_the_last_id(tmp_path):
+    eng = shard(tmp_path)
+    with eng.begin() as c:
+        c.execute(insert(models.Reading.__table__), [
+            {"device_id": "d", "ts": datetime(2026, 1, 1) + timedelta(seconds=i), "watts": 1.0}
+            for i in range(30)
+        ])
+    n, _, last_id = retention.compact_batch(eng, datetime(2027, 1, 1), 3600, batch_size=10)
+    assert (n, last_id) == (10, 10)
+    n, _, last_id = retention.compact_batch(eng, datetime(2027, 1, 1), 3600, 10, last_id)
+    assert (n, last_id) == (10, 20)
+    # Rows at or below after_id are not looked at again
+    n, _, last_id = retention.compact_batch(eng, datetime(2027, 1, 1), 3600, 10, 25)
+    assert (n, last_id) == (5, 30)
@@ -0,0 +1,107 @@
+from datetime import datetime, time, timedelta
+from types import SimpleNamespace
+
+from app import main, scheduler
+from app.scheduler import END, START, ScheduleEngine
+
+from conftest import add_device
+
+MON = datetime(2026, 10, 19)   # a Monday
+
+
+class Clock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def row(sid, start, end, days=("Mon",), device_id="d"):
+    return SimpleNamespace(id=sid, device_id=device_id, start_time=start, end_time=end,
+                           days_mask=scheduler.days_to_mask(days), send_email_reminder=False)
+
+
+def test_masks_round_trip():
+    assert scheduler.days_to_mask(["Mon", "Wed"]) == 0b101
+    assert scheduler.mask_to_days(0b101) == ["Mon", "Wed"]
+    assert scheduler.shift_mask(scheduler.DAY_BITS["Sun"]) == scheduler.DAY_BITS["Mon"]
+
+
+def test_next_fire_skips_other_days():
+    mask = scheduler.days_to_mask(["Wed"])
+    assert scheduler.next_fire(MON, time(8), mask) == datetime(2026, 10, 21, 8)
+    assert scheduler.next_fire(MON, time(8), 0) is None
+
+
+def test_tick_fires_edges_in_order_and_rearms():
+    clock = Clock(MON)
+    fired = []
+    engine = ScheduleEngine(on_fire=fired.append, clock=clock)
+    engine.upsert(1, "d", time(8), time(10), scheduler.days_to_mask(["Mon"]))
+    assert engine.tick(MON + timedelta(hours=7)) == []
+    engine.tick(MON + timedelta(hours=11))
+    assert [(e.edge, e.fire_at) for e in fired] == [
+        (START, MON + timedelta(hours=8)), (END, MON + timedelta(hours=10)),
+    ]
+    assert engine.next_fire_at() == MON + timedelta(days=7, hours=8)
+
+
+def test_overnight_window_ends_next_day():
+    engine = ScheduleEngine(clock=Clock(MON))
+    engine.upsert(1, "d", time(22), time(6), scheduler.days_to_mask(["Mon"]))
+    fired = engine.tick(MON + timedelta(days=1, hours=7))
+    assert [(e.edge, e.fire_at) for e in fired] == [
+        (START, MON + timedelta(hours=22)), (END, MON + timedelta(days=1, hours=6)),
+    ]
+
+
+def test_edit_and_remove_make_old_edges_stale():
+    engine = ScheduleEngine(clock=Clock(MON))
+    engine.upsert(1, "d", time(8), time(10), scheduler.days_to_mask(["Mon"]))
+    engine.upsert(1, "d", time(9), time(10), scheduler.days_to_mask(["Mon"]))
+    engine.upsert(2, "d", time(8), time(10), scheduler.days_to_mask(["Mon"]))
+    engine.remove(2)
+    fired = engine.tick(MON + timedelta(hours=9, minutes=30))
+    assert [(e.schedule_id, e.fire_at.hour) for e in fired] == [(1, 9)]
+
+
+def test_replace_device_arms_edits_from_the_change():
+    clock = Clock(MON + timedelta(hours=7))
+    engine = ScheduleEngine(clock=clock)
+    engine.load([row(1, time(8), time(12)), row(2, time(9), time(12))])
+    # Edited elsewhere at 8:30 to start at 8:45; the poll only runs at 9:05
+    clock.now = MON + timedelta(hours=9, minutes=5)
+    engine.replace_device("d", [row(1, time(8, 45), time(12))],
+                          after=MON + timedelta(hours=8, minutes=30))
+    fired = engine.tick()
+    assert [(e.schedule_id, e.edge, e.fire_at.time()) for e in fired] == [(1, START, time(8, 45))]
+    assert len(engine) == 1
+
+
+def test_replace_device_keeps_unchanged_schedules_armed():
+    clock = Clock(MON + timedelta(hours=7))
+    engine = ScheduleEngine(clock=clock)
+    engine.load([row(1, time(8), time(12))])
+    clock.now = MON + timedelta(hours=8, minutes=1)
+    # A replayed change: unchanged rows are left alone, so the 8:00 edge
+    # that is due but not yet ticked still fires
+    engine.replace_device("d", [row(1, time(8), time(12))], after=clock.now)
+    assert [e.edge for e in engine.tick()] == [START]
+
+
+def test_feed_reports_schedules_changed_on_any_worker(client, user, house):
+    did = add_device(client, user, house)
+    since = datetime.now() - timedelta(seconds=1)
+    r = client.post("/schedules", headers=user, json={
+        "device_id": did, "start_time": "08:00", "end_time": "10:00", "days": ["Mon"],
+    })
+    assert r.status_code == 200, r.text
+    changes = {d: (at, rows) for d, at, rows in main.schedule_changes(since)}
+    at, rows = changes[did]
+    assert [s.id for s in rows] == [r.json()["id"]]
+    assert abs((at - datetime.now()).total_seconds()) < 60
+
+    client.delete(f"/schedules/{r.json()['id']}", headers=user)
+    changes = {d: rows for d, _, rows in main.schedule_changes(since)}
+    assert changes[did] == []
@@ -0,0 +1,44 @@
+from app import scheduler
+
+from conftest import add_device, register
+
+WINDOW = {"start_time": "08:00", "end_time": "10:00", "days": ["Mon", "Wed"]}
+
+
+def make_schedule(client, headers, device_id):
+    r = client.post("/schedules", headers=headers, json={"device_id": device_id, **WINDOW})
+    assert r.status_code == 200, r.text
+    return r.json()
+
+
+def test_schedule_round_trips_days_and_arms_the_engine(client, user, house):
+    did = add_device(client, user, house)
+    s = make_schedule(client, user, did)
+    assert s["days"] == ["Mon", "Wed"]
+    entry = scheduler.SCHEDULER._entries[s["id"]]
+    assert entry.days_mask == scheduler.days_to_mask(["Mon", "Wed"])
+
+    r = client.put(f"/schedules/{s['id']}", headers=user,
+                   json={"start_time": "22:00", "end_time": "06:00", "days": ["Sun"]})
+    assert r.status_code == 200
+    assert client.get(f"/devices/{did}/schedules", headers=user).json()[0]["days"] == ["Sun"]
+    assert scheduler.SCHEDULER._entries[s["id"]].days_mask == scheduler.DAY_BITS["Sun"]
+
+
+def test_other_users_cannot_edit_or_delete_a_schedule(client, user, house):
+    did = add_device(client, user, house)
+    s = make_schedule(client, user, did)
+    intruder = register(client)
+
+    assert client.put(f"/schedules/{s['id']}", headers=intruder, json=WINDOW).status_code == 404
+    assert client.delete(f"/schedules/{s['id']}", headers=intruder).status_code == 404
+    assert len(client.get(f"/devices/{did}/schedules", headers=user).json()) == 1
+
+
+def test_deleting_a_missing_schedule_is_404(client, user, house):
+    did = add_device(client, user, house)
+    s = make_schedule(client, user, did)
+    assert client.delete(f"/schedules/{s['id']}", headers=user).status_code == 200
+    assert s["id"] not in scheduler.SCHEDULER._entries
+    assert client.delete(f"/schedules/{s['id']}", headers=user).status_code == 404
+    assert client.put(f"/schedules/{s['id']}", headers=user, json=WINDOW).status_code == 404
@@ -0,0 +1,21 @@
+from datetime import datetime
+
+from app import sketches
+
+
+def test_forget_drops_deltas_of_an_inflight_flush(monkeypatch):
+    store = sketches.SketchStore()
+    first, second = object(), object()
+    ts = datetime(2025, 7, 15, 12)
+    store.record(first, [("a", ts, 10.0)])
+    store.record(second, [("b", ts, 20.0)])
+
+    written = []
+    def write(eng, items):
+        written.extend(did for did, _, _ in items)
+        store.forget("b")    # deleted while the flush is running
+    monkeypatch.setattr(sketches, "_write", write)
+
+    assert store.flush() == 1
+    assert written == ["a"]
+    assert store.flush() == 0